@@ -0,0 +1,143 @@
+"""
+Benchmark of the product page extraction.
+
+Compares the per-row Selector queries the spider used before with the
+precompiled single-pass extractor in chemicals.extractors, and checks that
+both return the same data.
+
+Usage (from the chemicals/ folder):
+    python benchmarks/extraction.py [--packs 5] [--number 2000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+from scrapy.http import HtmlResponse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from chemicals.extractors import extract_product  # noqa: E402
+
+PAGE = """<html><body><table>
+<tr><td>Catalog #</td><td><span id="Catalog">{catalog}</span></td></tr>
+<tr><td>Compound Name</td><td> Benchmark compound </td></tr>
+<tr><td>CAS No</td><td>71884-56-5</td></tr>
+<tr><td>Price ($)</td><td>Size</td></tr>
+{rows}
+</table></body></html>"""
+
+ROW = """<tr><td><span id="su{n}">{qt}/g</span></td>
+<td><input id="UnitPrice{n}" value="{price}"/></td>
+<td><span>Please enter Qty to check availability</span></td></tr>"""
+
+
+def build_response(packs):
+    """
+    Builds a product page with the given number of packs.
+
+    Args:
+        packs: Number of pack rows on the page.
+
+    Returns:
+        An HtmlResponse of the page.
+    """
+    rows = "\n".join(
+        ROW.format(n=n, qt=n * 5, price=n * 40) for n in range(1, packs + 1)
+    )
+    body = PAGE.format(catalog="A12345", rows=rows)
+    return HtmlResponse(
+        "https://www.astatechinc.com/product.php", body=body, encoding="utf-8"
+    )
+
+
+def legacy_extract(response):
+    """
+    Extracts the product data with the queries parse_chemical used to run.
+
+    Args:
+        response: The response object.
+
+    Returns:
+        A dict in the same format as extract_product.
+    """
+    numcas = response.xpath(
+        '//td[contains(text(), "CAS")]/following-sibling::td[1]/text()'
+    ).get()
+    if not numcas:
+        return None
+
+    sizes = []
+    all_units = response.xpath(
+        '//tr[.//span[contains(text(), "Please enter Qty to check availability")]]'
+    )
+    for n, unit in enumerate(all_units, start=1):
+        response.css("#Catalog::text").get()
+        sizes.append(unit.css(f"#su{n}::text").get())
+
+    packs = []
+    currency = None
+    tr_tags = response.xpath(
+        '//tr[.//span[contains(text(), "Please enter Qty to check availability")]]'
+    )
+    for n, _ in enumerate(tr_tags, start=1):
+        size = response.xpath(f'//span[@id="su{n}"]/text()').get()
+        qt_and_unit = size.split("/")
+        currency = (
+            response.xpath('//td[contains(text(), "Price")]/text()')
+            .get()
+            .split("(")[-1]
+            .replace(")", "")
+        )
+        price = response.xpath(f'//input[@id="UnitPrice{n}"]/@value').get()
+        packs.append(
+            {
+                "number": n,
+                "size": sizes[n - 1],
+                "qt": qt_and_unit[0],
+                "unit": qt_and_unit[1],
+                "price": price,
+            }
+        )
+
+    return {
+        "catalog": response.css("#Catalog::text").get(),
+        "numcas": numcas,
+        "name": response.xpath(
+            '//td[contains(text(), "Compound")]/following-sibling::td[1]/text()'
+        )
+        .get()
+        .strip(),
+        "currency": currency,
+        "packs": packs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--packs", type=int, default=5)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    response = build_response(args.packs)
+    # Parse the document once so both variants measure extraction only.
+    response.selector
+
+    assert legacy_extract(response) == extract_product(response)
+
+    legacy = timeit.timeit(lambda: legacy_extract(response), number=args.number)
+    compiled = timeit.timeit(lambda: extract_product(response), number=args.number)
+
+    legacy_us = legacy / args.number * 1e6
+    compiled_us = compiled / args.number * 1e6
+    print(f"packs per page:      {args.packs}")
+    print(f"legacy extraction:   {legacy_us:8.1f} us/page")
+    print(f"compiled extraction: {compiled_us:8.1f} us/page")
+    print(
+        f"CPU saved:           {legacy_us - compiled_us:8.1f} us/page "
+        f"({legacy / compiled:.1f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    main()
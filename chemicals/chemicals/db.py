@@ -0,0 +1,570 @@
+"""
+PostgreSQL helpers shared by the pipelines and spiders.
+
+The tables are owned by the Django project in scrapy_api, see
+scrapy_app/models.py.
+"""
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import Json, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+from chemicals.settings import (
+    DB_HOST,
+    DB_PORT,
+    DB_NAME,
+    DB_USER,
+    DB_PASSWORD,
+)
+
+# Tables storing every generation of a company's rows in its own partition.
+GENERATION_TABLES = ("scrapy_app_chemicals", "scrapy_app_pack")
+
+# Columns of a product row copied into a new generation.
+COPIED_COLUMNS = (
+    "datetime, availability, company_name, product_url, numcas, name, qt_list, "
+    "unit_list, currency_list, price_pack_list, content_hash, availability_stale, "
+    "next_due_at"
+)
+
+# Columns of a pack copied into a new generation.
+COPIED_PACK_COLUMNS = (
+    "numcas, quantity, unit, unit_family, currency, price, price_per_unit"
+)
+
+# Condition matching the rows of a company's active generation, and its rows
+# without a generation. Takes the company name as parameter.
+CURRENT_ROWS = (
+    "crawl_run_id IS NOT DISTINCT FROM ("
+    "SELECT max(id) FROM scrapy_app_crawlrun WHERE company_name = %s "
+    "AND kind = 'full' AND status = 'finished')"
+)
+
+
+def connect():
+    """
+    Opens a connection to the PostgreSQL database.
+
+    Returns:
+        A psycopg2 connection.
+    """
+    return psycopg2.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+    )
+
+
+def connection_pool(maxconn):
+    """
+    Opens a pool of connections that can be shared between threads.
+
+    Args:
+        maxconn (int): Maximum number of connections in the pool.
+
+    Returns:
+        A psycopg2 ThreadedConnectionPool.
+    """
+    return ThreadedConnectionPool(
+        1,
+        maxconn,
+        host=DB_HOST,
+        port=DB_PORT,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+    )
+
+
+def load_redirect_links(conn, company_name):
+    """
+    Loads the resolved product URLs of a company's catalog links.
+
+    Args:
+        conn: The database connection.
+        company_name (str): Name of the company.
+
+    Returns:
+        A dict mapping catalog URLs to product URLs.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT catalog_url, product_url FROM scrapy_app_redirectlink "
+            "WHERE company_name = %s",
+            (company_name,),
+        )
+        links = dict(cursor.fetchall())
+    conn.commit()
+    return links
+
+
+def save_redirect_links(conn, company_name, links):
+    """
+    Stores resolved catalog links, replacing the product URL of known ones.
+
+    Args:
+        conn: The database connection.
+        company_name (str): Name of the company.
+        links (dict): Catalog URLs mapped to product URLs.
+    """
+    with conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            "INSERT INTO scrapy_app_redirectlink "
+            "(company_name, catalog_url, product_url, datetime) VALUES %s "
+            "ON CONFLICT (catalog_url) DO UPDATE SET "
+            "product_url = EXCLUDED.product_url, datetime = EXCLUDED.datetime",
+            [
+                (company_name, catalog_url, product_url)
+                for catalog_url, product_url in links.items()
+            ],
+            template="(%s, %s, %s, now())",
+        )
+    conn.commit()
+
+
+def delete_redirect_link(conn, catalog_url):
+    """
+    Forgets the product URL of a catalog link.
+
+    Args:
+        conn: The database connection.
+        catalog_url (str): The catalog link.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM scrapy_app_redirectlink WHERE catalog_url = %s",
+            (catalog_url,),
+        )
+    conn.commit()
+
+
+def start_crawl_run(
+    conn, company_name, crawl_run_id=None, kind="full", discovery=True, product_urls=()
+):
+    """
+    Marks a crawl run as running, creating it if it wasn't created by the API.
+
+    A full crawl run also gets the partitions its generation is written to.
+
+    Args:
+        conn: The database connection.
+        company_name (str): Name of the crawled company.
+        crawl_run_id (int): Id of the crawl run, or None to create one.
+        kind (str): "full" for a crawl of the whole catalog, "refresh" for a
+            crawl of some products. Only used when creating the crawl run.
+        discovery (bool): Whether the crawl walks the catalog to find products.
+        product_urls (list): The product pages a targeted refresh fetches. Only
+            used when creating the crawl run.
+
+    Returns:
+        The id of the crawl run.
+    """
+    spider_args = {"product_urls": " ".join(product_urls)} if product_urls else {}
+    with conn.cursor() as cursor:
+        if crawl_run_id is None:
+            cursor.execute(
+                "INSERT INTO scrapy_app_crawlrun "
+                "(company_name, kind, discovery, status, scheduled_at, started_at, "
+                "job_id, spider_args) "
+                "VALUES (%s, %s, %s, 'running', now(), now(), '', %s) RETURNING id",
+                (company_name, kind, discovery, Json(spider_args)),
+            )
+            crawl_run_id = cursor.fetchone()[0]
+        else:
+            cursor.execute(
+                "UPDATE scrapy_app_crawlrun SET status = 'running', discovery = %s "
+                "WHERE id = %s RETURNING kind",
+                (discovery, crawl_run_id),
+            )
+            (kind,) = cursor.fetchone()
+        if kind == "full":
+            create_generation(cursor, crawl_run_id)
+    conn.commit()
+    return crawl_run_id
+
+
+def create_generation(cursor, crawl_run_id):
+    """
+    Creates the partitions of a full crawl run's generation, without committing.
+
+    A resumed crawl run keeps the partitions it already has.
+
+    Args:
+        cursor: A cursor of the caller's transaction.
+        crawl_run_id (int): Id of the full crawl run.
+    """
+    for table in GENERATION_TABLES:
+        cursor.execute(
+            sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES IN ({})"
+            ).format(
+                sql.Identifier(f"{table}_{crawl_run_id}"),
+                sql.Identifier(table),
+                sql.Literal(crawl_run_id),
+            )
+        )
+
+
+def get_active_generation(cursor, company_name):
+    """
+    Returns the active generation of a company, without committing.
+
+    Args:
+        cursor: A cursor of the caller's transaction.
+        company_name (str): Name of the company.
+
+    Returns:
+        The id of the company's latest finished full crawl run, or None if it
+        was never fully crawled.
+    """
+    cursor.execute(
+        "SELECT max(id) FROM scrapy_app_crawlrun WHERE company_name = %s "
+        "AND kind = 'full' AND status = 'finished'",
+        (company_name,),
+    )
+    return cursor.fetchone()[0]
+
+
+def generation_filter(crawl_run_id, column="crawl_run_id"):
+    """
+    Builds the condition matching the rows of one generation.
+
+    Comparing with a constant lets PostgreSQL only scan the generation's
+    partition.
+
+    Args:
+        crawl_run_id (int): Id of the generation's full crawl run, or None for
+            the rows without a generation.
+        column (str): The compared column, qualified if needed.
+
+    Returns:
+        A tuple of the SQL condition and its parameters.
+    """
+    if crawl_run_id is None:
+        return f"{column} IS NULL", ()
+    return f"{column} = %s", (crawl_run_id,)
+
+
+def last_discovery(conn, company_name):
+    """
+    Returns when the last finished crawl that walked the catalog ended.
+
+    Args:
+        conn: The database connection.
+        company_name (str): Name of the company.
+
+    Returns:
+        The datetime, or None if the catalog was never walked.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT max(finished_at) FROM scrapy_app_crawlrun "
+            "WHERE company_name = %s AND kind = 'full' AND discovery "
+            "AND status = 'finished'",
+            (company_name,),
+        )
+        (finished_at,) = cursor.fetchone()
+    conn.commit()
+    return finished_at
+
+
+def load_product_urls(conn, company_name):
+    """
+    Loads the product pages of a company's active generation.
+
+    Args:
+        conn: The database connection.
+        company_name (str): Name of the company.
+
+    Returns:
+        A list of product URLs.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT product_url FROM scrapy_app_chemicals WHERE company_name = %s "
+            f"AND {CURRENT_ROWS} ORDER BY id",
+            (company_name, company_name),
+        )
+        urls = [url for (url,) in cursor.fetchall()]
+    conn.commit()
+    return urls
+
+
+def load_availability(conn, company_name):
+    """
+    Loads the availability of the products of a company's active generation.
+
+    Args:
+        conn: The database connection.
+        company_name (str): Name of the company.
+
+    Returns:
+        A dict mapping product URLs to their availability.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT product_url, availability FROM scrapy_app_chemicals "
+            f"WHERE company_name = %s AND {CURRENT_ROWS}",
+            (company_name, company_name),
+        )
+        availability = dict(cursor.fetchall())
+    conn.commit()
+    return availability
+
+
+def plan_recrawl(conn, company_name, min_interval, max_interval):
+    """
+    Gives every product of a company's active generation the time it is next
+    due for a recrawl.
+
+    A product's change interval is estimated from its history rows, one per
+    change of its price or availability data: the time between its first
+    snapshot and its last crawl, divided by the number of snapshots. Products
+    that never changed are estimated to change right after their last crawl,
+    so their interval keeps growing with every crawl that sees them unchanged.
+
+    Args:
+        conn: The database connection.
+        company_name (str): Name of the company.
+        min_interval (timedelta): Shortest recrawl interval.
+        max_interval (timedelta): Longest recrawl interval.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "UPDATE scrapy_app_chemicals c SET next_due_at = c.datetime + "
+            "LEAST(GREATEST(COALESCE(("
+            "SELECT (c.datetime - min(h.datetime)) / count(*) "
+            "FROM scrapy_app_chemicalshistory h "
+            "WHERE h.company_name = c.company_name "
+            "AND h.product_url = c.product_url), interval '0'), %s), %s) "
+            f"WHERE c.company_name = %s AND {CURRENT_ROWS}",
+            (min_interval, max_interval, company_name, company_name),
+        )
+    conn.commit()
+
+
+def load_due_product_urls(conn, company_name, budget):
+    """
+    Loads the product pages that are due for a recrawl, most overdue first.
+
+    Args:
+        conn: The database connection.
+        company_name (str): Name of the company.
+        budget (int): Maximum number of product pages.
+
+    Returns:
+        A list of product URLs.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT product_url FROM scrapy_app_chemicals "
+            f"WHERE company_name = %s AND {CURRENT_ROWS} "
+            "AND (next_due_at IS NULL OR next_due_at <= now()) "
+            "ORDER BY next_due_at NULLS FIRST, id LIMIT %s",
+            (company_name, company_name, budget),
+        )
+        urls = [url for (url,) in cursor.fetchall()]
+    conn.commit()
+    return urls
+
+
+def keep_products(conn, crawl_run_id, company_name, product_urls):
+    """
+    Copies the rows of products that weren't crawled again, and their packs,
+    from the active generation into a crawl run's generation.
+
+    Used for product pages skipped because they were crawled recently, so they
+    are still part of the new generation once the run finishes.
+
+    Args:
+        conn: The database connection.
+        crawl_run_id (int): Id of the full crawl run.
+        company_name (str): Name of the crawled company.
+        product_urls (list): URLs of the skipped product pages.
+
+    Returns:
+        The number of copied rows.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "WITH source AS ("
+            "SELECT * FROM scrapy_app_chemicals "
+            f"WHERE company_name = %s AND product_url = ANY(%s) AND {CURRENT_ROWS}), "
+            "kept AS ("
+            f"INSERT INTO scrapy_app_chemicals ({COPIED_COLUMNS}, crawl_run_id) "
+            f"SELECT {COPIED_COLUMNS}, %s FROM source "
+            "ON CONFLICT (crawl_run_id, company_name, product_url) DO NOTHING "
+            "RETURNING id, product_url), "
+            "packs AS ("
+            "INSERT INTO scrapy_app_pack (chemical_id, crawl_run_id, "
+            f"{COPIED_PACK_COLUMNS}) "
+            "SELECT kept.id, %s, "
+            + ", ".join(f"p.{column}" for column in COPIED_PACK_COLUMNS.split(", "))
+            + " FROM kept JOIN source USING (product_url) "
+            "JOIN scrapy_app_pack p ON p.chemical_id = source.id) "
+            "SELECT count(*) FROM kept",
+            (
+                company_name,
+                list(product_urls),
+                company_name,
+                crawl_run_id,
+                crawl_run_id,
+            ),
+        )
+        (kept,) = cursor.fetchone()
+    conn.commit()
+    return kept
+
+
+def finish_crawl_run(conn, crawl_run_id, company_name, finished):
+    """
+    Ends a crawl run and, if a full crawl finished, makes its generation the
+    active one.
+
+    Marking the run as finished switches the API over to the new generation in
+    one commit, together with the price aggregates of the CAS numbers of both
+    generations. The partitions of the older generations are dropped
+    afterwards, and rows that were stored without a partition of their own,
+    before generations were partitioned, are deleted. Refresh runs only
+    re-crawl some products of the active generation, so they never retire rows.
+
+    Args:
+        conn: The database connection.
+        crawl_run_id (int): Id of the crawl run.
+        company_name (str): Name of the crawled company.
+        finished (bool): Whether the crawl finished successfully.
+
+    Returns:
+        The number of products of the previous generation that the new one
+        doesn't have anymore.
+    """
+    with conn.cursor() as cursor:
+        previous = get_active_generation(cursor, company_name)
+        cursor.execute(
+            "UPDATE scrapy_app_crawlrun SET status = %s, finished_at = now() "
+            "WHERE id = %s RETURNING kind",
+            ("finished" if finished else "failed", crawl_run_id),
+        )
+        (kind,) = cursor.fetchone()
+        if not finished or kind != "full":
+            conn.commit()
+            return 0
+
+        condition, params = generation_filter(previous, "o.crawl_run_id")
+        cursor.execute(
+            "SELECT count(*) FROM scrapy_app_chemicals o "
+            f"WHERE o.company_name = %s AND (o.crawl_run_id IS NULL OR {condition}) "
+            "AND NOT EXISTS (SELECT 1 FROM scrapy_app_chemicals n "
+            "WHERE n.crawl_run_id = %s AND n.company_name = o.company_name "
+            "AND n.product_url = o.product_url)",
+            (company_name, *params, crawl_run_id),
+        )
+        (retired,) = cursor.fetchone()
+        cursor.execute(
+            "SELECT DISTINCT numcas FROM scrapy_app_chemicals "
+            "WHERE company_name = %s "
+            "AND (crawl_run_id IS NULL OR crawl_run_id = ANY(%s))",
+            (company_name, [crawl_run_id] + ([previous] if previous else [])),
+        )
+        refresh_price_aggregates(cursor, [numcas for (numcas,) in cursor.fetchall()])
+    conn.commit()
+
+    with conn.cursor() as cursor:
+        drop_generations(cursor, company_name, crawl_run_id)
+    conn.commit()
+    return retired
+
+
+def drop_generations(cursor, company_name, crawl_run_id):
+    """
+    Drops the generations of a company older than a crawl run, without
+    committing.
+
+    Dropping a partition is cheap no matter how many rows it has. Only rows
+    stored in the default partitions are deleted one by one.
+
+    Args:
+        cursor: A cursor of the caller's transaction.
+        company_name (str): Name of the company.
+        crawl_run_id (int): Id of the full crawl run whose generation is kept.
+    """
+    cursor.execute(
+        "SELECT id FROM scrapy_app_crawlrun WHERE company_name = %s "
+        "AND kind = 'full' AND id < %s "
+        "AND to_regclass('scrapy_app_chemicals_' || id) IS NOT NULL",
+        (company_name, crawl_run_id),
+    )
+    for (old_run_id,) in cursor.fetchall():
+        cursor.execute(
+            sql.SQL("DROP TABLE IF EXISTS {}").format(
+                sql.SQL(", ").join(
+                    sql.Identifier(f"{table}_{old_run_id}")
+                    for table in GENERATION_TABLES
+                )
+            )
+        )
+    cursor.execute(
+        "DELETE FROM scrapy_app_pack_default WHERE chemical_id IN ("
+        "SELECT id FROM scrapy_app_chemicals_default WHERE company_name = %s "
+        "AND (crawl_run_id IS NULL OR crawl_run_id < %s))",
+        (company_name, crawl_run_id),
+    )
+    cursor.execute(
+        "DELETE FROM scrapy_app_chemicals_default WHERE company_name = %s "
+        "AND (crawl_run_id IS NULL OR crawl_run_id < %s)",
+        (company_name, crawl_run_id),
+    )
+
+
+def refresh_price_aggregates(cursor, numcas_list):
+    """
+    Recomputes the price aggregates of some CAS numbers, without committing.
+
+    Only packs of the rows the API shows are aggregated, i.e. rows of the active
+    generation of their company. Readers keep seeing the old aggregates until the
+    caller's transaction commits.
+
+    Concurrent writers of the same CAS numbers are serialized with transaction
+    level advisory locks, taken in sorted order so they can't deadlock. The
+    aggregates are upserted and only the groups without packs anymore are
+    deleted.
+
+    Args:
+        cursor: A cursor of the caller's transaction.
+        numcas_list (list): CAS numbers whose packs changed.
+    """
+    numcas_list = sorted({numcas for numcas in numcas_list if numcas})
+    if not numcas_list:
+        return
+    cursor.execute(
+        "SELECT pg_advisory_xact_lock(h) FROM ("
+        "SELECT DISTINCT hashtext(n) AS h FROM unnest(%s::text[]) AS n ORDER BY h"
+        ") AS locks",
+        (numcas_list,),
+    )
+    cursor.execute(
+        "WITH fresh AS ("
+        "INSERT INTO scrapy_app_priceaggregate (numcas, unit_family, currency, "
+        "average_price, min_price, max_price, sample_count, updated_at) "
+        "SELECT p.numcas, p.unit_family, p.currency, avg(p.price_per_unit), "
+        "min(p.price_per_unit), max(p.price_per_unit), count(*), now() "
+        "FROM scrapy_app_pack p "
+        "JOIN scrapy_app_chemicals c ON c.id = p.chemical_id "
+        "WHERE p.numcas = ANY(%s) AND p.price_per_unit IS NOT NULL "
+        "AND c.crawl_run_id IS NOT DISTINCT FROM ("
+        "SELECT max(r.id) FROM scrapy_app_crawlrun r "
+        "WHERE r.company_name = c.company_name AND r.kind = 'full' "
+        "AND r.status = 'finished') "
+        "GROUP BY p.numcas, p.unit_family, p.currency "
+        "ON CONFLICT (numcas, unit_family, currency) DO UPDATE SET "
+        "average_price = EXCLUDED.average_price, min_price = EXCLUDED.min_price, "
+        "max_price = EXCLUDED.max_price, sample_count = EXCLUDED.sample_count, "
+        "updated_at = EXCLUDED.updated_at "
+        "RETURNING id) "
+        "DELETE FROM scrapy_app_priceaggregate "
+        "WHERE numcas = ANY(%s) AND id NOT IN (SELECT id FROM fresh)",
+        (numcas_list, numcas_list),
+    )
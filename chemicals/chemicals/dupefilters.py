@@ -0,0 +1,198 @@
+"""
+Request dupefilter remembering the pages fetched by previous crawls.
+
+Scrapy's dupefilter only knows the requests of the current crawl. This one
+also keeps the fingerprint of every page whose item the pipeline wrote in a
+SQLite file, with the time it was written, and skips the pages fetched again
+within their freshness window. The window depends on the URL: DUPEFILTER_TTLS maps
+URL patterns to a number of seconds, the first matching pattern wins, and a
+window of 0 means the page is always fetched. URLs matching no pattern use
+DUPEFILTER_DEFAULT_TTL.
+"""
+import re
+import sqlite3
+import time
+
+from scrapy import signals
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+
+from chemicals.signals import items_written
+
+
+class PersistentDupeFilter(RFPDupeFilter):
+    """
+    RFPDupeFilter backed by a SQLite store of the pages fetched by previous
+    crawls.
+
+    Requests skipped because their page is still fresh are marked with the
+    ``dupefilter_fresh`` meta key, so the request_dropped signal handlers can
+    tell them from the duplicates of the current crawl.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        debug=False,
+        *,
+        fingerprinter=None,
+        store_path="dupefilter.sqlite",
+        ttls=(),
+        default_ttl=0,
+        batch_size=100,
+        stats=None,
+    ):
+        super().__init__(path, debug, fingerprinter=fingerprinter)
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        self.default_ttl = default_ttl
+        self.batch_size = batch_size
+        self.stats = stats
+        # Fingerprints of the fetched pages whose item isn't written yet, by URL.
+        self.pending = {}
+        self.fetched = []
+
+        self.store = sqlite3.connect(store_path)
+        self.store.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints "
+            "(fingerprint TEXT PRIMARY KEY, fetched_at REAL NOT NULL)"
+        )
+        max_ttl = max([default_ttl] + [ttl for _, ttl in self.ttls])
+        self.store.execute(
+            "DELETE FROM fingerprints WHERE fetched_at < ?", (time.time() - max_ttl,)
+        )
+        self.store.commit()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        dupefilter = cls(
+            job_dir(settings),
+            settings.getbool("DUPEFILTER_DEBUG"),
+            fingerprinter=crawler.request_fingerprinter,
+            store_path=settings.get("DUPEFILTER_PATH", "dupefilter.sqlite"),
+            ttls=settings.getlist("DUPEFILTER_TTLS"),
+            default_ttl=settings.getint("DUPEFILTER_DEFAULT_TTL"),
+            stats=crawler.stats,
+        )
+        crawler.signals.connect(
+            dupefilter.response_received, signal=signals.response_received
+        )
+        crawler.signals.connect(dupefilter.items_written, signal=items_written)
+        return dupefilter
+
+    def get_ttl(self, url):
+        """
+        Returns the freshness window of a URL.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            The window in seconds, 0 if the page must always be fetched.
+        """
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def request_seen(self, request):
+        """
+        Checks whether a request was seen in this crawl or fetched recently.
+
+        Args:
+            request (scrapy.Request): The request.
+
+        Returns:
+            True if the request must be dropped.
+        """
+        fp = self.request_fingerprint(request)
+        if fp in self.fingerprints:
+            return True
+
+        ttl = self.get_ttl(request.url)
+        if ttl > 0 and self.is_fresh(fp, ttl):
+            self.fingerprints.add(fp)
+            request.meta["dupefilter_fresh"] = True
+            return True
+        return super().request_seen(request)
+
+    def is_fresh(self, fp, ttl):
+        """
+        Checks whether a page was fetched within its freshness window.
+
+        Args:
+            fp (str): The request fingerprint.
+            ttl (int): The freshness window in seconds.
+
+        Returns:
+            True if the page was fetched less than `ttl` seconds ago.
+        """
+        row = self.store.execute(
+            "SELECT fetched_at FROM fingerprints WHERE fingerprint = ?", (fp,)
+        ).fetchone()
+        return row is not None and row[0] > time.time() - ttl
+
+    def response_received(self, response, request, spider):
+        """
+        Remembers the pages fetched successfully until their item is written.
+
+        Args:
+            response (scrapy.http.Response): The response.
+            request (scrapy.Request): The request of the response.
+            spider (scrapy.Spider): The Spider instance.
+        """
+        if response.status != 200 or self.get_ttl(request.url) <= 0:
+            return
+        self.pending[response.url] = self.request_fingerprint(request)
+
+    def items_written(self, product_urls, spider):
+        """
+        Records the pages whose item the pipeline wrote, in batches of
+        `batch_size`.
+
+        A page whose item was dropped or failed to be written is never recorded,
+        so the next crawl fetches it again.
+
+        Args:
+            product_urls (list): The product pages of the written items.
+            spider (scrapy.Spider): The Spider instance.
+        """
+        now = time.time()
+        for url in product_urls:
+            fp = self.pending.pop(url, None)
+            if fp is not None:
+                self.fetched.append((fp, now))
+        if len(self.fetched) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the recorded pages to the store.
+        """
+        if not self.fetched:
+            return
+        self.store.executemany(
+            "INSERT OR REPLACE INTO fingerprints (fingerprint, fetched_at) "
+            "VALUES (?, ?)",
+            self.fetched,
+        )
+        self.store.commit()
+        self.fetched = []
+
+    def close(self, reason):
+        self.flush()
+        self.store.close()
+        super().close(reason)
+
+    def log(self, request, spider):
+        if not request.meta.get("dupefilter_fresh"):
+            super().log(request, spider)
+            return
+        if self.debug:
+            self.logger.debug(
+                "Skipped fresh request: %(request)s",
+                {"request": request},
+                extra={"spider": spider},
+            )
+        if self.stats:
+            self.stats.inc_value("dupefilter/fresh", spider=spider)
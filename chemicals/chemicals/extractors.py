@@ -0,0 +1,87 @@
+"""
+Precompiled extractors for AstaTech product pages.
+
+The XPath expressions are compiled once at import time, and the pack table is
+read in a single walk instead of querying the whole document for every pack.
+"""
+from lxml import etree
+
+PACK_ROWS = etree.XPath(
+    '//tr[.//span[contains(text(), "Please enter Qty to check availability")]]'
+)
+PACK_FIELDS = etree.XPath(
+    '//span[starts-with(@id, "su")] | //input[starts-with(@id, "UnitPrice")]'
+)
+CATALOG = etree.XPath('//*[@id="Catalog"]/text()', smart_strings=False)
+NUMCAS = etree.XPath(
+    '//td[contains(text(), "CAS")]/following-sibling::td[1]/text()',
+    smart_strings=False,
+)
+NAME = etree.XPath(
+    '//td[contains(text(), "Compound")]/following-sibling::td[1]/text()',
+    smart_strings=False,
+)
+PRICE_HEADER = etree.XPath(
+    '//td[contains(text(), "Price")]/text()', smart_strings=False
+)
+
+
+def first(values):
+    """
+    Returns the first extracted value, like Selector.get().
+
+    Args:
+        values: List returned by a compiled XPath.
+
+    Returns:
+        The first value or None.
+    """
+    return values[0] if values else None
+
+
+def extract_product(response):
+    """
+    Extracts catalog, CAS number, name, currency and all packs of a product page.
+
+    Args:
+        response: The response object of a product page.
+
+    Returns:
+        A dict with the extracted data, or None if the page has no CAS number.
+        Every pack is a dict with its number, size, qt, unit and price.
+    """
+    root = response.selector.root
+
+    numcas = first(NUMCAS(root))
+    if not numcas:
+        return None
+
+    rows = PACK_ROWS(root)
+    fields = {node.get("id"): node for node in PACK_FIELDS(root)}
+
+    packs = []
+    currency = None
+    if rows:
+        currency = PRICE_HEADER(root)[0].split("(")[-1].replace(")", "")
+    for n in range(1, len(rows) + 1):
+        size = fields[f"su{n}"].text
+        qt_and_unit = size.split("/")
+        price_input = fields.get(f"UnitPrice{n}")
+        packs.append(
+            {
+                "number": n,
+                "size": size,
+                "qt": qt_and_unit[0],
+                "unit": qt_and_unit[1],
+                "price": price_input.get("value") if price_input is not None else None,
+            }
+        )
+
+    name = first(NAME(root))
+    return {
+        "catalog": first(CATALOG(root)),
+        "numcas": numcas,
+        "name": name.strip() if name is not None else None,
+        "currency": currency,
+        "packs": packs,
+    }
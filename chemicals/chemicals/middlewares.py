@@ -3,13 +3,14 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+import random
+import re
+import time
+from collections import deque
+from urllib.parse import urlparse
 
-from chemicals.settings import (
-    PROXY_HOST,
-    PROXY_USERNAME,
-    PROXY_PASSWORD,
-)
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -109,18 +110,333 @@ class ChemicalsDownloaderMiddleware:
         spider.logger.info("Spider opened: %s" % spider.name)
 
 
-class ProxyMiddleware:
-    def __init__(self, host, username, password):
-        self.host = host
-        self.username = username
-        self.password = password
+class Proxy:
+    """
+    One endpoint of the proxy pool and its recent results.
+    """
+
+    def __init__(self, url, window):
+        """
+        Args:
+            url: The proxy URL, with its credentials.
+            window: Number of recent results the score is computed from.
+        """
+        self.url = url
+        parsed = urlparse(url)
+        self.name = (
+            f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname
+        )
+        self.results = deque(maxlen=window)
+        self.failures = 0
+        self.cooldown_until = 0
+
+    def score(self, default_latency):
+        """
+        Scores the proxy by success rate over average latency.
+
+        Args:
+            default_latency: Latency assumed while the proxy has no successes.
+
+        Returns:
+            The score, higher is better.
+        """
+        successes = [latency for ok, latency in self.results if ok]
+        # Smoothed so that a new proxy still gets some requests.
+        success_rate = (len(successes) + 1) / (len(self.results) + 2)
+        latency = sum(successes) / len(successes) if successes else default_latency
+        return success_rate / max(latency, 0.05)
+
+    def record(self, ok, latency=None):
+        """
+        Records the result of a request sent through the proxy.
+
+        Args:
+            ok: Whether the request succeeded.
+            latency: Download latency of a successful request, in seconds.
+
+        Returns:
+            The number of consecutive failures.
+        """
+        self.results.append((ok, latency))
+        self.failures = 0 if ok else self.failures + 1
+        return self.failures
+
+
+class ProxyPoolMiddleware:
+    """
+    Spreads the requests over a pool of proxies.
+
+    The proxies come from the PROXY_LIST setting, or PROXY_HOST with its
+    credentials if the list is empty. Each request goes through a proxy chosen
+    at random, weighted by its success rate over its average latency in its
+    last PROXY_POOL_WINDOW results. A proxy failing PROXY_POOL_MAX_FAILURES
+    times in a row is left out for PROXY_POOL_COOLDOWN seconds.
+
+    The URL of each proxy is built once, so the requests sent through a proxy
+    share the download handler's pooled connections to it. Selections,
+    failures and cooldowns are counted in the crawler stats under proxy_pool/.
+    """
+
+    def __init__(
+        self,
+        proxy_urls,
+        window=50,
+        cooldown=60,
+        max_failures=3,
+        ban_codes=(),
+        default_latency=1.0,
+        stats=None,
+    ):
+        self.proxies = [Proxy(url, window) for url in proxy_urls]
+        self.proxies_by_name = {proxy.name: proxy for proxy in self.proxies}
+        self.cooldown = cooldown
+        self.max_failures = max_failures
+        self.ban_codes = set(ban_codes)
+        self.default_latency = default_latency
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        proxy_urls = settings.getlist("PROXY_LIST")
+        if not proxy_urls and settings.get("PROXY_HOST"):
+            credentials = ""
+            if settings.get("PROXY_USERNAME"):
+                credentials = "{}:{}@".format(
+                    settings.get("PROXY_USERNAME"), settings.get("PROXY_PASSWORD")
+                )
+            proxy_urls = [credentials + settings.get("PROXY_HOST")]
+        if not proxy_urls:
+            raise NotConfigured("No proxies configured")
+        middleware = cls(
+            [url if "://" in url else f"http://{url}" for url in proxy_urls],
+            window=settings.getint("PROXY_POOL_WINDOW", 50),
+            cooldown=settings.getfloat("PROXY_POOL_COOLDOWN", 60),
+            max_failures=settings.getint("PROXY_POOL_MAX_FAILURES", 3),
+            ban_codes=[int(code) for code in settings.getlist("PROXY_POOL_BAN_CODES")],
+            stats=crawler.stats,
+        )
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def choose(self, spider):
+        """
+        Chooses the proxy of a request.
+
+        Args:
+            spider: The Spider instance.
+
+        Returns:
+            A Proxy, chosen among the ones not cooling down, or the one whose
+            cooldown ends first if they all are.
+        """
+        now = time.monotonic()
+        available = [proxy for proxy in self.proxies if proxy.cooldown_until <= now]
+        if not available:
+            self.inc_stat("proxy_pool/exhausted", spider)
+            return min(self.proxies, key=lambda proxy: proxy.cooldown_until)
+        weights = [proxy.score(self.default_latency) for proxy in available]
+        return random.choices(available, weights=weights)[0]
+
+    def process_request(self, request, spider):
+        proxy = self.choose(spider)
+        request.meta["proxy"] = proxy.url
+        request.meta["proxy_pool"] = proxy.name
+        self.inc_stat(f"proxy_pool/selected/{proxy.name}", spider)
+
+    def process_response(self, request, response, spider):
+        proxy = self.get_proxy(request)
+        if proxy is not None:
+            if response.status in self.ban_codes:
+                self.failed(proxy, spider)
+            else:
+                proxy.record(True, request.meta.get("download_latency"))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        proxy = self.get_proxy(request)
+        if proxy is not None:
+            self.failed(proxy, spider)
+
+    def get_proxy(self, request):
+        """
+        Returns the proxy a request was sent through, or None.
+        """
+        return self.proxies_by_name.get(request.meta.get("proxy_pool"))
+
+    def failed(self, proxy, spider):
+        """
+        Records a failed request and cools the proxy down after too many
+        failures in a row.
+
+        Args:
+            proxy: The Proxy the request was sent through.
+            spider: The Spider instance.
+        """
+        self.inc_stat(f"proxy_pool/failed/{proxy.name}", spider)
+        if proxy.record(False) >= self.max_failures:
+            proxy.failures = 0
+            proxy.cooldown_until = time.monotonic() + self.cooldown
+            self.inc_stat(f"proxy_pool/cooldown/{proxy.name}", spider)
+            spider.logger.warning(
+                "Proxy %s cooling down for %ss", proxy.name, self.cooldown
+            )
+
+    def inc_stat(self, key, spider):
+        if self.stats:
+            self.stats.inc_value(key, spider=spider)
+
+    def spider_closed(self, spider):
+        """
+        Adds the final score of each proxy to the crawler stats.
+        """
+        if self.stats:
+            for proxy in self.proxies:
+                self.stats.set_value(
+                    f"proxy_pool/score/{proxy.name}",
+                    round(proxy.score(self.default_latency), 3),
+                    spider=spider,
+                )
+
+
+class EndpointConcurrency:
+    """
+    Concurrency of one class of URLs, adjusted by AIMD.
+    """
+
+    def __init__(self, name, pattern, start, min, max, target_latency):
+        """
+        Args:
+            name: Name of the class, used as its download slot.
+            pattern: Regular expression matching the URLs of the class.
+            start: Initial concurrency.
+            min: Lowest concurrency.
+            max: Highest concurrency.
+            target_latency: Latency above which the concurrency is decreased,
+                in seconds.
+        """
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.concurrency = float(start)
+        self.min = min
+        self.max = max
+        self.target_latency = target_latency
+        self.last_decrease = 0
+
+    def increase(self):
+        """
+        Adds one request to the concurrency over about one round of requests.
+        """
+        self.concurrency = min(self.max, self.concurrency + 1 / self.concurrency)
+
+    def decrease(self, factor, interval):
+        """
+        Multiplies the concurrency by `factor`, at most once per `interval`
+        seconds, so a burst of slow or failed requests already in flight counts
+        as one decrease.
+
+        Returns:
+            True if the concurrency was decreased.
+        """
+        now = time.monotonic()
+        if now - self.last_decrease < interval:
+            return False
+        self.last_decrease = now
+        self.concurrency = max(self.min, self.concurrency * factor)
+        return True
+
+
+class AdaptiveConcurrencyMiddleware:
+    """
+    Gives each class of URLs its own download slot and adapts its concurrency.
+
+    The classes are set by ADAPTIVE_CONCURRENCY_CLASSES, the first class whose
+    pattern matches the URL is used. A class' concurrency grows by one request
+    per round of responses faster than its target latency, and is multiplied by
+    ADAPTIVE_CONCURRENCY_DECREASE on a slower response, an error or a
+    ADAPTIVE_CONCURRENCY_ERROR_CODES status. The current concurrency of each
+    class is kept in the crawler stats under adaptive_concurrency/.
+    """
+
+    def __init__(self, crawler, classes, decrease=0.5, error_codes=()):
+        self.crawler = crawler
+        self.endpoints = [
+            EndpointConcurrency(name, **options) for name, options in classes.items()
+        ]
+        self.endpoints_by_name = {
+            endpoint.name: endpoint for endpoint in self.endpoints
+        }
+        self.decrease_factor = decrease
+        self.error_codes = set(error_codes)
 
     @classmethod
     def from_crawler(cls, crawler):
-        host = PROXY_HOST
-        username = PROXY_USERNAME
-        password = PROXY_PASSWORD
-        return cls(host, username, password)
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            raise NotConfigured
+        return cls(
+            crawler,
+            settings.getdict("ADAPTIVE_CONCURRENCY_CLASSES"),
+            decrease=settings.getfloat("ADAPTIVE_CONCURRENCY_DECREASE", 0.5),
+            error_codes=[
+                int(code)
+                for code in settings.getlist("ADAPTIVE_CONCURRENCY_ERROR_CODES")
+            ],
+        )
+
+    def get_endpoint(self, url):
+        """
+        Returns the class of a URL, or None if it matches no class.
+        """
+        for endpoint in self.endpoints:
+            if endpoint.pattern.search(url):
+                return endpoint
+        return None
 
     def process_request(self, request, spider):
-        request.meta["proxy"] = f"http://{self.username}:{self.password}@{self.host}"
+        endpoint = self.get_endpoint(request.url)
+        if endpoint is not None:
+            request.meta["download_slot"] = endpoint.name
+            self.apply(endpoint, spider)
+
+    def process_response(self, request, response, spider):
+        endpoint = self.endpoints_by_name.get(request.meta.get("download_slot"))
+        if endpoint is not None:
+            latency = request.meta.get("download_latency", 0)
+            if response.status in self.error_codes or latency > endpoint.target_latency:
+                self.decrease(endpoint, spider)
+            else:
+                endpoint.increase()
+                self.apply(endpoint, spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        endpoint = self.endpoints_by_name.get(request.meta.get("download_slot"))
+        if endpoint is not None:
+            self.decrease(endpoint, spider)
+
+    def decrease(self, endpoint, spider):
+        """
+        Decreases the concurrency of a class after a slow or failed request.
+        """
+        if endpoint.decrease(self.decrease_factor, endpoint.target_latency):
+            self.crawler.stats.inc_value(
+                f"adaptive_concurrency/decreased/{endpoint.name}", spider=spider
+            )
+            self.apply(endpoint, spider)
+
+    def apply(self, endpoint, spider):
+        """
+        Sets the concurrency of the download slot of a class.
+
+        The slot is created by the downloader when the first request of the
+        class is queued, with the default concurrency; the next requests update
+        it.
+        """
+        slot = self.crawler.engine.downloader.slots.get(endpoint.name)
+        concurrency = int(endpoint.concurrency)
+        if slot is not None and slot.concurrency != concurrency:
+            slot.concurrency = concurrency
+            self.crawler.stats.set_value(
+                f"adaptive_concurrency/{endpoint.name}", concurrency, spider=spider
+            )
@@ -2,16 +2,54 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+from collections import Counter
 import datetime
+from decimal import Decimal, InvalidOperation
+import hashlib
+import json
+import re
+
 import psycopg2
+from psycopg2.extras import execute_values
+from scrapy import signals
 from scrapy.exceptions import DropItem
-from chemicals.settings import (
-    DB_HOST,
-    DB_PORT,
-    DB_NAME,
-    DB_USER,
-    DB_PASSWORD,
+from twisted.internet import defer, reactor, task, threads
+from twisted.python.threadpool import ThreadPool
+from chemicals.db import (
+    connect,
+    connection_pool,
+    finish_crawl_run,
+    generation_filter,
+    get_active_generation,
+    keep_products,
+    refresh_price_aggregates,
+    start_crawl_run,
 )
+from chemicals.signals import items_written
+
+# Unit family and conversion factor to grams or milliliters of each valid unit.
+PACK_UNITS = {
+    "mg": ("g", 0.001),
+    "g": ("g", 1),
+    "kg": ("g", 1000),
+    "ml": ("ml", 1),
+    "l": ("ml", 1000),
+}
+
+
+def parse_price(price):
+    """Convert a scraped price such as "1,200.00" to a Decimal.
+
+    Args:
+        price (str): The scraped price.
+
+    Returns:
+        Decimal: The price, or None if it isn't a number.
+    """
+    try:
+        return Decimal(re.sub(r"[^0-9.]", "", price or ""))
+    except InvalidOperation:
+        return None
 
 
 class ChemicalsPipeline:
@@ -90,30 +128,150 @@ class ChemicalsPipeline:
 
 
 class PostgreSQLPipeline:
-    def __init__(self):
-        """Initialize the Spider.
+    columns = (
+        "datetime",
+        "availability",
+        "company_name",
+        "product_url",
+        "numcas",
+        "name",
+        "qt_list",
+        "unit_list",
+        "currency_list",
+        "price_pack_list",
+    )
+    hashed_columns = (
+        "availability",
+        "numcas",
+        "name",
+        "qt_list",
+        "unit_list",
+        "currency_list",
+        "price_pack_list",
+    )
+    history_columns = columns + ("content_hash",)
+    stored_columns = history_columns + ("availability_stale", "crawl_run_id")
+
+    def __init__(self, batch_size=1, flush_interval=0, stats=None, signals=None):
+        """Initialize the pipeline.
+
+        This method is called when the pipeline instance is created. Items are buffered
+        and written in batches of `batch_size` rows, and the buffer is also flushed every
+        `flush_interval` seconds so that items don't wait for a full batch when the crawl
+        is slow.
+
+        Args:
+            batch_size (int): Number of items written with one multi-row INSERT.
+            flush_interval (float): Seconds between periodic flushes, 0 to disable.
+            stats (scrapy.statscollectors.StatsCollector): The crawler stats.
+            signals (scrapy.signalmanager.SignalManager): The crawler signals,
+                `items_written` is sent with them.
+        """
+        self.conn = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.signals = signals
+        self.rows = []
+        self.flush_task = None
+        self.crawl_run_id = None
+        self.crawl_kind = "full"
+        self.fresh_urls = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(
+            stats=crawler.stats,
+            signals=crawler.signals,
+            **cls.get_options(crawler.settings),
+        )
+        crawler.signals.connect(pipeline.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(
+            pipeline.request_dropped, signal=signals.request_dropped
+        )
+        return pipeline
+
+    @classmethod
+    def get_options(cls, settings):
+        """Read the pipeline options from the crawler settings.
+
+        Args:
+            settings (scrapy.settings.Settings): The crawler settings.
+
+        Returns:
+            dict: Keyword arguments of the pipeline, other than `stats` and
+            `signals`.
+        """
+        return {
+            "batch_size": settings.getint("POSTGRES_BATCH_SIZE", 1),
+            "flush_interval": settings.getfloat("POSTGRES_FLUSH_INTERVAL", 0),
+        }
+
+    def open_spider(self, spider):
+        """Connect to the database, start the crawl run and the periodic flush.
+
+        Every row written by the spider is stamped with the crawl run, which is
+        created here unless the spider got a `crawl_run_id` argument from the API.
+
+        Args:
+            spider (scrapy.Spider): The Spider instance being opened.
+        """
+        self.conn = connect()
+        self.crawl_run_started(
+            start_crawl_run(self.conn, *self.get_crawl_run_args(spider)), spider
+        )
 
-        This method is called when the Spider instance is created. It establishes a connection
-        to the PostgreSQL database using the provided connection details (host, port, dbname,
-        user, password), and creates a cursor object to perform database operations.
+    def get_crawl_run_args(self, spider):
+        """Build the arguments of `start_crawl_run` following the connection.
+
+        Args:
+            spider (scrapy.Spider): The Spider instance being opened.
+
+        Returns:
+            tuple: Company name, crawl run id, kind, discovery flag and the product
+                pages of a targeted refresh.
         """
-        self.conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
+        return (
+            spider.company_name,
+            self.get_spider_crawl_run_id(spider),
+            getattr(spider, "crawl_kind", "full"),
+            getattr(spider, "discovery", True),
+            getattr(spider, "product_urls", []),
         )
-        self.cursor = self.conn.cursor()
+
+    def crawl_run_started(self, crawl_run_id, spider):
+        """Remember the started crawl run and start the periodic flush.
+
+        Args:
+            crawl_run_id (int): Id of the started crawl run.
+            spider (scrapy.Spider): The Spider instance being opened.
+        """
+        self.crawl_run_id = crawl_run_id
+        self.crawl_kind = getattr(spider, "crawl_kind", "full")
+        if self.flush_interval > 0:
+            self.flush_task = task.LoopingCall(self.flush, spider)
+            self.flush_task.start(self.flush_interval, now=False)
+
+    def get_spider_crawl_run_id(self, spider):
+        """Read the crawl run passed to the spider by the API.
+
+        Args:
+            spider (scrapy.Spider): The Spider instance.
+
+        Returns:
+            int: The crawl run id, or None if the spider was started without one.
+        """
+        crawl_run_id = getattr(spider, "crawl_run_id", None)
+        return int(crawl_run_id) if crawl_run_id else None
 
     def process_item(self, item, spider):
         """Process the scraped item.
 
-        This function is called for each scraped item. It processes the item by inserting
-        its data into a PostgreSQL database table named 'scrapy_app_chemicals'. The item
-        data is inserted into the table using an SQL INSERT statement. If any error occurs
-        during the database operation, the transaction is rolled back and a `DropItem`
-        exception is raised.
+        This function is called for each scraped item. It adds the item data to the
+        buffer of rows for the PostgreSQL table named 'scrapy_app_chemicals', and
+        writes the buffer once it holds `batch_size` rows. Products are keyed on
+        (company_name, product_url), so a product crawled again updates its row.
 
         Args:
             item (scrapy.Item): The scraped item to be processed.
@@ -123,40 +281,595 @@ class PostgreSQLPipeline:
             scrapy.Item: The processed item.
 
         Raises:
-            DropItem: If an error occurs during the database operation.
+            DropItem: If the item is missing a column.
+        """
+        try:
+            self.rows.append(self.get_row(item))
+        except KeyError as e:
+            raise DropItem(f"Error inserting item into PostgreSQL: {str(e)}")
+        if len(self.rows) >= self.batch_size:
+            self.flush(spider)
+        return item
+
+    def get_row(self, item):
+        """Build the table row of an item.
+
+        Args:
+            item (scrapy.Item): The scraped item.
+
+        Returns:
+            dict: The column values, with the 'content_hash' of the item data, its
+            'availability_stale' flag and the 'crawl_run_id' of the crawl.
+
+        Raises:
+            KeyError: If the item is missing a column.
+        """
+        row = {column: item[column] for column in self.columns}
+        row["content_hash"] = self.get_content_hash(row)
+        row["availability_stale"] = item.get("availability_stale", False)
+        row["crawl_run_id"] = self.crawl_run_id
+        return row
+
+    def get_content_hash(self, row):
+        """Hash the product data of a row, leaving out the crawl time.
+
+        Args:
+            row (dict): The column values.
+
+        Returns:
+            str: The SHA-256 hex digest of the normalized data.
+        """
+        data = json.dumps(
+            [row[column] for column in self.hashed_columns],
+            separators=(",", ":"),
+            default=str,
+        )
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def flush(self, spider):
+        """Write the buffered rows to the database.
+
+        Args:
+            spider (scrapy.Spider): The Spider instance that generated the items.
+        """
+        rows, self.rows = self.rows, []
+        if rows:
+            self.rows_written(self.write_rows(self.conn, rows, spider), spider)
+
+    def rows_written(self, result, spider):
+        """Add the counts of a write to the crawler stats and send `items_written`
+        for the committed rows.
+
+        Args:
+            result (tuple): The counts and the committed rows, see `write_rows`.
+            spider (scrapy.Spider): The Spider instance that generated the items.
+        """
+        counts, rows = result
+        if self.stats:
+            for key, value in counts.items():
+                self.stats.inc_value(f"postgres/{key}_items", value, spider=spider)
+        if self.signals and rows:
+            self.signals.send_catch_log(
+                items_written,
+                product_urls=[row["product_url"] for row in rows],
+                spider=spider,
+            )
+
+    def write_rows(self, conn, rows, spider):
+        """Write rows with a few multi-row statements in one transaction.
+
+        If the batch fails, the transaction is rolled back and the rows are written
+        one by one, so that one bad item doesn't lose the whole batch. Rows that still
+        fail are logged.
+
+        Args:
+            conn: The database connection to write with.
+            rows (list): Rows built by `get_row`.
+            spider (scrapy.Spider): The Spider instance that generated the items.
+
+        Returns:
+            tuple: Counter of the written, changed, unchanged and failed rows, and the
+            list of the committed rows.
         """
         try:
-            self.cursor.execute(
-                "INSERT INTO scrapy_app_chemicals (datetime, availability, company_name, product_url, numcas, name, "
-                "qt_list, unit_list, currency_list, price_pack_list) "
-                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            counts = self.upsert_rows(conn, rows)
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            if len(rows) == 1:
+                spider.logger.error(f"Error inserting item into PostgreSQL: {str(e)}")
+                return Counter(failed=1), []
+            spider.logger.warning(
+                f"Batch insert of {len(rows)} items failed, inserting them one by one: {str(e)}"
+            )
+            counts, written = Counter(), []
+            for row in rows:
+                row_counts, row_written = self.write_rows(conn, [row], spider)
+                counts += row_counts
+                written += row_written
+            return counts, written
+        return counts, rows
+
+    def upsert_rows(self, conn, rows):
+        """Write rows without committing, skipping unchanged product data.
+
+        A full crawl writes its rows to its own generation, a refresh to the
+        company's active generation. The content hash of every product, as stored in
+        the written generation or else in the active one, is compared with the hash
+        of the crawled data. Unchanged products that are already in the written
+        generation only get their 'datetime' and 'availability_stale' updated. The
+        other products are written in full and get their rows in the
+        'scrapy_app_pack' table replaced, and the new and changed ones are also added
+        to the 'scrapy_app_chemicalshistory' table.
+
+        The price aggregates of the CAS numbers whose packs a refresh changed are
+        refreshed in the same transaction. The rows of a full crawl aren't shown
+        before it finishes, which refreshes the aggregates of its generation.
+
+        Args:
+            conn: The database connection to write with.
+            rows (list): Rows built by `get_row`, all of the same company.
+
+        Returns:
+            Counter: Number of written, changed and unchanged rows.
+        """
+        template = (
+            "(" + ", ".join(f"%({column})s" for column in self.stored_columns) + ")"
+        )
+        columns = ", ".join(self.stored_columns)
+        history_template = (
+            "(" + ", ".join(f"%({column})s" for column in self.history_columns) + ")"
+        )
+        history_columns = ", ".join(self.history_columns)
+
+        with conn.cursor() as cursor:
+            company_name = rows[0]["company_name"]
+            active = get_active_generation(cursor, company_name)
+            generation = self.crawl_run_id if self.crawl_kind == "full" else active
+            # A product can only be written once per statement, keep its last row.
+            rows = list(
+                {
+                    row["product_url"]: dict(row, crawl_run_id=generation)
+                    for row in rows
+                }.values()
+            )
+
+            cursor.execute(
+                "SELECT product_url, content_hash, numcas, crawl_run_id "
+                "FROM scrapy_app_chemicals "
+                "WHERE company_name = %s AND product_url = ANY(%s) "
+                "AND (crawl_run_id IS NULL OR crawl_run_id = ANY(%s))",
                 (
-                    item["datetime"],
-                    item["availability"],
-                    item["company_name"],
-                    item["product_url"],
-                    item["numcas"],
-                    item["name"],
-                    item["qt_list"],
-                    item["unit_list"],
-                    item["currency_list"],
-                    item["price_pack_list"],
+                    company_name,
+                    [row["product_url"] for row in rows],
+                    [run_id for run_id in (generation, active) if run_id],
                 ),
             )
-            self.conn.commit()
-        except (psycopg2.Error, KeyError) as e:
-            self.conn.rollback()
+            stored = {}
+            for url, content_hash, numcas, crawl_run_id in cursor.fetchall():
+                # Prefer the row of the written generation.
+                if url not in stored or crawl_run_id == generation:
+                    stored[url] = (content_hash, numcas, crawl_run_id)
+
+            changed = []
+            unchanged = []
+            written = []
+            for row in rows:
+                content_hash, _, crawl_run_id = stored.get(
+                    row["product_url"], (None, None, None)
+                )
+                if content_hash != row["content_hash"]:
+                    changed.append(row)
+                    written.append(row)
+                elif row["product_url"] in stored and crawl_run_id == generation:
+                    unchanged.append(row)
+                else:
+                    # Unchanged, but not in the written generation yet.
+                    written.append(row)
+
+            condition, params = generation_filter(generation, "c.crawl_run_id")
+            condition = cursor.mogrify(condition, params).decode()
+            if unchanged:
+                execute_values(
+                    cursor,
+                    "UPDATE scrapy_app_chemicals AS c "
+                    "SET datetime = v.datetime, "
+                    "availability_stale = v.availability_stale "
+                    "FROM (VALUES %s) "
+                    "AS v (company_name, product_url, datetime, availability_stale) "
+                    f"WHERE {condition} AND c.company_name = v.company_name "
+                    "AND c.product_url = v.product_url",
+                    unchanged,
+                    template=(
+                        "(%(company_name)s, %(product_url)s, %(datetime)s, "
+                        "%(availability_stale)s)"
+                    ),
+                )
+            if written:
+                updates = ", ".join(
+                    f"{column} = EXCLUDED.{column}"
+                    for column in self.stored_columns
+                    if column not in ("company_name", "product_url", "crawl_run_id")
+                )
+                chemical_ids = execute_values(
+                    cursor,
+                    f"INSERT INTO scrapy_app_chemicals ({columns}) VALUES %s "
+                    "ON CONFLICT (crawl_run_id, company_name, product_url) "
+                    f"DO UPDATE SET {updates} "
+                    "RETURNING product_url, id",
+                    written,
+                    template=template,
+                    fetch=True,
+                )
+                self.replace_packs(cursor, written, dict(chemical_ids), generation)
+            if changed:
+                execute_values(
+                    cursor,
+                    f"INSERT INTO scrapy_app_chemicalshistory ({history_columns}) "
+                    "VALUES %s",
+                    changed,
+                    template=history_template,
+                )
+            if changed and self.crawl_kind != "full":
+                # A changed product may also have moved to another CAS number.
+                refresh_price_aggregates(
+                    cursor,
+                    [row["numcas"] for row in changed]
+                    + [
+                        stored[row["product_url"]][1]
+                        for row in changed
+                        if row["product_url"] in stored
+                    ],
+                )
+
+        return Counter(
+            written=len(rows), changed=len(changed), unchanged=len(rows) - len(changed)
+        )
+
+    def replace_packs(self, cursor, rows, chemical_ids, generation):
+        """Replace the packs of written products.
+
+        Args:
+            cursor: The database cursor to write with.
+            rows (list): Rows built by `get_row`.
+            chemical_ids (dict): Ids of the rows by product_url.
+            generation (int): The generation the rows were written to.
+        """
+        condition, params = generation_filter(generation)
+        cursor.execute(
+            f"DELETE FROM scrapy_app_pack WHERE {condition} AND chemical_id = ANY(%s)",
+            (*params, list(chemical_ids.values())),
+        )
+        packs = [
+            pack
+            for row in rows
+            for pack in self.get_packs(row, chemical_ids[row["product_url"]])
+        ]
+        if packs:
+            execute_values(
+                cursor,
+                "INSERT INTO scrapy_app_pack (chemical_id, crawl_run_id, numcas, "
+                "quantity, unit, unit_family, currency, price, price_per_unit) "
+                "VALUES %s",
+                packs,
+            )
+
+    def get_packs(self, row, chemical_id):
+        """Build the pack rows of a product.
+
+        Every pack gets a numeric price and its price per gram or milliliter.
+
+        Args:
+            row (dict): Row built by `get_row`.
+            chemical_id (int): Id of the product row.
+
+        Returns:
+            list: The column values of each pack with a known unit.
+        """
+        packs = []
+        for quantity, unit, currency, price in zip(
+            row["qt_list"],
+            row["unit_list"],
+            row["currency_list"],
+            row["price_pack_list"],
+        ):
+            if unit not in PACK_UNITS:
+                continue
+            unit_family, factor = PACK_UNITS[unit]
+            price = parse_price(price)
+            price_per_unit = None
+            if price is not None and quantity:
+                price_per_unit = price / Decimal(str(quantity * factor))
+            packs.append(
+                (
+                    chemical_id,
+                    row["crawl_run_id"],
+                    row["numcas"],
+                    quantity,
+                    unit,
+                    unit_family,
+                    currency,
+                    price,
+                    price_per_unit,
+                )
+            )
+        return packs
+
+    def close_spider(self, spider):
+        """Close the Spider.
+
+        This method is called when the Spider is closed. It writes the remaining
+        buffered items.
+
+        Args:
+            spider (scrapy.Spider): The Spider instance being closed.
+        """
+        if self.flush_task and self.flush_task.running:
+            self.flush_task.stop()
+        self.flush(spider)
+
+    def spider_opened(self, spider):
+        """Keep the skipped fresh product pages in the spider state.
+
+        With a job directory, the state is saved when the spider closes, so a
+        resumed crawl still keeps the rows of the pages skipped before the stop.
+
+        Args:
+            spider (scrapy.Spider): The Spider instance.
+        """
+        state = getattr(spider, "state", None)
+        if state is not None:
+            self.fresh_urls = state.setdefault("fresh_urls", self.fresh_urls)
+
+    def request_dropped(self, request, spider):
+        """Remember the product pages the dupefilter skipped as still fresh.
+
+        Their rows weren't crawled again, but they are still current, so they are
+        kept in the crawl run's generation when it finishes.
+
+        Args:
+            request (scrapy.Request): The dropped request.
+            spider (scrapy.Spider): The Spider instance.
+        """
+        if request.meta.get("dupefilter_fresh"):
+            self.fresh_urls.append(request.url)
+
+    def spider_closed(self, spider, reason):
+        """Finish the crawl run and close the database connection.
+
+        This method is called once all items have been processed. If the crawl
+        finished successfully, its rows become the company's active generation and the
+        partitions of older generations are dropped.
+
+        Args:
+            spider (scrapy.Spider): The Spider instance being closed.
+            reason (str): The reason the spider was closed.
+        """
+        self.crawl_run_finished(
+            self.finish_crawl(self.conn, spider.company_name, reason == "finished"),
+            spider,
+        )
+        self.conn.close()
+
+    def finish_crawl(self, conn, company_name, finished):
+        """Copy the rows of the skipped fresh product pages into the generation of a
+        full crawl, then finish the crawl run.
+
+        Args:
+            conn: The database connection.
+            company_name (str): Name of the crawled company.
+            finished (bool): Whether the crawl finished successfully.
+
+        Returns:
+            tuple: Number of kept rows and number of retired rows.
+        """
+        kept = 0
+        if finished and self.fresh_urls and self.crawl_kind == "full":
+            kept = keep_products(conn, self.crawl_run_id, company_name, self.fresh_urls)
+        retired = finish_crawl_run(conn, self.crawl_run_id, company_name, finished)
+        return kept, retired
+
+    def crawl_run_finished(self, counts, spider):
+        """Add the kept rows and the rows retired with the older generations to the
+        crawler stats.
+
+        Args:
+            counts (tuple): Number of kept rows and number of retired rows.
+            spider (scrapy.Spider): The Spider instance being closed.
+        """
+        kept, retired = counts
+        if self.stats:
+            self.stats.set_value("postgres/kept_items", kept, spider=spider)
+            self.stats.set_value("postgres/retired_items", retired, spider=spider)
+
+
+class ThreadedPostgreSQLPipeline(PostgreSQLPipeline):
+    def __init__(
+        self, batch_size=1, flush_interval=0, stats=None, signals=None, max_writes=4
+    ):
+        """Initialize the pipeline.
+
+        Works like `PostgreSQLPipeline`, but batches are written by a pool of
+        `max_writes` threads, each with its own database connection, so that a slow
+        database doesn't block the reactor and the downloads. When `max_writes` batches
+        are in flight, `process_item` returns Deferreds that only fire once a write has
+        finished, which makes Scrapy stop feeding new responses until the database
+        catches up.
+
+        Args:
+            batch_size (int): Number of items written with one multi-row INSERT.
+            flush_interval (float): Seconds between periodic flushes, 0 to disable.
+            stats (scrapy.statscollectors.StatsCollector): The crawler stats.
+            signals (scrapy.signalmanager.SignalManager): The crawler signals.
+            max_writes (int): Maximum number of batches written at the same time.
+        """
+        super().__init__(batch_size, flush_interval, stats, signals)
+        self.max_writes = max_writes
+        self.semaphore = defer.DeferredSemaphore(max_writes)
+        self.threadpool = None
+        self.pool = None
+        self.writes = set()
+
+    @classmethod
+    def get_options(cls, settings):
+        """Add the number of concurrent writes to the options."""
+        options = super().get_options(settings)
+        options["max_writes"] = settings.getint("POSTGRES_MAX_INFLIGHT_WRITES", 4)
+        return options
+
+    def open_spider(self, spider):
+        """Start the write threads and their connections, then start the crawl run
+        and the periodic flush from a write thread.
+
+        Args:
+            spider (scrapy.Spider): The Spider instance being opened.
+
+        Returns:
+            Deferred: Fires when the crawl run has been started, which Scrapy waits
+            for before the crawl begins.
+        """
+        self.pool = connection_pool(self.max_writes)
+        self.threadpool = ThreadPool(
+            minthreads=1, maxthreads=self.max_writes, name="PostgreSQLPipeline"
+        )
+        self.threadpool.start()
+        d = threads.deferToThreadPool(
+            reactor,
+            self.threadpool,
+            self.run_pooled,
+            start_crawl_run,
+            *self.get_crawl_run_args(spider),
+        )
+        d.addCallback(self.crawl_run_started, spider)
+        return d
+
+    def process_item(self, item, spider):
+        """Process the scraped item.
+
+        Adds the item data to the buffer of rows and hands the buffer to a write thread
+        once it holds `batch_size` rows.
+
+        Args:
+            item (scrapy.Item): The scraped item to be processed.
+            spider (scrapy.Spider): The Spider instance that generated the item.
+
+        Returns:
+            scrapy.Item or Deferred: The item, or a Deferred firing with the item once
+            the write of its batch has finished or, if all writes are in flight, once
+            one of them has finished.
+
+        Raises:
+            DropItem: If the item is missing a column.
+        """
+        try:
+            self.rows.append(self.get_row(item))
+        except KeyError as e:
             raise DropItem(f"Error inserting item into PostgreSQL: {str(e)}")
+        if len(self.rows) >= self.batch_size:
+            return self.flush(spider).addCallback(lambda _: item)
+        if self.semaphore.tokens == 0:
+            return self.semaphore.acquire().addCallback(self.release, item)
         return item
 
+    def release(self, semaphore, item):
+        """Give back a write slot that was only acquired to wait for a free one."""
+        semaphore.release()
+        return item
+
+    def flush(self, spider):
+        """Hand the buffered rows to a write thread.
+
+        Args:
+            spider (scrapy.Spider): The Spider instance that generated the items.
+
+        Returns:
+            Deferred: Fires when the rows have been written.
+        """
+        rows, self.rows = self.rows, []
+        if not rows:
+            return defer.succeed(None)
+        d = self.semaphore.run(
+            threads.deferToThreadPool,
+            reactor,
+            self.threadpool,
+            self.run_pooled,
+            self.write_rows,
+            rows,
+            spider,
+        )
+        d.addCallback(self.rows_written, spider)
+        d.addErrback(
+            lambda failure: spider.logger.error(
+                f"Error writing {len(rows)} items to PostgreSQL: "
+                f"{failure.getErrorMessage()}"
+            )
+        )
+        self.writes.add(d)
+        d.addBoth(lambda _: self.writes.discard(d))
+        return d
+
+    def run_pooled(self, func, *args):
+        """Call a database function with a connection from the pool.
+
+        Args:
+            func: Function taking the connection as its first argument.
+            *args: The other arguments of the function.
+
+        Returns:
+            The return value of the function.
+        """
+        conn = self.pool.getconn()
+        try:
+            return func(conn, *args)
+        finally:
+            self.pool.putconn(conn)
+
     def close_spider(self, spider):
         """Close the Spider.
 
-        This method is called when the Spider is closed. It is responsible for closing
-        the database connection and cursor.
+        Writes the remaining buffered items and waits for all writes in flight.
 
         Args:
             spider (scrapy.Spider): The Spider instance being closed.
+
+        Returns:
+            Deferred: Fires when everything has been written.
         """
-        self.cursor.close()
-        self.conn.close()
+        if self.flush_task and self.flush_task.running:
+            self.flush_task.stop()
+        self.flush(spider)
+        return defer.DeferredList(list(self.writes))
+
+    def spider_closed(self, spider, reason):
+        """Finish the crawl run, then stop the write threads and close their
+        connections.
+
+        Args:
+            spider (scrapy.Spider): The Spider instance being closed.
+            reason (str): The reason the spider was closed.
+
+        Returns:
+            Deferred: Fires when the crawl run has been finished.
+        """
+        d = threads.deferToThreadPool(
+            reactor,
+            self.threadpool,
+            self.run_pooled,
+            self.finish_crawl,
+            spider.company_name,
+            reason == "finished",
+        )
+        d.addCallback(self.crawl_run_finished, spider)
+        d.addErrback(
+            lambda failure: spider.logger.error(
+                f"Error finishing crawl run {self.crawl_run_id}: "
+                f"{failure.getErrorMessage()}"
+            )
+        )
+        d.addBoth(lambda _: self.close_pools())
+        return d
+
+    def close_pools(self):
+        """Stop the write threads and close their connections."""
+        self.threadpool.stop()
+        self.pool.closeall()
@@ -0,0 +1,74 @@
+"""
+Scheduler keeping a bounded number of requests in memory.
+
+Without a job directory, Scrapy's scheduler keeps the whole frontier in
+memory. This one pushes requests to memory until SCHEDULER_MEMORY_LIMIT
+requests are queued there, and then spills the requests whose priority is at
+most SCHEDULER_SPILL_PRIORITY to a disk queue in a temporary directory.
+Requests of a higher priority always stay in memory. Memory requests are
+popped first, so the spilled ones are crawled once the memory queue drains.
+
+With a job directory (JOBDIR), every request is stored in the job's disk
+queue as usual, so a stopped crawl can be resumed. Requests with the
+``keep_in_memory`` meta key are never written to disk: they carry state that
+can't outlive the process, like partially scraped items.
+"""
+import shutil
+import tempfile
+
+from scrapy.core.scheduler import Scheduler
+
+
+class SpillingScheduler(Scheduler):
+    """
+    Scheduler spilling low priority requests to disk past a memory limit.
+    """
+
+    def __init__(self, *args, memory_limit=10000, spill_priority=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.memory_limit = memory_limit
+        self.spill_priority = spill_priority
+        self.resumable = self.dqdir is not None
+        self.spill_dir = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        scheduler = super().from_crawler(crawler)
+        scheduler.memory_limit = crawler.settings.getint(
+            "SCHEDULER_MEMORY_LIMIT", scheduler.memory_limit
+        )
+        scheduler.spill_priority = crawler.settings.getint(
+            "SCHEDULER_SPILL_PRIORITY", scheduler.spill_priority
+        )
+        return scheduler
+
+    def open(self, spider):
+        if not self.resumable:
+            self.spill_dir = tempfile.mkdtemp(prefix="chemicals-spill-")
+            self.dqdir = self._dqdir(self.spill_dir)
+        return super().open(spider)
+
+    def close(self, reason):
+        result = super().close(reason)
+        if self.spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+        return result
+
+    def _dqpush(self, request):
+        """
+        Pushes a request to the disk queue if it must be stored there.
+
+        Args:
+            request (scrapy.Request): The request.
+
+        Returns:
+            True if the request was stored on disk, False if it must be kept in
+            memory.
+        """
+        if request.meta.get("keep_in_memory"):
+            return False
+        if not self.resumable and (
+            len(self.mqs) < self.memory_limit or request.priority > self.spill_priority
+        ):
+            return False
+        return super()._dqpush(request)
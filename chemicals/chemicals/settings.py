@@ -60,9 +60,53 @@ ROBOTSTXT_OBEY = True
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
     # "chemicals.middlewares.ChemicalsDownloaderMiddleware": 543,
-    "chemicals.middlewares.ProxyMiddleware": 500,
+    # After RetryMiddleware (550) to see the responses and errors it retries,
+    # before HttpProxyMiddleware (750) which handles the proxy credentials.
+    "chemicals.middlewares.ProxyPoolMiddleware": 600,
+    # Also after RetryMiddleware, to see the slow and failed requests it retries.
+    "chemicals.middlewares.AdaptiveConcurrencyMiddleware": 650,
 }
 
+# Requests are spread over the proxies of PROXY_LIST (whitespace separated
+# user:password@host:port entries, PROXY_HOST if empty) by their success rate
+# and latency over their last PROXY_POOL_WINDOW requests. Responses with a
+# PROXY_POOL_BAN_CODES status and download errors are failures, and a proxy
+# failing PROXY_POOL_MAX_FAILURES times in a row is left out for
+# PROXY_POOL_COOLDOWN seconds.
+PROXY_POOL_WINDOW = 50
+PROXY_POOL_COOLDOWN = 60
+PROXY_POOL_MAX_FAILURES = 3
+PROXY_POOL_BAN_CODES = [403, 407, 429, 502, 503, 504]
+
+# Each class of URLs is downloaded in its own slot, whose concurrency starts
+# at "start" and is adjusted between "min" and "max": one more request per
+# round of responses faster than "target_latency" seconds, and multiplied by
+# ADAPTIVE_CONCURRENCY_DECREASE on slower responses, download errors and
+# ADAPTIVE_CONCURRENCY_ERROR_CODES. The first matching pattern gives the
+# class. The cheap availability checks are pushed hard while the heavy pages
+# back off early. CONCURRENT_REQUESTS bounds all classes together.
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_CONCURRENCY_CLASSES = {
+    "availability": {
+        "pattern": r"/CGetInv\.php",
+        "start": 16,
+        "min": 4,
+        "max": 64,
+        "target_latency": 1.0,
+    },
+    "category": {
+        "pattern": r"/ConcordCatagory\.php",
+        "start": 2,
+        "min": 1,
+        "max": 8,
+        "target_latency": 5.0,
+    },
+    "page": {"pattern": r"", "start": 4, "min": 1, "max": 16, "target_latency": 3.0},
+}
+ADAPTIVE_CONCURRENCY_DECREASE = 0.5
+ADAPTIVE_CONCURRENCY_ERROR_CODES = [429, 500, 502, 503, 504]
+CONCURRENT_REQUESTS = 96
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 # EXTENSIONS = {
@@ -73,9 +117,19 @@ DOWNLOADER_MIDDLEWARES = {
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
     "chemicals.pipelines.ChemicalsPipeline": 100,
-    "chemicals.pipelines.PostgreSQLPipeline": 300,
+    "chemicals.pipelines.ThreadedPostgreSQLPipeline": 300,
 }
 
+# Write items to PostgreSQL in batches of POSTGRES_BATCH_SIZE rows. The buffer
+# is also flushed every POSTGRES_FLUSH_INTERVAL seconds and when the spider
+# closes.
+POSTGRES_BATCH_SIZE = 100
+POSTGRES_FLUSH_INTERVAL = 10
+# ThreadedPostgreSQLPipeline writes batches from a thread pool off the reactor.
+# When this many batches are in flight, item processing waits for them, which
+# slows down the crawl instead of buffering without limit.
+POSTGRES_MAX_INFLIGHT_WRITES = 4
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 # AUTOTHROTTLE_ENABLED = True
@@ -97,6 +151,74 @@ ITEM_PIPELINES = {
 # HTTPCACHE_IGNORE_HTTP_CODES = []
 # HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
 
+# Check the availability of all packs of a product at once ("parallel") or
+# one request after another ("serial"). Failed or timed out checks count as
+# not in stock instead of holding the item back.
+AVAILABILITY_MODE = "parallel"
+AVAILABILITY_TIMEOUT = 15
+AVAILABILITY_MAX_RETRIES = 1
+
+# After AVAILABILITY_BREAKER_FAILURES failed checks in a row, or checks slower
+# than AVAILABILITY_BREAKER_SLOW seconds, availability checks are skipped and
+# items get the stored availability of their product, flagged as stale. After
+# AVAILABILITY_BREAKER_RESET seconds one product's checks are sent as a probe,
+# and their results resume or keep skipping the checks.
+AVAILABILITY_BREAKER_FAILURES = 5
+AVAILABILITY_BREAKER_SLOW = 5
+AVAILABILITY_BREAKER_RESET = 60
+
+# Schedule all pages of a category as soon as the page count is known instead
+# of following the Next link page by page.
+CATEGORY_PAGES_PARALLEL = True
+
+# Store the product page each category link redirects to, so later crawls
+# go straight to the product page for known links.
+REDIRECT_LINKS_ENABLED = True
+REDIRECT_LINKS_BATCH_SIZE = 100
+
+# Days between catalog walks of crawls seeded from the stored product pages
+# (seed spider argument). Seeded crawls in between only fetch product pages.
+SEED_DISCOVERY_INTERVAL = 7
+
+# Crawls seeded with seed=due only fetch the products due for a recrawl. A
+# product's recrawl interval, in days, follows how often its data changed and
+# is kept between these bounds. At most RECRAWL_BUDGET products are fetched
+# per crawl, the most overdue first.
+RECRAWL_MIN_INTERVAL = 1
+RECRAWL_MAX_INTERVAL = 30
+RECRAWL_BUDGET = 1000
+
+# Pages fetched by previous crawls are remembered in DUPEFILTER_PATH and not
+# fetched again within their freshness window, in seconds. The first pattern
+# matching the URL gives the window, 0 meaning always fetched. Category pages
+# and catalog links are always fetched so new products are found; availability
+# checks complete their product's item, so they are always fetched too.
+# Skipped product pages stay in the finished crawl's data. The store is in the
+# project directory, not in the working directory of scrapyd, unless the
+# DUPEFILTER_PATH environment variable gives another path.
+DUPEFILTER_CLASS = "chemicals.dupefilters.PersistentDupeFilter"
+DUPEFILTER_PATH = os.environ.get(
+    "DUPEFILTER_PATH", abspath(join(dirname(__file__), "..", "dupefilter.sqlite"))
+)
+DUPEFILTER_TTLS = [
+    (r"^https://www\.astatechinc\.com/$", 0),
+    (r"/ConcordCatagory\.php", 0),
+    (r"[?&]cat=", 0),
+    (r"/CGetInv\.php", 0),
+]
+DUPEFILTER_DEFAULT_TTL = 20 * 60 * 60
+
+# At most SCHEDULER_MEMORY_LIMIT requests are queued in memory, further
+# requests with a priority of at most SCHEDULER_SPILL_PRIORITY (the category
+# pages, see the priorities in the spider) go to a disk queue. With a job
+# directory (JOBDIR, set per crawl run by the API), the queue and the
+# dupefilter state are kept there and a stopped crawl can be resumed.
+# Availability checks always stay in memory; the product pages still waiting
+# for them are fetched again when the crawl resumes.
+SCHEDULER = "chemicals.scheduler.SpillingScheduler"
+SCHEDULER_MEMORY_LIMIT = 10000
+SCHEDULER_SPILL_PRIORITY = 0
+
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
@@ -111,4 +233,5 @@ DB_PASSWORD = os.environ.get("POSTGRES_PASSWORD")
 
 PROXY_HOST = os.environ.get("PROXY_HOST")
 PROXY_USERNAME = os.environ.get("PROXY_USERNAME")
-PROXY_PASSWORD = os.environ.get("PROXY_PASSWORD")
\ No newline at end of file
+PROXY_PASSWORD = os.environ.get("PROXY_PASSWORD")
+PROXY_LIST = os.environ.get("PROXY_LIST", "").split()
\ No newline at end of file
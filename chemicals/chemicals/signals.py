@@ -0,0 +1,7 @@
+"""
+Signals sent by the chemicals project, next to Scrapy's own signals.
+"""
+
+# Sent by the PostgreSQL pipelines once rows are committed, with the
+# product_urls of the written items and the spider.
+items_written = object()
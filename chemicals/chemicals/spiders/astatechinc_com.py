@@ -1,5 +1,33 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import re
+import shutil
+import time
+from urllib.parse import parse_qs, urlparse
+
 import scrapy
+from scrapy.utils.job import job_dir
+from w3lib.url import add_or_replace_parameter
+
+from chemicals.db import (
+    connect,
+    delete_redirect_link,
+    last_discovery,
+    load_availability,
+    load_due_product_urls,
+    load_product_urls,
+    plan_recrawl,
+    load_redirect_links,
+    save_redirect_links,
+)
+from chemicals.extractors import extract_product
+
+# Priorities of the requests, higher first. A request closer to a finished item
+# goes first, so items waiting for their availability are completed and flushed
+# before more product pages are fetched, and the catalog is walked last.
+AVAILABILITY_PRIORITY = 30
+PRODUCT_PRIORITY = 20
+REDIRECT_PRIORITY = 10
+CATEGORY_PRIORITY = 0
 
 
 class AstatechincComSpider(scrapy.Spider):
@@ -12,6 +40,246 @@ class AstatechincComSpider(scrapy.Spider):
     start_urls = ["https://www.astatechinc.com/"]
 
     domain = "https://www.astatechinc.com/"
+    company_name = "AstaTech"
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        """
+        Creates the spider and reads the availability check options.
+
+        The availability mode can be overridden per run with the
+        ``availability_mode`` spider argument ("serial" or "parallel"). The
+        ``product_urls`` argument, a whitespace separated list of product pages,
+        turns the crawl into a refresh of only these products.
+
+        The ``seed`` argument, "db" or the path of a file with one URL per line,
+        starts the crawl from known product pages instead of the homepage. The
+        ``discovery`` argument ("auto", "always" or "never") then decides whether
+        the catalog is walked as well to find new products. "auto" walks it when
+        the last walk is older than SEED_DISCOVERY_INTERVAL days.
+
+        ``seed=due`` only fetches the stored products that are due for a recrawl
+        according to their change history, at most ``budget`` (RECRAWL_BUDGET)
+        of them. Products that aren't due keep their rows, so such a crawl is a
+        refresh and never walks the catalog.
+
+        With a job directory (JOBDIR), a stopped crawl can be resumed by running
+        it again with the same directory and arguments.
+
+        Args:
+            crawler: The crawler instance.
+
+        Returns:
+            The spider instance.
+        """
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.availability_mode = kwargs.get(
+            "availability_mode", crawler.settings.get("AVAILABILITY_MODE", "serial")
+        )
+        spider.availability_timeout = crawler.settings.getfloat(
+            "AVAILABILITY_TIMEOUT", 15
+        )
+        spider.availability_max_retries = crawler.settings.getint(
+            "AVAILABILITY_MAX_RETRIES", 1
+        )
+        spider.availability_slow = crawler.settings.getfloat(
+            "AVAILABILITY_BREAKER_SLOW", 5
+        )
+        spider.availability_breaker = CircuitBreaker(
+            crawler.settings.getint("AVAILABILITY_BREAKER_FAILURES", 5),
+            crawler.settings.getfloat("AVAILABILITY_BREAKER_RESET", 60),
+        )
+        spider.stored_availability = None
+        spider.category_pages_parallel = crawler.settings.getbool(
+            "CATEGORY_PAGES_PARALLEL", False
+        )
+        spider.redirect_links_enabled = crawler.settings.getbool(
+            "REDIRECT_LINKS_ENABLED", False
+        )
+        spider.redirect_links_batch_size = crawler.settings.getint(
+            "REDIRECT_LINKS_BATCH_SIZE", 100
+        )
+        spider.redirect_links = {}
+        spider.new_redirect_links = {}
+        spider.db = None
+        spider.jobdir = job_dir(crawler.settings)
+        spider.resumed = False
+        # Product pages whose item is waiting for its availability checks.
+        spider.pending_products = set()
+        spider.product_urls = kwargs.get("product_urls", "").split()
+        spider.seed = kwargs.get("seed")
+        spider.crawl_kind = (
+            "refresh" if spider.product_urls or spider.seed == "due" else "full"
+        )
+        spider.recrawl_budget = int(
+            kwargs.get("budget", crawler.settings.getint("RECRAWL_BUDGET", 1000))
+        )
+        spider.recrawl_min_interval = timedelta(
+            days=crawler.settings.getfloat("RECRAWL_MIN_INTERVAL", 1)
+        )
+        spider.recrawl_max_interval = timedelta(
+            days=crawler.settings.getfloat("RECRAWL_MAX_INTERVAL", 30)
+        )
+        spider.discovery = spider.use_discovery(
+            kwargs.get("discovery", "auto"),
+            crawler.settings.getfloat("SEED_DISCOVERY_INTERVAL", 7),
+        )
+        return spider
+
+    def use_discovery(self, mode, interval):
+        """
+        Decides whether the crawl walks the catalog to find products.
+
+        Args:
+            mode: "auto", "always" or "never", only used by seeded crawls.
+            interval: Days between catalog walks in "auto" mode.
+
+        Returns:
+            True if the crawl walks the catalog.
+        """
+        if self.crawl_kind == "refresh":
+            return False
+        if not self.seed or mode == "always":
+            return True
+        if mode == "never":
+            return False
+
+        conn = connect()
+        try:
+            finished_at = last_discovery(conn, self.company_name)
+        finally:
+            conn.close()
+        return finished_at is None or (
+            datetime.now(timezone.utc) - finished_at > timedelta(days=interval)
+        )
+
+    def get_db(self):
+        """
+        Returns the spider's database connection, opening it on first use.
+        """
+        if self.db is None:
+            self.db = connect()
+        return self.db
+
+    def load_seed_urls(self):
+        """
+        Loads the product pages a seeded crawl starts from. For seed=due, the
+        recrawl of all products is planned first.
+
+        Returns:
+            A list of product URLs.
+        """
+        if self.seed == "db":
+            return load_product_urls(self.get_db(), self.company_name)
+        if self.seed == "due":
+            plan_recrawl(
+                self.get_db(),
+                self.company_name,
+                self.recrawl_min_interval,
+                self.recrawl_max_interval,
+            )
+            return load_due_product_urls(
+                self.get_db(), self.company_name, self.recrawl_budget
+            )
+        with open(self.seed) as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def start_requests(self):
+        """
+        Loads the catalog links resolved by previous crawls before crawling.
+
+        A refresh skips the catalog and requests the given product pages, which
+        are parsed like the ones found in the categories. A seeded crawl requests
+        the known product pages first, and then walks the catalog only if
+        discovery is on. Product pages found again in the catalog are dropped by
+        the dupefilter. The pages of a refresh or of a ``seed=due`` crawl are
+        fetched even if a previous crawl fetched them recently.
+
+        A resumed crawl first fetches again the product pages whose item was
+        still waiting for its availability when the crawl stopped, since the
+        availability requests aren't kept in the job directory. The pages already
+        requested before the stop are dropped by the dupefilter.
+
+        Yields:
+            Request objects for the start URLs, or for the product pages.
+        """
+        yield from self.resume()
+
+        if self.product_urls:
+            for url in self.product_urls:
+                yield scrapy.Request(
+                    url,
+                    callback=self.parse_chemical,
+                    priority=PRODUCT_PRIORITY,
+                    dont_filter=not self.resumed,
+                )
+            return
+
+        if self.seed:
+            urls = self.load_seed_urls()
+            self.logger.info(
+                "Seeded %d product pages, discovery %s",
+                len(urls),
+                "on" if self.discovery else "off",
+            )
+            for url in urls:
+                yield scrapy.Request(
+                    url,
+                    callback=self.parse_chemical,
+                    priority=PRODUCT_PRIORITY,
+                    dont_filter=self.seed == "due" and not self.resumed,
+                )
+            if not self.discovery:
+                return
+
+        if self.redirect_links_enabled:
+            self.redirect_links = load_redirect_links(self.get_db(), self.company_name)
+            self.logger.info("Loaded %d known catalog links", len(self.redirect_links))
+        yield from super().start_requests()
+
+    def resume(self):
+        """
+        Restores the pending product pages from the job directory, if the crawl
+        is resumed.
+
+        The pending product pages are kept in the spider state, which Scrapy
+        saves in the job directory when the spider closes.
+
+        Yields:
+            Request objects for the product pages whose item was pending.
+        """
+        state = getattr(self, "state", None)
+        if state is None:
+            return
+        self.resumed = "pending_products" in state
+        self.pending_products = state.setdefault("pending_products", set())
+        if not self.resumed:
+            return
+        self.logger.info(
+            "Resuming crawl, %d pending product pages", len(self.pending_products)
+        )
+        for url in list(self.pending_products):
+            yield scrapy.Request(
+                url,
+                callback=self.parse_chemical,
+                priority=PRODUCT_PRIORITY,
+                dont_filter=True,
+            )
+
+    def closed(self, reason):
+        """
+        Stores the catalog links resolved in this crawl and closes the database
+        connection. The job directory of a finished crawl is deleted, as there is
+        nothing left to resume.
+
+        Args:
+            reason: The reason the spider was closed.
+        """
+        if self.db is not None:
+            self.save_new_redirect_links()
+            self.db.close()
+        if reason == "finished" and self.jobdir:
+            shutil.rmtree(self.jobdir, ignore_errors=True)
 
     def parse(self, response):
         """
@@ -29,13 +297,16 @@ class AstatechincComSpider(scrapy.Spider):
 
         for name in categories_names:
             url = f"https://www.astatechinc.com/ConcordCatagory.php?CCatagory={name}"
-            yield scrapy.Request(url, callback=self.parse_category)
+            yield scrapy.Request(
+                url, callback=self.parse_category, priority=CATEGORY_PRIORITY
+            )
 
     def parse_category(self, response):
         """
         Parses the category page and extracts chemical URLs.
         Sends requests to get the redirect links for each chemical.
-        If there are more pages, sends request to the next page of the category.
+        If there are more pages, sends requests to all remaining pages of the
+        category at once, or to the next page if the pager can't be read.
 
         Args:
             response: The response object.
@@ -46,14 +317,76 @@ class AstatechincComSpider(scrapy.Spider):
         chemicals = response.xpath('//a[contains(@href, "cat=")]')
         for chemical in chemicals:
             url = chemical.xpath("@href").get()
-            yield scrapy.Request(url, callback=self.get_redirect_link)
-
-        if self.check_if_last_page(response):
-            next_page = (
-                self.domain
-                + response.xpath('//a[contains(text(), "Next")]/@href').get()
+            product_url = None
+            if self.redirect_links_enabled:
+                product_url = self.redirect_links.get(url)
+            if product_url:
+                yield scrapy.Request(
+                    product_url,
+                    callback=self.parse_chemical,
+                    errback=self.redirect_link_failed,
+                    priority=PRODUCT_PRIORITY,
+                    meta={"catalog_url": url},
+                )
+            else:
+                yield scrapy.Request(
+                    url,
+                    callback=self.get_redirect_link,
+                    priority=REDIRECT_PRIORITY,
+                    meta={"catalog_url": url},
+                )
+
+        if response.meta.get("all_pages_scheduled"):
+            return
+
+        next_href = response.xpath('//a[contains(text(), "Next")]/@href').get()
+        if not next_href or not self.check_if_last_page(response):
+            return
+        next_page = self.domain + next_href
+
+        page_urls = None
+        pager = self.parse_pager(response)
+        if self.category_pages_parallel and pager is not None:
+            page_urls = self.get_page_urls(next_page, *pager)
+
+        if page_urls:
+            for url in page_urls:
+                yield scrapy.Request(
+                    url,
+                    callback=self.parse_category,
+                    priority=CATEGORY_PRIORITY,
+                    meta={"all_pages_scheduled": True},
+                )
+        else:
+            yield scrapy.Request(
+                next_page, callback=self.parse_category, priority=CATEGORY_PRIORITY
             )
-            yield scrapy.Request(next_page, callback=self.parse_category)
+
+    def get_page_urls(self, next_page, current_page, last_page):
+        """
+        Builds the URLs of all remaining pages of a category from its Next link.
+
+        The page parameter is the query parameter of the Next link whose value
+        is the next page number.
+
+        Args:
+            next_page: URL of the next page.
+            current_page: Number of the current page.
+            last_page: Number of the last page.
+
+        Returns:
+            A list of URLs, or None if the page parameter can't be found.
+        """
+        query = parse_qs(urlparse(next_page).query)
+        page_params = [
+            key for key, values in query.items() if values == [str(current_page + 1)]
+        ]
+        if len(page_params) != 1:
+            return None
+        return [next_page] + [
+            add_or_replace_parameter(next_page, page_params[0], str(page))
+            for page in range(current_page + 2, last_page + 1)
+        ]
 
     def get_redirect_link(self, response):
         """
@@ -66,52 +399,120 @@ class AstatechincComSpider(scrapy.Spider):
             Request object to parse the chemical details.
         """
         url = response.text.split("window.parent.location='")[1].split("'")[0]
-        yield scrapy.Request(self.domain + url, callback=self.parse_chemical)
+        if self.redirect_links_enabled:
+            self.remember_redirect_link(response.meta["catalog_url"], self.domain + url)
+        yield scrapy.Request(
+            self.domain + url, callback=self.parse_chemical, priority=PRODUCT_PRIORITY
+        )
 
-    def check_if_last_page(self, response):
+    def remember_redirect_link(self, catalog_url, product_url):
         """
-        Checks if the current page is the last page in the category.
+        Queues a resolved catalog link to be stored for the next crawls.
+
+        Args:
+            catalog_url: The catalog link from the category page.
+            product_url: The product page it redirects to.
+        """
+        self.new_redirect_links[catalog_url] = product_url
+        if len(self.new_redirect_links) >= self.redirect_links_batch_size:
+            self.save_new_redirect_links()
+
+    def save_new_redirect_links(self):
+        """
+        Stores the queued catalog links in the database.
+        """
+        if self.new_redirect_links:
+            save_redirect_links(
+                self.get_db(), self.company_name, self.new_redirect_links
+            )
+            self.redirect_links.update(self.new_redirect_links)
+            self.new_redirect_links = {}
+
+    def redirect_link_failed(self, failure):
+        """
+        Resolves a catalog link again when its stored product URL fails.
+
+        Args:
+            failure: The failure of the product page request.
+
+        Yields:
+            Request object to get the redirect link of the catalog link.
+        """
+        catalog_url = failure.request.meta["catalog_url"]
+        self.logger.info(
+            "Stored product URL %s failed, resolving %s again",
+            failure.request.url,
+            catalog_url,
+        )
+        self.redirect_links.pop(catalog_url, None)
+        delete_redirect_link(self.get_db(), catalog_url)
+        yield scrapy.Request(
+            catalog_url,
+            callback=self.get_redirect_link,
+            priority=REDIRECT_PRIORITY,
+            meta={"catalog_url": catalog_url},
+            dont_filter=True,
+        )
+
+    def parse_pager(self, response):
+        """
+        Reads the "N of M" pager text of a category page.
 
         Args:
             response: The response object.
 
         Returns:
-            True if it's not the last page, False otherwise.
+            A tuple of the current and the last page number, or None if the
+            page has no pager.
         """
         pages = response.xpath(
             '//span[@style="margin-right:0.3em;"]/following-sibling::text()'
         ).get()
-        pages = pages[2:-2].split(" of ")
-        current_page, last_page = pages[0], pages[1]
-        return last_page != current_page
+        match = re.search(r"(\d+) of (\d+)", pages or "")
+        if not match:
+            return None
+        return int(match.group(1)), int(match.group(2))
 
-    def get_availability_urls(self, response):
+    def check_if_last_page(self, response):
         """
-        Extracts the availability URLs for each chemical.
+        Checks if the current page is the last page in the category.
 
         Args:
             response: The response object.
 
+        Returns:
+            True if it's not the last page, False otherwise. Pages without a
+            pager are not treated as the last page, so the Next link is
+            followed.
+        """
+        pager = self.parse_pager(response)
+        if pager is None:
+            return True
+        current_page, last_page = pager
+        return last_page != current_page
+
+    def get_availability_urls(self, product):
+        """
+        Builds the availability URLs for each pack of the chemical.
+
+        Args:
+            product: The data returned by extract_product.
+
         Returns:
             A list of URLs.
         """
-        n = 1
-        urls = []
-        all_units = response.xpath(
-            '//tr[.//span[contains(text(), "Please enter Qty to check availability")]]'
-        )
-        for unit in all_units:
-            catalog = response.css("#Catalog::text").get()
-            size = unit.css(f"#su{n}::text").get()
-            url = f"https://astatechinc.com/CGetInv.php?Catalog={catalog}&SUX={size}&QTY=1&QTYX={n}"
-            urls.append(url)
-            n += 1
-        return urls
+        return [
+            f"https://astatechinc.com/CGetInv.php?Catalog={product['catalog']}"
+            f"&SUX={pack['size']}&QTY=1&QTYX={pack['number']}"
+            for pack in product["packs"]
+        ]
 
     def parse_chemical(self, response):
         """
         Parses the chemical details page and yields the extracted data.
-        Sends requests to check the availability of the chemical.
+        Sends requests to check the availability of the chemical, unless the
+        availability endpoint is failing, in which case the stored availability
+        is used.
 
         Args:
             response: The response object.
@@ -119,62 +520,88 @@ class AstatechincComSpider(scrapy.Spider):
         Yields:
             Item object with the extracted data.
         """
-        qt_list = []
-        unit_list = []
-        currency_list = []
-        price_pack_list = []
-        n = 1
-
-        numcas = response.xpath(
-            '//td[contains(text(), "CAS")]/following-sibling::td[1]/text()'
-        ).get()
-        if not numcas:
+        product = extract_product(response)
+        if not product:
             return None
 
-        availability_urls = self.get_availability_urls(response)
-
-        tr_tags = response.xpath(
-            '//tr[.//span[contains(text(), "Please enter Qty to check availability")]]'
-        )
-        for _ in tr_tags:
-            qt_and_unit = response.xpath(f'//span[@id="su{n}"]/text()').get().split("/")
-            currency = (
-                response.xpath('//td[contains(text(), "Price")]/text()')
-                .get()
-                .split("(")[-1]
-                .replace(")", "")
-            )
-            price = response.xpath(f'//input[@id="UnitPrice{n}"]/@value').get()
-            qt_list.append(qt_and_unit[0])
-            unit_list.append(qt_and_unit[1])
-            currency_list.append(currency)
-            price_pack_list.append(price)
-            n += 1
-
+        packs = product["packs"]
         item = {
             "datetime": datetime.now(),
             "availability": [],
-            "company_name": "AstaTech",
+            "company_name": self.company_name,
             "product_url": response.url,
-            "numcas": numcas,
-            "name": response.xpath(
-                '//td[contains(text(), "Compound")]/following-sibling::td[1]/text()'
-            )
-            .get()
-            .strip(),
-            "qt_list": qt_list,
-            "unit_list": unit_list,
-            "currency_list": currency_list,
-            "price_pack_list": price_pack_list,
+            "numcas": product["numcas"],
+            "name": product["name"],
+            "qt_list": [pack["qt"] for pack in packs],
+            "unit_list": [pack["unit"] for pack in packs],
+            "currency_list": [product["currency"]] * len(packs),
+            "price_pack_list": [pack["price"] for pack in packs],
+            "availability_stale": False,
         }
 
+        availability_urls = self.get_availability_urls(product)
+        if availability_urls and not self.availability_breaker.allow():
+            yield self.stale_availability(item)
+            return
+
+        self.pending_products.add(response.url)
         yield from self.process_additional_requests(availability_urls, item)
 
+    def stale_availability(self, item):
+        """
+        Fills the availability of an item from the stored row of its product.
+
+        Args:
+            item: The item object.
+
+        Returns:
+            The item, flagged as having a stale availability.
+        """
+        if self.stored_availability is None:
+            self.stored_availability = load_availability(
+                self.get_db(), self.company_name
+            )
+        item["availability"] = self.stored_availability.get(item["product_url"], False)
+        item["availability_stale"] = True
+        self.crawler.stats.inc_value("availability/stale", spider=self)
+        return item
+
+    def record_availability(self, response):
+        """
+        Records a successful availability check in the circuit breaker. A check
+        slower than AVAILABILITY_BREAKER_SLOW counts as a failure.
+
+        Args:
+            response: The response of the availability request.
+        """
+        latency = response.meta.get("download_latency", 0)
+        self.record_breaker(latency <= self.availability_slow)
+
+    def record_breaker(self, ok):
+        """
+        Records the result of an availability check in the circuit breaker,
+        logging when it opens or closes.
+
+        Args:
+            ok: Whether the check succeeded.
+        """
+        was_closed = self.availability_breaker.state == CircuitBreaker.CLOSED
+        self.availability_breaker.record(ok)
+        is_closed = self.availability_breaker.state == CircuitBreaker.CLOSED
+        if was_closed and not is_closed:
+            self.logger.warning("Availability checks failing, using stored values")
+            self.crawler.stats.inc_value("availability/breaker_opened", spider=self)
+        elif is_closed and not was_closed:
+            self.logger.info("Availability checks resumed")
+
     def process_additional_requests(self, urls, item):
         """
         Processes additional requests to check the availability of the chemical.
         Yields the item with updated availability information.
 
+        In "parallel" mode all availability requests are sent at once,
+        otherwise they are chained one after another.
+
         Args:
             urls: List of availability URLs.
             item: The item object.
@@ -182,22 +609,42 @@ class AstatechincComSpider(scrapy.Spider):
         Yields:
             Request objects to check the availability of the chemical.
         """
-        if not urls:
-            if True in item["availability"]:
-                item["availability"] = True
-            else:
-                item["availability"] = False
-
-            yield item
+        if self.availability_mode == "parallel":
+            yield from self.check_availability_in_parallel(urls, item)
+        elif not urls:
+            yield self.finalize_availability(item)
         else:
             url = urls[0]
             remaining_urls = urls[1:]
             yield scrapy.Request(
                 url,
                 callback=self.get_availability,
-                meta={"urls": remaining_urls, "item": item},
+                errback=self.availability_failed,
+                priority=AVAILABILITY_PRIORITY,
+                meta={
+                    "urls": remaining_urls,
+                    "item": item,
+                    "download_timeout": self.availability_timeout,
+                    "max_retry_times": self.availability_max_retries,
+                    "keep_in_memory": True,
+                },
+                dont_filter=True,
             )
 
+    def finalize_availability(self, item):
+        """
+        Collapses the availability collected for every pack into one flag.
+
+        Args:
+            item: The item object.
+
+        Returns:
+            The item with a boolean availability.
+        """
+        self.pending_products.discard(item["product_url"])
+        item["availability"] = True in item["availability"]
+        return item
+
     def get_availability(self, response):
         """
         Extracts availability information from the response and updates the item.
@@ -209,12 +656,191 @@ class AstatechincComSpider(scrapy.Spider):
         Yields:
             Request objects for remaining availability URLs.
         """
+        self.record_availability(response)
         item = response.meta["item"]
-
-        if "in stock" in response.text or "in China stock" in response.text:
-            item["availability"].append(True)
-        else:
-            item["availability"].append(False)
+        item["availability"].append(self.is_in_stock(response))
 
         remaining_urls = response.meta["urls"]
         yield from self.process_additional_requests(remaining_urls, item)
+
+    def is_in_stock(self, response):
+        """
+        Checks whether an availability response reports the pack as in stock.
+
+        Args:
+            response: The response object.
+
+        Returns:
+            True if the pack is in stock, False otherwise.
+        """
+        return "in stock" in response.text or "in China stock" in response.text
+
+    def check_availability_in_parallel(self, urls, item):
+        """
+        Sends all availability requests of a chemical at once.
+
+        The requests share one AvailabilityCheck, and the item is yielded by
+        whichever callback or errback resolves the last pending pack. Each
+        request has its own download timeout, so a slow pack is counted as
+        unavailable instead of holding the item.
+
+        Args:
+            urls: List of availability URLs.
+            item: The item object.
+
+        Yields:
+            Request objects to check the availability of the chemical.
+        """
+        if not urls:
+            yield self.finalize_availability(item)
+            return
+
+        check = AvailabilityCheck(item, len(urls))
+        for url in urls:
+            yield scrapy.Request(
+                url,
+                callback=self.get_parallel_availability,
+                errback=self.availability_failed,
+                priority=AVAILABILITY_PRIORITY,
+                meta={
+                    "availability_check": check,
+                    "download_timeout": self.availability_timeout,
+                    "max_retry_times": self.availability_max_retries,
+                    "keep_in_memory": True,
+                },
+                dont_filter=True,
+            )
+
+    def get_parallel_availability(self, response):
+        """
+        Records the availability of one pack checked in parallel.
+
+        Args:
+            response: The response object.
+
+        Yields:
+            The item once every pack of the chemical has been checked.
+        """
+        self.record_availability(response)
+        check = response.meta["availability_check"]
+        if check.add(self.is_in_stock(response)):
+            yield self.finalize_availability(check.item)
+
+    def availability_failed(self, failure):
+        """
+        Records a failed or timed out availability check as a missing result.
+
+        Args:
+            failure: The failure of the availability request.
+
+        Yields:
+            The next availability request in "serial" mode, or the item, with
+            partial availability, once every pack has resolved.
+        """
+        self.logger.warning(
+            "Availability check failed for %s: %s",
+            failure.request.url,
+            failure.getErrorMessage(),
+        )
+        self.crawler.stats.inc_value("availability/failed", spider=self)
+        self.record_breaker(False)
+        meta = failure.request.meta
+        if "availability_check" not in meta:
+            yield from self.process_additional_requests(meta["urls"], meta["item"])
+            return
+        check = meta["availability_check"]
+        if check.add(None):
+            yield self.finalize_availability(check.item)
+
+
+class AvailabilityCheck:
+    """
+    Availability results of one chemical whose packs are checked in parallel.
+    """
+
+    def __init__(self, item, pending):
+        """
+        Args:
+            item: The item waiting for its availability.
+            pending: Number of availability requests sent for the item.
+        """
+        self.item = item
+        self.pending = pending
+
+    def add(self, in_stock):
+        """
+        Records the result of one availability request.
+
+        Args:
+            in_stock: True or False, or None if the check failed.
+
+        Returns:
+            True if this was the last pending result.
+        """
+        if in_stock is not None:
+            self.item["availability"].append(in_stock)
+        self.pending -= 1
+        return self.pending == 0
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of the availability checks.
+
+    While closed, the checks are sent. It opens after `max_failures` failed
+    checks in a row, and the checks are skipped. Once `reset_timeout` seconds
+    have passed, one product's checks are let through as a probe (half-open),
+    and their first result closes or opens the circuit again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, max_failures, reset_timeout):
+        """
+        Args:
+            max_failures: Number of failed checks in a row opening the circuit.
+            reset_timeout: Seconds before an open circuit lets a probe through.
+        """
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+
+    def allow(self):
+        """
+        Checks whether a product's availability can be checked.
+
+        Returns:
+            True if the circuit is closed, or if this product is the probe of an
+            open circuit.
+        """
+        if (
+            self.state == self.OPEN
+            and time.monotonic() - self.opened_at >= self.reset_timeout
+        ):
+            self.state = self.HALF_OPEN
+            return True
+        return self.state == self.CLOSED
+
+    def record(self, ok):
+        """
+        Records the result of a check. Results of checks sent before the circuit
+        opened are ignored while it is open.
+
+        Args:
+            ok: Whether the check succeeded.
+        """
+        if self.state == self.OPEN:
+            return
+        if ok:
+            self.state = self.CLOSED
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.max_failures:
+            self.state = self.OPEN
+            self.failures = 0
+            self.opened_at = time.monotonic()
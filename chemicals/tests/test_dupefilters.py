@@ -0,0 +1,48 @@
+from unittest import TestCase
+
+from scrapy import Request, Spider
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+
+from chemicals.dupefilters import PersistentDupeFilter
+from chemicals.signals import items_written
+
+PRODUCT_URL = "https://www.astatechinc.com/ProductDetail.php?id=1"
+
+
+class PersistentDupeFilterTestCase(TestCase):
+    def setUp(self):
+        self.crawler = get_crawler(
+            Spider,
+            {"DUPEFILTER_PATH": ":memory:", "DUPEFILTER_DEFAULT_TTL": 3600},
+        )
+        self.spider = Spider("test")
+        self.dupefilter = PersistentDupeFilter.from_crawler(self.crawler)
+        self.dupefilter.batch_size = 1
+        self.addCleanup(self.dupefilter.close, "finished")
+
+    def fetch(self, url):
+        request = Request(url)
+        self.dupefilter.response_received(
+            Response(url, status=200), request, self.spider
+        )
+        return self.dupefilter.request_fingerprint(request)
+
+    def test_page_is_recorded_once_its_item_is_written(self):
+        fp = self.fetch(PRODUCT_URL)
+        self.assertFalse(self.dupefilter.is_fresh(fp, 3600))
+
+        self.crawler.signals.send_catch_log(
+            items_written, product_urls=[PRODUCT_URL], spider=self.spider
+        )
+        self.assertTrue(self.dupefilter.is_fresh(fp, 3600))
+
+    def test_page_without_written_item_is_not_recorded(self):
+        fp = self.fetch(PRODUCT_URL)
+        self.crawler.signals.send_catch_log(
+            items_written,
+            product_urls=["https://www.astatechinc.com/ProductDetail.php?id=2"],
+            spider=self.spider,
+        )
+        self.dupefilter.flush()
+        self.assertFalse(self.dupefilter.is_fresh(fp, 3600))
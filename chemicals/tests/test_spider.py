@@ -0,0 +1,188 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+from twisted.python.failure import Failure
+
+from chemicals.spiders.astatechinc_com import (
+    AstatechincComSpider,
+    AvailabilityCheck,
+    CircuitBreaker,
+)
+
+PRODUCT_URL = "https://www.astatechinc.com/product.php"
+PRODUCT_PAGE = """<html><body><table>
+<tr><td>Catalog #</td><td><span id="Catalog">A12345</span></td></tr>
+<tr><td>Compound Name</td><td>Chemical A</td></tr>
+<tr><td>CAS No</td><td>12345</td></tr>
+<tr><td>Price ($)</td><td>Size</td></tr>
+<tr><td><span id="su1">1/g</span></td>
+<td><input id="UnitPrice1" value="10"/></td>
+<td><span>Please enter Qty to check availability</span></td></tr>
+<tr><td><span id="su2">5/g</span></td>
+<td><input id="UnitPrice2" value="40"/></td>
+<td><span>Please enter Qty to check availability</span></td></tr>
+</table></body></html>"""
+
+
+@patch("chemicals.spiders.astatechinc_com.time.monotonic", return_value=0)
+class CircuitBreakerTestCase(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(max_failures=2, reset_timeout=60)
+
+    def test_opens_after_failures_in_a_row(self, monotonic):
+        self.breaker.record(False)
+        self.breaker.record(True)
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_ignores_results_while_open(self, monotonic):
+        self.breaker.record(False)
+        self.breaker.record(False)
+        # A check sent before the circuit opened.
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_lets_one_probe_through_after_timeout(self, monotonic):
+        self.breaker.record(False)
+        self.breaker.record(False)
+        monotonic.return_value = 59
+        self.assertFalse(self.breaker.allow())
+
+        monotonic.return_value = 60
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_successful_probe_closes(self, monotonic):
+        self.breaker.record(False)
+        self.breaker.record(False)
+        monotonic.return_value = 60
+        self.breaker.allow()
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_opens_again(self, monotonic):
+        self.breaker.record(False)
+        self.breaker.record(False)
+        monotonic.return_value = 60
+        self.breaker.allow()
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        monotonic.return_value = 119
+        self.assertFalse(self.breaker.allow())
+        monotonic.return_value = 120
+        self.assertTrue(self.breaker.allow())
+
+
+class AvailabilityFallbackTestCase(TestCase):
+    def setUp(self):
+        self.crawler = get_crawler(
+            AstatechincComSpider, {"AVAILABILITY_BREAKER_FAILURES": 1}
+        )
+        self.spider = AstatechincComSpider.from_crawler(self.crawler)
+        self.spider.stored_availability = {PRODUCT_URL: True}
+        self.response = HtmlResponse(PRODUCT_URL, body=PRODUCT_PAGE, encoding="utf-8")
+
+    def test_closed_breaker_checks_availability(self):
+        (request,) = self.spider.parse_chemical(self.response)
+        self.assertIsInstance(request, Request)
+        self.assertIn("/CGetInv.php", request.url)
+
+    def test_open_breaker_uses_stored_availability(self):
+        self.spider.record_breaker(False)
+
+        (item,) = self.spider.parse_chemical(self.response)
+        self.assertIs(item["availability"], True)
+        self.assertIs(item["availability_stale"], True)
+        self.assertEqual(self.spider.pending_products, set())
+        stats = self.crawler.stats
+        self.assertEqual(stats.get_value("availability/breaker_opened"), 1)
+        self.assertEqual(stats.get_value("availability/stale"), 1)
+
+    def test_unknown_product_is_unavailable(self):
+        self.spider.record_breaker(False)
+        self.spider.stored_availability = {}
+
+        (item,) = self.spider.parse_chemical(self.response)
+        self.assertIs(item["availability"], False)
+        self.assertIs(item["availability_stale"], True)
+
+
+class AvailabilityCheckTestCase(TestCase):
+    def test_last_result_completes_the_check(self):
+        item = {"availability": []}
+        check = AvailabilityCheck(item, 3)
+        self.assertFalse(check.add(False))
+        self.assertFalse(check.add(None))
+        self.assertTrue(check.add(True))
+        # Failed checks are left out of the results.
+        self.assertEqual(item["availability"], [False, True])
+
+
+class ParallelAvailabilityTestCase(TestCase):
+    def setUp(self):
+        crawler = get_crawler(AstatechincComSpider)
+        self.spider = AstatechincComSpider.from_crawler(
+            crawler, availability_mode="parallel"
+        )
+        response = HtmlResponse(PRODUCT_URL, body=PRODUCT_PAGE, encoding="utf-8")
+        self.requests = list(self.spider.parse_chemical(response))
+
+    def respond(self, request, body):
+        response = HtmlResponse(request.url, body=body, request=request)
+        return list(self.spider.get_parallel_availability(response))
+
+    def fail(self, request):
+        try:
+            raise TimeoutError("Availability check timed out")
+        except TimeoutError:
+            failure = Failure()
+        failure.request = request
+        return list(self.spider.availability_failed(failure))
+
+    def test_requests_are_sent_at_once(self):
+        self.assertEqual(len(self.requests), 2)
+        self.assertIs(
+            self.requests[0].meta["availability_check"],
+            self.requests[1].meta["availability_check"],
+        )
+        self.assertEqual(self.spider.pending_products, {PRODUCT_URL})
+
+    def test_item_is_yielded_by_the_last_response(self):
+        self.assertEqual(self.respond(self.requests[1], b"out of stock"), [])
+        (item,) = self.respond(self.requests[0], b"in stock")
+        self.assertIs(item["availability"], True)
+        self.assertEqual(self.spider.pending_products, set())
+
+    def test_item_is_yielded_by_the_last_failure(self):
+        self.assertEqual(self.respond(self.requests[0], b"out of stock"), [])
+        (item,) = self.fail(self.requests[1])
+        self.assertIs(item["availability"], False)
+        self.assertEqual(self.spider.pending_products, set())
+
+
+class RedirectLinkFailedTestCase(TestCase):
+    @patch("chemicals.spiders.astatechinc_com.delete_redirect_link")
+    @patch("chemicals.spiders.astatechinc_com.connect")
+    def test_stale_link_is_deleted(self, connect, delete_redirect_link):
+        spider = AstatechincComSpider.from_crawler(get_crawler(AstatechincComSpider))
+        catalog_url = "https://www.astatechinc.com/Catalog.php?Catalog=A12345"
+        spider.redirect_links = {catalog_url: PRODUCT_URL}
+        try:
+            raise TimeoutError("Product page timed out")
+        except TimeoutError:
+            failure = Failure()
+        failure.request = Request(PRODUCT_URL, meta={"catalog_url": catalog_url})
+
+        (request,) = spider.redirect_link_failed(failure)
+        self.assertEqual(request.url, catalog_url)
+        self.assertEqual(spider.redirect_links, {})
+        delete_redirect_link.assert_called_once_with(connect.return_value, catalog_url)
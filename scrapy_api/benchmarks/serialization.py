@@ -0,0 +1,110 @@
+"""
+Benchmark of the chemicals list serialization.
+
+Compares ChemicalsSerializer with the read-only fast path of
+scrapy_app.serializers (.values() rows encoded by dumps) on the same rows,
+and checks that both produce the same JSON. The rows are inserted in a
+transaction that is rolled back at the end.
+
+Usage (from the scrapy_api/ folder, with the database settings exported):
+    python benchmarks/serialization.py [--rows 10000] [--number 5]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+import django
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "scrapy_api.settings")
+django.setup()
+
+from django.core.serializers.json import DjangoJSONEncoder  # noqa: E402
+from django.db import transaction  # noqa: E402
+
+from scrapy_app.models import Chemicals  # noqa: E402
+from scrapy_app.serializers import (  # noqa: E402
+    ChemicalsSerializer,
+    chemicals_values,
+    dumps,
+    orjson,
+)
+
+NUMCAS = "benchmark-0000"
+
+
+def create_rows(rows):
+    """
+    Inserts benchmark rows sharing one CAS number.
+
+    Args:
+        rows: Number of rows to insert.
+    """
+    Chemicals.objects.bulk_create(
+        Chemicals(
+            availability=True,
+            company_name="Benchmark",
+            product_url=f"https://example.com/product{n}",
+            numcas=NUMCAS,
+            name=f"Benchmark compound {n}",
+            qt_list=[1.0, 5.0, 25.0],
+            unit_list=["g", "g", "g"],
+            currency_list=["$", "$", "$"],
+            price_pack_list=["10.00", "40.00", "150.00"],
+        )
+        for n in range(rows)
+    )
+
+
+def serializer_json():
+    """
+    Encodes the rows like the list view did before the fast path.
+
+    Returns:
+        The JSON bytes.
+    """
+    queryset = Chemicals.objects.filter(numcas=NUMCAS)
+    data = ChemicalsSerializer(queryset, many=True).data
+    return json.dumps({"data": data}, cls=DjangoJSONEncoder).encode()
+
+
+def fast_json():
+    """
+    Encodes the rows with the read-only fast path.
+
+    Returns:
+        The JSON bytes.
+    """
+    rows = list(chemicals_values(Chemicals.objects.filter(numcas=NUMCAS)))
+    return dumps({"data": rows})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--number", type=int, default=5)
+    args = parser.parse_args()
+
+    with transaction.atomic():
+        create_rows(args.rows)
+
+        assert json.loads(serializer_json()) == json.loads(fast_json())
+
+        serializer = timeit.timeit(serializer_json, number=args.number)
+        fast = timeit.timeit(fast_json, number=args.number)
+
+        transaction.set_rollback(True)
+
+    serializer_ms = serializer / args.number * 1e3
+    fast_ms = fast / args.number * 1e3
+    print(f"rows:                {args.rows}")
+    print(f"json encoder:        {'orjson' if orjson is not None else 'json'}")
+    print(f"ChemicalsSerializer: {serializer_ms:8.1f} ms")
+    print(f"values() fast path:  {fast_ms:8.1f} ms")
+    print(f"speedup:             {serializer / fast:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
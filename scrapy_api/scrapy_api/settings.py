@@ -111,6 +111,50 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Local memory by default, a Redis server shared by all workers if REDIS_URL is set.
+
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Seconds a cached API response is kept, and seconds before checking for a newly
+# finished crawl run.
+CHEMICALS_CACHE_TIMEOUT = int(os.getenv("CHEMICALS_CACHE_TIMEOUT", 3600))
+CHEMICALS_CACHE_VERSION_TIMEOUT = int(os.getenv("CHEMICALS_CACHE_VERSION_TIMEOUT", 5))
+
+# Default and maximum number of rows of a chemicals list page.
+CHEMICALS_PAGE_SIZE = 100
+CHEMICALS_MAX_PAGE_SIZE = 1000
+
+# Maximum number of CAS numbers of one batch lookup.
+CHEMICALS_BATCH_MAX_SIZE = 500
+
+# Seconds to wait for scrapyd, and seconds its job list is cached by the status
+# endpoint.
+SCRAPYD_TIMEOUT = 10
+SCRAPYD_STATUS_CACHE_TIMEOUT = 5
+
+# Seconds after which a pending crawl run whose job scrapyd doesn't know is
+# considered lost and marked as failed.
+SCRAPYD_LAUNCH_TIMEOUT = int(os.getenv("SCRAPYD_LAUNCH_TIMEOUT", 60))
+
+# Folder of the crawls' job directories on the scrapyd host. A crawl run keeps
+# its request queue there, so it can be resumed after its job stopped.
+SCRAPYD_JOBS_DIR = os.getenv("SCRAPYD_JOBS_DIR", "jobs")
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -0,0 +1,74 @@
+"""
+Response cache of the chemicals API.
+
+The API data only changes when a crawl run finishes, so every cache key
+includes a data version derived from the latest finished crawl run of each
+company. A finished crawl changes the version, which makes the entries of the
+older data unreachable; they simply expire.
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+
+from .models import CrawlRun
+
+DATA_VERSION_KEY = "chemicals:data-version"
+
+# Striped locks used to coalesce concurrent misses of the same key.
+LOCKS = [threading.Lock() for _ in range(64)]
+
+
+def get_data_version():
+    """
+    Returns the version token of the data served by the API.
+
+    The token is itself cached for CHEMICALS_CACHE_VERSION_TIMEOUT seconds, which
+    bounds how long a finished crawl can go unnoticed.
+
+    Returns:
+        A short string that changes whenever a crawl run of any company finishes.
+    """
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        runs = (
+            CrawlRun.objects.filter(status=CrawlRun.Status.FINISHED)
+            .values_list("company_name")
+            .annotate(Max("id"))
+            .order_by("company_name")
+        )
+        version = hashlib.md5(repr(list(runs)).encode()).hexdigest()[:12]
+        cache.set(DATA_VERSION_KEY, version, settings.CHEMICALS_CACHE_VERSION_TIMEOUT)
+    return version
+
+
+def get_or_compute(name, params, compute):
+    """
+    Returns a cached value, computing and caching it on a miss.
+
+    Concurrent misses of the same key in this process wait for the first one
+    instead of all running `compute`.
+
+    Args:
+        name (str): Name of the cached endpoint.
+        params (tuple): Request parameters the value depends on.
+        compute (callable): Function computing the value, which must not be None.
+
+    Returns:
+        The cached or computed value.
+    """
+    digest = hashlib.md5(repr(params).encode()).hexdigest()
+    key = f"chemicals:{get_data_version()}:{name}:{digest}"
+
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    with LOCKS[hash(key) % len(LOCKS)]:
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.set(key, value, settings.CHEMICALS_CACHE_TIMEOUT)
+    return value
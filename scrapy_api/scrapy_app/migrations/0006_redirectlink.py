@@ -0,0 +1,31 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:09
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0005_alter_chemicals_options"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RedirectLink",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("company_name", models.CharField(max_length=255)),
+                ("catalog_url", models.CharField(max_length=255, unique=True)),
+                ("product_url", models.CharField(max_length=255)),
+                ("datetime", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,124 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:13
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.utils.timezone
+
+
+HISTORY_FIELDS = (
+    "datetime",
+    "availability",
+    "company_name",
+    "product_url",
+    "numcas",
+    "name",
+    "qt_list",
+    "unit_list",
+    "currency_list",
+    "price_pack_list",
+    "content_hash",
+)
+
+
+def delete_duplicate_products(apps, schema_editor):
+    """
+    Keeps only the newest row of every (company_name, product_url) pair so the
+    unique constraint can be created. The older rows are archived in the history
+    table before they are deleted.
+    """
+    Chemicals = apps.get_model("scrapy_app", "Chemicals")
+    ChemicalsHistory = apps.get_model("scrapy_app", "ChemicalsHistory")
+    newest = (
+        Chemicals.objects.filter(
+            company_name=OuterRef("company_name"), product_url=OuterRef("product_url")
+        )
+        .order_by("-datetime", "-id")
+        .values("id")[:1]
+    )
+    duplicates = Chemicals.objects.exclude(id=Subquery(newest))
+    ChemicalsHistory.objects.bulk_create(
+        (
+            ChemicalsHistory(**row)
+            for row in duplicates.values(*HISTORY_FIELDS).iterator()
+        ),
+        batch_size=1000,
+    )
+    duplicates.delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0006_redirectlink"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChemicalsHistory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("datetime", models.DateTimeField(default=django.utils.timezone.now)),
+                ("availability", models.BooleanField(default=False)),
+                ("company_name", models.CharField(max_length=255)),
+                ("product_url", models.CharField(max_length=255)),
+                ("numcas", models.CharField(max_length=255)),
+                ("name", models.CharField(max_length=255)),
+                (
+                    "qt_list",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.FloatField(), size=None
+                    ),
+                ),
+                (
+                    "unit_list",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.CharField(), size=None
+                    ),
+                ),
+                (
+                    "currency_list",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.CharField(), size=None
+                    ),
+                ),
+                (
+                    "price_pack_list",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.CharField(), size=None
+                    ),
+                ),
+                ("content_hash", models.CharField(max_length=64)),
+            ],
+            options={
+                "ordering": ["-datetime"],
+            },
+        ),
+        migrations.AddField(
+            model_name="chemicals",
+            name="content_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.RunPython(delete_duplicate_products, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="chemicals",
+            constraint=models.UniqueConstraint(
+                fields=("company_name", "product_url"),
+                name="unique_chemicals_company_product",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="chemicalshistory",
+            index=models.Index(
+                fields=["company_name", "product_url", "datetime"],
+                name="scrapy_app__company_dae197_idx",
+            ),
+        ),
+    ]
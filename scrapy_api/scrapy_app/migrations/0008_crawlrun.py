@@ -0,0 +1,63 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0007_chemicals_upsert"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CrawlRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("company_name", models.CharField(max_length=255)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("finished", "Finished"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=16,
+                    ),
+                ),
+                ("started_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["-started_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["company_name", "status"],
+                        name="scrapy_app__company_e0f7f2_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="chemicals",
+            name="crawl_run",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="scrapy_app.crawlrun",
+            ),
+        ),
+    ]
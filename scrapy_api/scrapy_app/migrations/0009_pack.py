@@ -0,0 +1,124 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:16
+
+from decimal import Decimal, InvalidOperation
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+UNITS = {
+    "mg": ("g", 0.001),
+    "g": ("g", 1),
+    "kg": ("g", 1000),
+    "ml": ("ml", 1),
+    "l": ("ml", 1000),
+}
+
+
+def parse_price(price):
+    """
+    Converts a scraped price such as "1,200.00" to a Decimal, or None.
+    """
+    try:
+        return Decimal(re.sub(r"[^0-9.]", "", price or ""))
+    except InvalidOperation:
+        return None
+
+
+def backfill_packs(apps, schema_editor):
+    """
+    Creates a Pack for every element of the pack arrays of existing rows.
+    """
+    Chemicals = apps.get_model("scrapy_app", "Chemicals")
+    Pack = apps.get_model("scrapy_app", "Pack")
+
+    packs = []
+    for chemical in Chemicals.objects.iterator(chunk_size=2000):
+        for quantity, unit, currency, price in zip(
+            chemical.qt_list,
+            chemical.unit_list,
+            chemical.currency_list,
+            chemical.price_pack_list,
+        ):
+            unit = unit.strip().lower()
+            if unit not in UNITS:
+                continue
+            unit_family, factor = UNITS[unit]
+            price = parse_price(price)
+            price_per_unit = None
+            if price is not None and quantity:
+                price_per_unit = price / Decimal(str(quantity * factor))
+            packs.append(
+                Pack(
+                    chemical_id=chemical.id,
+                    numcas=chemical.numcas,
+                    quantity=quantity,
+                    unit=unit,
+                    unit_family=unit_family,
+                    currency=currency,
+                    price=price,
+                    price_per_unit=price_per_unit,
+                )
+            )
+        if len(packs) >= 5000:
+            Pack.objects.bulk_create(packs)
+            packs = []
+    Pack.objects.bulk_create(packs)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0008_crawlrun"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Pack",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("numcas", models.CharField(max_length=255)),
+                ("quantity", models.FloatField()),
+                ("unit", models.CharField(max_length=16)),
+                (
+                    "unit_family",
+                    models.CharField(
+                        choices=[("g", "Gram"), ("ml", "Milliliter")], max_length=2
+                    ),
+                ),
+                ("currency", models.CharField(max_length=16)),
+                (
+                    "price",
+                    models.DecimalField(decimal_places=2, max_digits=14, null=True),
+                ),
+                (
+                    "price_per_unit",
+                    models.DecimalField(decimal_places=6, max_digits=20, null=True),
+                ),
+                (
+                    "chemical",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="packs",
+                        to="scrapy_app.chemicals",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["numcas", "unit_family", "currency"],
+                        name="scrapy_app__numcas_d57e03_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_packs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:18
+
+from django.db import migrations, models
+import django.utils.timezone
+
+# Aggregates the packs of the rows the API shows, like the crawler does.
+BACKFILL_PRICE_AGGREGATES = """
+INSERT INTO scrapy_app_priceaggregate (numcas, unit_family, currency,
+    average_price, min_price, max_price, sample_count, updated_at)
+SELECT p.numcas, p.unit_family, p.currency, avg(p.price_per_unit),
+    min(p.price_per_unit), max(p.price_per_unit), count(*), now()
+FROM scrapy_app_pack p
+JOIN scrapy_app_chemicals c ON c.id = p.chemical_id
+WHERE p.price_per_unit IS NOT NULL
+AND (c.crawl_run_id IS NULL OR c.crawl_run_id >= COALESCE((
+    SELECT max(r.id) FROM scrapy_app_crawlrun r
+    WHERE r.company_name = c.company_name AND r.status = 'finished'), 0))
+GROUP BY p.numcas, p.unit_family, p.currency
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0009_pack"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PriceAggregate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("numcas", models.CharField(max_length=255)),
+                (
+                    "unit_family",
+                    models.CharField(
+                        choices=[("g", "Gram"), ("ml", "Milliliter")], max_length=2
+                    ),
+                ),
+                ("currency", models.CharField(max_length=16)),
+                ("average_price", models.DecimalField(decimal_places=6, max_digits=20)),
+                ("min_price", models.DecimalField(decimal_places=6, max_digits=20)),
+                ("max_price", models.DecimalField(decimal_places=6, max_digits=20)),
+                ("sample_count", models.IntegerField()),
+                ("updated_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="priceaggregate",
+            constraint=models.UniqueConstraint(
+                fields=("numcas", "unit_family", "currency"),
+                name="unique_price_aggregate",
+            ),
+        ),
+        migrations.RunSQL(BACKFILL_PRICE_AGGREGATES, migrations.RunSQL.noop),
+    ]
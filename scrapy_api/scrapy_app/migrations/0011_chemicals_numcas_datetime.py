@@ -0,0 +1,19 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0010_priceaggregate"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chemicals",
+            index=models.Index(
+                fields=["numcas", "-datetime", "-id"],
+                name="scrapy_app__numcas_be447f_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0011_chemicals_numcas_datetime"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="crawlrun",
+            name="job_id",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=64
+            ),
+        ),
+    ]
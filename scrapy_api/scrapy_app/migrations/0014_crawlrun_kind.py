@@ -0,0 +1,35 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0013_unique_active_crawl_run"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="crawlrun",
+            name="unique_active_crawl_run",
+        ),
+        migrations.AddField(
+            model_name="crawlrun",
+            name="kind",
+            field=models.CharField(
+                choices=[("full", "Full"), ("refresh", "Refresh")],
+                default="full",
+                max_length=16,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="crawlrun",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("kind", "full"), ("status__in", ["pending", "running"])
+                ),
+                fields=("company_name",),
+                name="unique_active_crawl_run",
+            ),
+        ),
+    ]
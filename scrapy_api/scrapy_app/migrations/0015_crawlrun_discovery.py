@@ -0,0 +1,17 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0014_crawlrun_kind"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="crawlrun",
+            name="discovery",
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0015_crawlrun_discovery"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chemicals",
+            name="next_due_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="chemicals",
+            index=models.Index(
+                fields=["company_name", "next_due_at"],
+                name="scrapy_app__company_ff5a42_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0016_chemicals_next_due_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="crawlrun",
+            name="spider_args",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0017_crawlrun_spider_args"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chemicals",
+            name="availability_stale",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:54
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fail_duplicate_active_refresh_runs(apps, schema_editor):
+    """
+    Marks all but the newest pending or running refresh run of every company as
+    failed so the unique constraint can be created.
+    """
+    CrawlRun = apps.get_model("scrapy_app", "CrawlRun")
+    active = CrawlRun.objects.filter(kind="refresh", status__in=["pending", "running"])
+    newest = (
+        active.filter(company_name=OuterRef("company_name"))
+        .order_by("-id")
+        .values("id")[:1]
+    )
+    active.exclude(id=Subquery(newest)).update(status="failed")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0018_chemicals_availability_stale"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="crawlrun",
+            name="unique_active_crawl_run",
+        ),
+        migrations.RunPython(
+            fail_duplicate_active_refresh_runs, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name="crawlrun",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status__in", ["pending", "running"])),
+                fields=("company_name", "kind"),
+                name="unique_active_crawl_run",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:56
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0019_unique_active_crawl_run_kind"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="crawlrun",
+            name="scheduled_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0020_crawlrun_scheduled_at"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="chemicals",
+            name="scrapy_app__numcas_be447f_idx",
+        ),
+        migrations.AddIndex(
+            model_name="chemicals",
+            index=models.Index(
+                fields=["numcas", "-id"], name="scrapy_app__numcas_a2ea65_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,146 @@
+# Generated by Django 4.2.2 on 2026-10-18 19:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Tables whose rows are stored in one partition per crawl generation.
+PARTITIONED_TABLES = ("scrapy_app_chemicals", "scrapy_app_pack")
+
+
+def rebuild_table(schema_editor, table, partitioned):
+    """
+    Copies a table into a new one, partitioned by crawl_run_id or not, and
+    recreates its indexes and constraints under the same names.
+
+    A partitioned table can't have a primary key on id alone, so it gets a plain
+    index on id instead. Existing rows all go to the default partition, the
+    crawler creates a partition for every new full crawl run.
+    """
+    old_table = f"{table}_old"
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {old_table}")
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype IN ('u', 'f')",
+            [old_table],
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s "
+            "AND indexname NOT IN ("
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)",
+            [old_table, old_table],
+        )
+        indexes = [
+            (name, definition.replace(f"{old_table} USING", f"{table} USING"))
+            for name, definition in cursor.fetchall()
+            if name != f"{table}_id_idx"
+        ]
+
+        cursor.execute(
+            f"CREATE TABLE {table} (LIKE {old_table} "
+            "INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING IDENTITY)"
+            + (" PARTITION BY LIST (crawl_run_id)" if partitioned else "")
+        )
+        if partitioned:
+            cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        cursor.execute(f"INSERT INTO {table} SELECT * FROM {old_table}")
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE(max(id), 0) + 1, false) FROM {table}"
+        )
+        cursor.execute(f"DROP TABLE {old_table}")
+
+        if partitioned:
+            cursor.execute(f"CREATE INDEX {table}_id_idx ON {table} (id)")
+        else:
+            cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id)")
+        for name, definition in indexes:
+            cursor.execute(definition)
+        for name, definition in constraints:
+            cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+
+def partition_tables(apps, schema_editor):
+    for table in PARTITIONED_TABLES:
+        rebuild_table(schema_editor, table, partitioned=True)
+
+
+def unpartition_tables(apps, schema_editor):
+    for table in PARTITIONED_TABLES:
+        rebuild_table(schema_editor, table, partitioned=False)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0021_chemicals_numcas_id"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="chemicals",
+            name="unique_chemicals_company_product",
+        ),
+        migrations.AddField(
+            model_name="pack",
+            name="crawl_run",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="scrapy_app.crawlrun",
+            ),
+        ),
+        migrations.RunSQL(
+            "UPDATE scrapy_app_pack p SET crawl_run_id = c.crawl_run_id "
+            "FROM scrapy_app_chemicals c WHERE c.id = p.chemical_id",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name="chemicals",
+            name="crawl_run",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="scrapy_app.crawlrun",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="pack",
+            name="chemical",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="packs",
+                to="scrapy_app.chemicals",
+            ),
+        ),
+        # Rows written before a company was fully crawled have no generation,
+        # they must still be unique per product.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name="chemicals",
+                    constraint=models.UniqueConstraint(
+                        fields=("crawl_run", "company_name", "product_url"),
+                        name="unique_chemicals_generation_product",
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    "ALTER TABLE scrapy_app_chemicals "
+                    "ADD CONSTRAINT unique_chemicals_generation_product "
+                    "UNIQUE NULLS NOT DISTINCT (crawl_run_id, company_name, "
+                    "product_url)",
+                    "ALTER TABLE scrapy_app_chemicals "
+                    "DROP CONSTRAINT unique_chemicals_generation_product",
+                ),
+            ],
+        ),
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.2 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0022_chemicals_generation_partitions"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="chemicals",
+            name="scrapy_app__numcas_a2ea65_idx",
+        ),
+        migrations.AddIndex(
+            model_name="chemicals",
+            index=models.Index(
+                fields=["numcas", "company_name", "product_url"],
+                name="scrapy_app__numcas_2324a1_idx",
+            ),
+        ),
+    ]
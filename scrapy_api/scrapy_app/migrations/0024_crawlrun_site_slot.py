@@ -0,0 +1,54 @@
+# Generated by Django 4.2.2 on 2026-10-18 19:27
+
+from django.db import migrations, models
+import django.db.models.fields.json
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("scrapy_app", "0023_chemicals_numcas_position"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="crawlrun",
+            name="unique_active_crawl_run",
+        ),
+        # A full crawl and a seed=due refresh of a company may both be active,
+        # keep the newest one.
+        migrations.RunSQL(
+            "UPDATE scrapy_app_crawlrun r SET status = 'failed' "
+            "WHERE status IN ('pending', 'running') "
+            "AND NOT spider_args ? 'product_urls' AND EXISTS ("
+            "SELECT 1 FROM scrapy_app_crawlrun n "
+            "WHERE n.company_name = r.company_name AND n.id > r.id "
+            "AND n.status IN ('pending', 'running') "
+            "AND NOT n.spider_args ? 'product_urls')",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name="crawlrun",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("status__in", ["pending", "running"]),
+                    models.Q(("spider_args__has_key", "product_urls"), _negated=True),
+                ),
+                fields=("company_name",),
+                name="unique_active_crawl_run",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="crawlrun",
+            constraint=models.UniqueConstraint(
+                models.F("company_name"),
+                django.db.models.fields.json.KeyTextTransform(
+                    "product_urls", "spider_args"
+                ),
+                condition=models.Q(
+                    ("status__in", ["pending", "running"]),
+                    ("spider_args__has_key", "product_urls"),
+                ),
+                name="unique_active_targeted_crawl_run",
+            ),
+        ),
+    ]
@@ -1,8 +1,131 @@
 from django.db import models
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib.postgres.fields import ArrayField
 
 
+class CrawlRun(models.Model):
+    """
+    Model representing one crawl of a company's products.
+
+    Every full crawl writes its rows as a new generation, stored in its own
+    partition of the Chemicals and Pack tables. The latest finished full run of
+    a company is its active generation: finishing a run switches the API over to
+    its rows, and the partitions of the older generations are then dropped.
+    Refresh runs only re-crawl some products and update their rows in the
+    active generation.
+
+    A company has at most one pending or running crawl that walks its catalog or
+    its stored products, a full crawl or a `seed=due` refresh. Refreshes of given
+    product pages are targeted and don't take that slot, only the same pages
+    can't be refreshed twice at the same time.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        FINISHED = "finished"
+        FAILED = "failed"
+
+    class Kind(models.TextChoices):
+        FULL = "full"
+        REFRESH = "refresh"
+
+    # Statuses of the crawl runs that hold their company's slot.
+    ACTIVE_STATUSES = (Status.PENDING, Status.RUNNING)
+    # Crawl runs that only fetch the product pages given in their arguments.
+    TARGETED = Q(spider_args__has_key="product_urls")
+
+    company_name = models.CharField(max_length=255)
+    kind = models.CharField(max_length=16, choices=Kind.choices, default=Kind.FULL)
+    # Whether the crawl walked the catalog, or only fetched known product pages.
+    discovery = models.BooleanField(default=True)
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.PENDING
+    )
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    job_id = models.CharField(max_length=64, blank=True, default="", db_index=True)
+    # When the job was last sent to scrapyd.
+    scheduled_at = models.DateTimeField(default=timezone.now)
+    # Arguments the spider was launched with, sent again when the crawl resumes.
+    spider_args = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        """
+        Meta class for specifying model options.
+        """
+
+        ordering = ["-started_at"]
+        indexes = [
+            models.Index(fields=["company_name", "status"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["company_name"],
+                condition=Q(status__in=["pending", "running"])
+                & ~Q(spider_args__has_key="product_urls"),
+                name="unique_active_crawl_run",
+            ),
+            models.UniqueConstraint(
+                F("company_name"),
+                KeyTextTransform("product_urls", "spider_args"),
+                condition=Q(status__in=["pending", "running"])
+                & Q(spider_args__has_key="product_urls"),
+                name="unique_active_targeted_crawl_run",
+            ),
+        ]
+
+    def __str__(self):
+        """
+        String representation of the CrawlRun object.
+        """
+        return f"{self.company_name} #{self.pk} ({self.status})"
+
+    def same_slot(self):
+        """
+        Crawl runs that can't be active at the same time as this one: the
+        untargeted runs of the company, or its runs of the same product pages.
+
+        Returns:
+            A CrawlRun queryset, which may include this run.
+        """
+        crawl_runs = CrawlRun.objects.filter(company_name=self.company_name)
+        if "product_urls" in self.spider_args:
+            return crawl_runs.filter(
+                spider_args__product_urls=self.spider_args["product_urls"]
+            )
+        return crawl_runs.exclude(self.TARGETED)
+
+
+class ChemicalsQuerySet(models.QuerySet):
+    """
+    QuerySet for the Chemicals model.
+    """
+
+    def current(self):
+        """
+        Rows of each company's active crawl generation.
+
+        Until a company's first full crawl finishes, its active generation is the
+        rows without a crawl run, written before crawl runs were tracked or by
+        refreshes. The rows of a running full crawl stay hidden until it
+        finishes, and the rows of older generations are hidden as soon as a newer
+        full run finishes, even before they are dropped.
+        """
+        active_run = CrawlRun.objects.filter(
+            company_name=OuterRef("company_name"),
+            kind=CrawlRun.Kind.FULL,
+            status=CrawlRun.Status.FINISHED,
+        ).order_by("-id")
+        return self.alias(
+            generation=Coalesce("crawl_run_id", 0),
+            active_run_id=Coalesce(Subquery(active_run.values("id")[:1]), 0),
+        ).filter(generation=F("active_run_id"))
+
+
 class Chemicals(models.Model):
     """
     Model representing chemicals information.
@@ -18,6 +141,19 @@ class Chemicals(models.Model):
     unit_list = ArrayField(models.CharField())
     currency_list = ArrayField(models.CharField())
     price_pack_list = ArrayField(models.CharField())
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    # Whether the availability was copied from the previous crawl because the
+    # availability checks were failing.
+    availability_stale = models.BooleanField(default=False)
+    # The full crawl run whose generation the row belongs to, which is also the
+    # partition of the table the row is stored in.
+    crawl_run = models.ForeignKey(
+        CrawlRun, null=True, blank=True, on_delete=models.PROTECT
+    )
+    # When the product is due for a recrawl, planned from its change history.
+    next_due_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ChemicalsQuerySet.as_manager()
 
     class Meta:
         """
@@ -25,9 +161,157 @@ class Chemicals(models.Model):
         """
 
         ordering = ["-datetime"]
+        constraints = [
+            # NULLS NOT DISTINCT in the database, see migration 0022.
+            models.UniqueConstraint(
+                fields=["crawl_run", "company_name", "product_url"],
+                name="unique_chemicals_generation_product",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["numcas", "company_name", "product_url"]),
+            models.Index(fields=["company_name", "next_due_at"]),
+        ]
 
     def __str__(self):
         """
         String representation of the Chemicals object.
         """
         return self.name
+
+
+class Pack(models.Model):
+    """
+    Model representing one pack size of a chemical with its typed price.
+    """
+
+    class UnitFamily(models.TextChoices):
+        GRAM = "g"
+        MILLILITER = "ml"
+
+    # Partitioned tables have no primary key the foreign key could reference.
+    chemical = models.ForeignKey(
+        Chemicals, on_delete=models.CASCADE, related_name="packs", db_constraint=False
+    )
+    # Generation of the product row, the partition of the table the pack is in.
+    crawl_run = models.ForeignKey(
+        CrawlRun,
+        null=True,
+        blank=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name="+",
+    )
+    numcas = models.CharField(max_length=255)
+    quantity = models.FloatField()
+    unit = models.CharField(max_length=16)
+    unit_family = models.CharField(max_length=2, choices=UnitFamily.choices)
+    currency = models.CharField(max_length=16)
+    price = models.DecimalField(max_digits=14, decimal_places=2, null=True)
+    price_per_unit = models.DecimalField(max_digits=20, decimal_places=6, null=True)
+
+    class Meta:
+        """
+        Meta class for specifying model options.
+        """
+
+        indexes = [
+            models.Index(fields=["numcas", "unit_family", "currency"]),
+        ]
+
+    def __str__(self):
+        """
+        String representation of the Pack object.
+        """
+        return f"{self.quantity:g} {self.unit} of {self.numcas}"
+
+
+class PriceAggregate(models.Model):
+    """
+    Model storing price statistics of a CAS number per unit family and currency.
+
+    The rows are refreshed by the crawler for the CAS numbers whose packs
+    changed, so reading the average price is a single row lookup.
+    """
+
+    numcas = models.CharField(max_length=255)
+    unit_family = models.CharField(max_length=2, choices=Pack.UnitFamily.choices)
+    currency = models.CharField(max_length=16)
+    average_price = models.DecimalField(max_digits=20, decimal_places=6)
+    min_price = models.DecimalField(max_digits=20, decimal_places=6)
+    max_price = models.DecimalField(max_digits=20, decimal_places=6)
+    sample_count = models.IntegerField()
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        """
+        Meta class for specifying model options.
+        """
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=["numcas", "unit_family", "currency"],
+                name="unique_price_aggregate",
+            )
+        ]
+
+    def __str__(self):
+        """
+        String representation of the PriceAggregate object.
+        """
+        return f"{self.numcas} {self.currency}/{self.unit_family}"
+
+
+class ChemicalsHistory(models.Model):
+    """
+    Model storing every changed version of a product's data.
+
+    A row is added when a product is first seen and whenever its crawled data
+    differs from the stored one.
+    """
+
+    datetime = models.DateTimeField(default=timezone.now)
+    availability = models.BooleanField(default=False)
+    company_name = models.CharField(max_length=255)
+    product_url = models.CharField(max_length=255)
+    numcas = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+    qt_list = ArrayField(models.FloatField())
+    unit_list = ArrayField(models.CharField())
+    currency_list = ArrayField(models.CharField())
+    price_pack_list = ArrayField(models.CharField())
+    content_hash = models.CharField(max_length=64)
+
+    class Meta:
+        """
+        Meta class for specifying model options.
+        """
+
+        ordering = ["-datetime"]
+        indexes = [
+            models.Index(fields=["company_name", "product_url", "datetime"]),
+        ]
+
+    def __str__(self):
+        """
+        String representation of the ChemicalsHistory object.
+        """
+        return f"{self.name} ({self.datetime})"
+
+
+class RedirectLink(models.Model):
+    """
+    Model mapping a category listing link to the product page it redirects to.
+    """
+
+    company_name = models.CharField(max_length=255)
+    catalog_url = models.CharField(max_length=255, unique=True)
+    product_url = models.CharField(max_length=255)
+    datetime = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        """
+        String representation of the RedirectLink object.
+        """
+        return self.catalog_url
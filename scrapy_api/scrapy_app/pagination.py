@@ -0,0 +1,107 @@
+"""
+Keyset pagination of the chemicals list.
+
+Pages are ordered by company name and product URL, and the cursor is the
+position of the last row of the previous page, so fetching a page is a range
+scan of the (numcas, company_name, product_url) index no matter how deep it is.
+Every product of a company has one current row, and its position doesn't change
+when a refresh updates it or a finished crawl replaces it with a row of the new
+generation, so paging through a list while crawls run doesn't skip or repeat
+rows.
+"""
+import base64
+import binascii
+import json
+
+from django.db.models import CharField, Func, Value
+
+# Fields the pages are ordered by, which make up the cursor.
+CURSOR_FIELDS = ("company_name", "product_url")
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a cursor can't be decoded.
+    """
+
+
+def encode_cursor(row):
+    """
+    Encodes the position of a row as an opaque cursor.
+
+    Args:
+        row (dict): The last row of a page.
+
+    Returns:
+        A URL safe string.
+    """
+    position = [row[field] for field in CURSOR_FIELDS]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor built by `encode_cursor`.
+
+    Args:
+        cursor (str): The cursor.
+
+    Returns:
+        The list of the CURSOR_FIELDS values of the row.
+
+    Raises:
+        InvalidCursor: If the cursor is malformed.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not (
+        isinstance(position, list)
+        and len(position) == len(CURSOR_FIELDS)
+        and all(isinstance(value, str) for value in position)
+    ):
+        raise InvalidCursor(cursor)
+    return position
+
+
+def row(*expressions):
+    """
+    Builds a row constructor, which PostgreSQL compares column by column.
+
+    Args:
+        *expressions: The expressions of the row.
+
+    Returns:
+        A Func expression.
+    """
+    return Func(*expressions, function="ROW", output_field=CharField())
+
+
+def paginate(queryset, cursor, limit):
+    """
+    Returns one page of a queryset and the cursor of the next one.
+
+    Args:
+        queryset: A Chemicals values queryset, including the CURSOR_FIELDS.
+        cursor (str): Cursor returned with the previous page, or None.
+        limit (int): Maximum number of rows of the page.
+
+    Returns:
+        A tuple of the list of row dicts and the next cursor, None on the last
+        page.
+
+    Raises:
+        InvalidCursor: If the cursor is malformed.
+    """
+    queryset = queryset.order_by(*CURSOR_FIELDS)
+    if cursor:
+        position = row(*(Value(value) for value in decode_cursor(cursor)))
+        queryset = queryset.alias(position=row(*CURSOR_FIELDS)).filter(
+            position__gt=position
+        )
+
+    rows = list(queryset[: limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], encode_cursor(rows[limit - 1])
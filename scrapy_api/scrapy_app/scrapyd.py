@@ -0,0 +1,218 @@
+"""
+Client of the scrapyd server running the spiders.
+
+Launches are sent from a small thread pool, so API requests return as soon as
+the crawl run is recorded. The job id is chosen here and passed to scrapyd,
+which lets the API return it before scrapyd has answered.
+
+Every crawl run has its own job directory (JOBDIR), which keeps its request
+queue and dupefilter state. A new job launched with the same directory resumes
+the crawl.
+"""
+import logging
+import os
+import posixpath
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import CrawlRun
+
+logger = logging.getLogger(__name__)
+
+SCRAPYD_HOST = os.environ.get("SCRAPYD_HOST")
+SCRAPYD_PROJECT = "chemicals"
+
+JOBS_KEY = "scrapyd:jobs"
+JOBS_LOCK = threading.Lock()
+
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="scrapyd")
+
+
+def scrapyd_url(endpoint):
+    """
+    Returns the URL of a scrapyd API endpoint.
+
+    Args:
+        endpoint (str): Name of the endpoint, e.g. "schedule.json".
+
+    Returns:
+        The URL.
+    """
+    return f"http://{SCRAPYD_HOST}:6800/{endpoint}"
+
+
+def new_job_id():
+    """
+    Returns a new scrapyd job id.
+    """
+    return uuid.uuid4().hex
+
+
+def job_dir(crawl_run):
+    """
+    Returns the job directory of a crawl run on the scrapyd host.
+
+    Args:
+        crawl_run (CrawlRun): The crawl run.
+
+    Returns:
+        The path of the directory.
+    """
+    return posixpath.join(settings.SCRAPYD_JOBS_DIR, str(crawl_run.pk))
+
+
+def schedule(crawl_run, spider_name):
+    """
+    Launches the spider of a crawl run in the background.
+
+    The launch is sent once the current transaction has committed, so the
+    thread sees the crawl run. If scrapyd can't be reached or refuses the job,
+    the crawl run is marked as failed.
+
+    Args:
+        crawl_run (CrawlRun): The crawl run, with its job id and spider arguments
+            set.
+        spider_name (str): Name of the spider.
+    """
+    data = {
+        "project": SCRAPYD_PROJECT,
+        "spider": spider_name,
+        "jobid": crawl_run.job_id,
+        "crawl_run_id": crawl_run.pk,
+        "setting": f"JOBDIR={job_dir(crawl_run)}",
+        **crawl_run.spider_args,
+    }
+    transaction.on_commit(lambda: executor.submit(post_schedule, crawl_run.pk, data))
+
+
+def post_schedule(crawl_run_id, data):
+    """
+    Sends a job to scrapyd's schedule.json, in a thread of the executor.
+
+    Args:
+        crawl_run_id (int): Id of the crawl run.
+        data (dict): The schedule.json parameters.
+    """
+    try:
+        response = requests.post(
+            scrapyd_url("schedule.json"), data=data, timeout=settings.SCRAPYD_TIMEOUT
+        )
+        if response.status_code == 200 and response.json().get("status") == "ok":
+            return
+        logger.error(f"Scrapyd refused crawl run {crawl_run_id}: {response.text}")
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f"Failed to launch crawl run {crawl_run_id}: {e}")
+
+    try:
+        CrawlRun.objects.filter(pk=crawl_run_id, status=CrawlRun.Status.PENDING).update(
+            status=CrawlRun.Status.FAILED
+        )
+    finally:
+        connection.close()
+
+
+def cancel(job_id):
+    """
+    Cancels a scrapyd job in the background, once the current transaction has
+    committed.
+
+    Args:
+        job_id (str): The job id.
+    """
+    transaction.on_commit(lambda: executor.submit(post_cancel, job_id))
+
+
+def post_cancel(job_id):
+    """
+    Sends a job to scrapyd's cancel.json, in a thread of the executor.
+
+    Args:
+        job_id (str): The job id.
+    """
+    try:
+        requests.post(
+            scrapyd_url("cancel.json"),
+            data={"project": SCRAPYD_PROJECT, "job": job_id},
+            timeout=settings.SCRAPYD_TIMEOUT,
+        ).raise_for_status()
+    except requests.RequestException as e:
+        logger.error(f"Failed to cancel job {job_id}: {e}")
+
+
+def fail_lost_runs():
+    """
+    Marks the pending crawl runs whose launch was lost as failed.
+
+    A launch is lost if the API process stopped before sending it to scrapyd,
+    and its pending crawl run would block new crawls of the company. Crawl runs
+    pending for more than SCRAPYD_LAUNCH_TIMEOUT seconds without a job id, or
+    whose job scrapyd doesn't know, are failed.
+
+    Returns:
+        The number of failed crawl runs.
+    """
+    pending = CrawlRun.objects.filter(
+        status=CrawlRun.Status.PENDING,
+        scheduled_at__lt=timezone.now()
+        - timedelta(seconds=settings.SCRAPYD_LAUNCH_TIMEOUT),
+    )
+    pending = list(pending.values_list("pk", "job_id"))
+    if not pending:
+        return 0
+
+    jobs = list_jobs()
+    lost = [
+        pk
+        for pk, job_id in pending
+        if not job_id or (jobs is not None and job_id not in jobs)
+    ]
+    return CrawlRun.objects.filter(pk__in=lost, status=CrawlRun.Status.PENDING).update(
+        status=CrawlRun.Status.FAILED
+    )
+
+
+def list_jobs():
+    """
+    Returns the state of scrapyd's jobs, cached for SCRAPYD_STATUS_CACHE_TIMEOUT.
+
+    However many clients poll the status endpoint, listjobs.json is requested at
+    most once per timeout by every worker process sharing the cache.
+
+    Returns:
+        A dict mapping job ids to "pending", "running" or "finished", or None if
+        scrapyd can't be reached.
+    """
+    jobs = cache.get(JOBS_KEY)
+    if jobs is not None:
+        return jobs
+
+    with JOBS_LOCK:
+        jobs = cache.get(JOBS_KEY)
+        if jobs is not None:
+            return jobs
+        try:
+            response = requests.get(
+                scrapyd_url("listjobs.json"),
+                params={"project": SCRAPYD_PROJECT},
+                timeout=settings.SCRAPYD_TIMEOUT,
+            )
+            response.raise_for_status()
+            listing = response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Failed to list scrapyd jobs: {e}")
+            return None
+        jobs = {
+            job["id"]: state
+            for state in ("pending", "running", "finished")
+            for job in listing.get(state, [])
+        }
+        cache.set(JOBS_KEY, jobs, settings.SCRAPYD_STATUS_CACHE_TIMEOUT)
+    return jobs
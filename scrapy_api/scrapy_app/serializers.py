@@ -1,6 +1,14 @@
+import datetime
+import json
+
 from rest_framework import serializers
 from .models import Chemicals
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class ChemicalsSerializer(serializers.ModelSerializer):
     """
@@ -13,4 +21,87 @@ class ChemicalsSerializer(serializers.ModelSerializer):
         """
 
         model = Chemicals
-        fields = "__all__"
+        exclude = ["content_hash", "next_due_at"]
+
+
+# Fields of ChemicalsSerializer, as .values() names them. The crawl_run foreign key
+# is rendered as its id by both.
+CHEMICALS_FIELDS = tuple(ChemicalsSerializer().fields)
+
+
+def chemicals_values(queryset, fields=None):
+    """
+    Projects a Chemicals queryset on the serialized fields, without building models.
+
+    This is the read-only fast path of ChemicalsSerializer: the rows are plain dicts
+    straight from the database cursor.
+
+    Args:
+        queryset: The Chemicals queryset.
+        fields (list): Fields to return, all fields of ChemicalsSerializer if None.
+
+    Returns:
+        A values queryset.
+    """
+    return queryset.values(*(fields or CHEMICALS_FIELDS))
+
+
+def parse_fields(value):
+    """
+    Parses a comma separated `fields` query parameter.
+
+    Args:
+        value (str): The parameter value, or None.
+
+    Returns:
+        The list of field names, all fields of ChemicalsSerializer if the parameter
+        is empty.
+
+    Raises:
+        ValueError: If a field is not a field of ChemicalsSerializer.
+    """
+    fields = [field.strip() for field in (value or "").split(",") if field.strip()]
+    if not fields:
+        return list(CHEMICALS_FIELDS)
+    unknown = [field for field in fields if field not in CHEMICALS_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}.")
+    return fields
+
+
+def encode_default(value):
+    """
+    Encodes the values the json module can't, like DRF renders them.
+
+    Args:
+        value: The value to encode.
+
+    Returns:
+        A JSON serializable representation of the value.
+
+    Raises:
+        TypeError: If the value is of an unsupported type.
+    """
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """
+    Encodes data to JSON, with orjson if it is installed.
+
+    Args:
+        data: The data to encode.
+
+    Returns:
+        The encoded bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=encode_default, option=orjson.OPT_UTC_Z)
+    return json.dumps(data, default=encode_default).encode()
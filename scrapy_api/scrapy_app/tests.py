@@ -1,22 +1,61 @@
-from django.test import TestCase
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+import psycopg2
+import requests
+
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import Chemicals
+from .models import Chemicals, ChemicalsHistory, CrawlRun, Pack, PriceAggregate
+from .serializers import ChemicalsSerializer, chemicals_values, dumps
+
+# The crawler writes to the tables of this app, test it against them.
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "chemicals"))
+)
+from chemicals.db import finish_crawl_run, keep_products, start_crawl_run  # noqa: E402
+from chemicals.pipelines import PostgreSQLPipeline  # noqa: E402
+
+
+def create_chemical(**fields):
+    """
+    Creates a product row, with the fields that the test doesn't set defaulted.
+    """
+    values = {
+        "availability": True,
+        "company_name": "Company A",
+        "product_url": "https://example.com/productA",
+        "numcas": "12345",
+        "name": "Chemical A",
+        "qt_list": [1.0],
+        "unit_list": ["g"],
+        "currency_list": ["$"],
+        "price_pack_list": ["10"],
+    }
+    values.update(fields)
+    return Chemicals.objects.create(**values)
 
 
 class ChemicalsListAPIViewTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.url = reverse("chemicals-list")
         self.numcas = "12345"
 
-        Chemicals.objects.create(
-            availability=True,
-            company_name="Company A",
-            product_url="https://example.com/productA",
-            numcas="12345",
-            name="Chemical A",
+        create_chemical(
             qt_list=[1.0, 2.0, 3.0],
             unit_list=["g", "kg", "mg"],
             currency_list=["USD", "EUR", "GBP"],
@@ -42,29 +81,168 @@ class ChemicalsListAPIViewTestCase(TestCase):
         self.assertEqual(response.json()["error"], "No CAS number provided.")
 
 
+class ChemicalsPaginationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse("chemicals-list")
+        for n in range(3):
+            create_chemical(
+                product_url=f"https://example.com/product{n}", name=f"Chemical {n}"
+            )
+
+    def test_pages_follow_next_cursor(self):
+        response = self.client.get(self.url, {"numcas": "12345", "limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first_page = response.json()
+        self.assertEqual(len(first_page["data"]), 2)
+        self.assertIsNotNone(first_page["next"])
+
+        response = self.client.get(
+            self.url, {"numcas": "12345", "limit": 2, "cursor": first_page["next"]}
+        )
+        second_page = response.json()
+        self.assertEqual(len(second_page["data"]), 1)
+        self.assertIsNone(second_page["next"])
+
+        names = [row["name"] for row in first_page["data"] + second_page["data"]]
+        self.assertEqual(names, ["Chemical 0", "Chemical 1", "Chemical 2"])
+
+    def test_crawl_between_pages_does_not_skip_rows(self):
+        response = self.client.get(self.url, {"numcas": "12345", "limit": 2})
+        first_page = response.json()
+
+        # A finished crawl replaces every row with one of its generation.
+        crawl_run = CrawlRun.objects.create(
+            company_name="Company A", status=CrawlRun.Status.FINISHED
+        )
+        for n in range(3):
+            create_chemical(
+                product_url=f"https://example.com/product{n}",
+                name=f"Chemical {n} new",
+                crawl_run=crawl_run,
+            )
+        response = self.client.get(
+            self.url, {"numcas": "12345", "limit": 2, "cursor": first_page["next"]}
+        )
+        names = [row["name"] for row in response.json()["data"]]
+        self.assertEqual(names, ["Chemical 2 new"])
+
+    def test_cursor_without_returned_position_fields(self):
+        response = self.client.get(
+            self.url, {"numcas": "12345", "limit": 2, "fields": "name"}
+        )
+        first_page = response.json()
+        self.assertEqual(
+            first_page["data"], [{"name": "Chemical 0"}, {"name": "Chemical 1"}]
+        )
+        response = self.client.get(
+            self.url,
+            {"numcas": "12345", "fields": "name", "cursor": first_page["next"]},
+        )
+        self.assertEqual(response.json()["data"], [{"name": "Chemical 2"}])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"numcas": "12345", "cursor": "nope"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()["error"], "Invalid cursor.")
+
+    def test_stream_returns_all_rows(self):
+        response = self.client.get(self.url, {"numcas": "12345", "stream": "1"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(b"".join(response.streaming_content))["data"]
+        self.assertEqual(
+            [row["name"] for row in data], ["Chemical 0", "Chemical 1", "Chemical 2"]
+        )
+
+    def test_stream_with_invalid_numcas(self):
+        response = self.client.get(self.url, {"numcas": "00000", "stream": "1"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ChemicalsFastSerializationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse("chemicals-list")
+        self.chemical = create_chemical(
+            qt_list=[1.0, 500.0],
+            unit_list=["g", "mg"],
+            currency_list=["$", "$"],
+            price_pack_list=["10", "20"],
+        )
+
+    def test_fast_path_matches_serializer(self):
+        expected = json.loads(
+            json.dumps(ChemicalsSerializer(self.chemical).data, cls=DjangoJSONEncoder)
+        )
+        row = chemicals_values(Chemicals.objects.all()).get()
+        self.assertEqual(json.loads(dumps(row)), expected)
+        with patch("scrapy_app.serializers.orjson", None):
+            self.assertEqual(json.loads(dumps(row)), expected)
+
+    def test_sparse_fieldset(self):
+        response = self.client.get(
+            self.url, {"numcas": "12345", "fields": "name,price_pack_list"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json()["data"],
+            [{"name": "Chemical A", "price_pack_list": ["10", "20"]}],
+        )
+
+    def test_unknown_fields(self):
+        response = self.client.get(
+            self.url, {"numcas": "12345", "fields": "name,content_hash"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()["error"], "Unknown fields: content_hash.")
+
+
 class AveragePriceViewTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.url = reverse("average-price")
         self.numcas = "12345"
 
         # Create some sample Chemicals objects
-        Chemicals.objects.create(
-            availability=True,
-            company_name="Company A",
-            product_url="https://example.com/productA",
-            numcas=self.numcas,
-            name="Chemical A",
-            qt_list=[1.0, 2.0, 3.0],
-            unit_list=["g", "g", "mg"],
-            currency_list=["USD", "EUR", "GBP"],
-            price_pack_list=["100", "200", "300"],
+        create_chemical(
+            qt_list=[1.0, 2.0, 500.0, 1.0],
+            unit_list=["g", "g", "mg", "g"],
+            currency_list=["$", "$", "$", "€"],
+            price_pack_list=["100", "200", "150", "90"],
         )
+        for currency, average, minimum, maximum, count in [
+            ("$", "166.666667", "100", "300", 3),
+            ("€", "90", "90", "90", 1),
+        ]:
+            PriceAggregate.objects.create(
+                numcas=self.numcas,
+                unit_family=Pack.UnitFamily.GRAM,
+                currency=currency,
+                average_price=Decimal(average),
+                min_price=Decimal(minimum),
+                max_price=Decimal(maximum),
+                sample_count=count,
+            )
 
     def test_get_average_price_with_valid_numcas(self):
         response = self.client.get(self.url, {"numcas": self.numcas})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(int(response.json()["average_price_g"]), 199.0)
+        self.assertAlmostEqual(response.json()["average_price_g"], 166.67, places=2)
+        self.assertEqual(response.json()["average_price_ml"], 0.0)
+
+    def test_get_average_price_in_other_currency(self):
+        response = self.client.get(self.url, {"numcas": self.numcas, "currency": "€"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["average_price_g"], 90.0)
+
+    def test_get_average_price_without_aggregates(self):
+        PriceAggregate.objects.all().delete()
+        response = self.client.get(self.url, {"numcas": self.numcas})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["average_price_g"], 0.0)
         self.assertEqual(response.json()["average_price_ml"], 0.0)
 
     def test_get_average_price_with_invalid_numcas(self):
@@ -78,3 +256,627 @@ class AveragePriceViewTestCase(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.json()["error"], "No CAS number provided.")
+
+
+class ChemicalsBatchAPIViewTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("chemicals-batch")
+        for numcas in ("12345", "67890"):
+            create_chemical(
+                product_url=f"https://example.com/{numcas}",
+                numcas=numcas,
+                name=f"Chemical {numcas}",
+            )
+        PriceAggregate.objects.create(
+            numcas="12345",
+            unit_family=Pack.UnitFamily.GRAM,
+            currency="$",
+            average_price=Decimal("10"),
+            min_price=Decimal("10"),
+            max_price=Decimal("10"),
+            sample_count=1,
+        )
+
+    def test_batch_lookup(self):
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                self.url, {"numcas": ["12345", "67890", "00000"]}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()["results"]
+        self.assertEqual(results["12345"]["data"][0]["name"], "Chemical 12345")
+        self.assertEqual(results["12345"]["average_price_g"], 10.0)
+        self.assertEqual(results["67890"]["average_price_g"], 0.0)
+        self.assertEqual(response.json()["missing"], ["00000"])
+
+    def test_batch_lookup_of_averages_only(self):
+        response = self.client.post(
+            self.url,
+            {"numcas": ["12345", "67890", "00000"], "include": ["avg"]},
+            format="json",
+        )
+        results = response.json()["results"]
+        self.assertNotIn("data", results["12345"])
+        self.assertEqual(sorted(results), ["12345", "67890"])
+        self.assertEqual(response.json()["missing"], ["00000"])
+
+    def test_batch_lookup_without_numcas(self):
+        response = self.client.post(self.url, {}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(CHEMICALS_BATCH_MAX_SIZE=2)
+    def test_batch_lookup_with_too_many_numcas(self):
+        response = self.client.post(
+            self.url, {"numcas": ["1", "2", "3"]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CompanySpiderAPIViewTestCase(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("run-campaign")
+
+        create_chemical(company_name="AstaTech")
+
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        patcher = patch("scrapy_app.scrapyd.executor", new=self)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self, *args):
+        return self.executor.submit(*args)
+
+    def launch(self, query="?company_name=AstaTech"):
+        response = self.client.post(self.url + query)
+        self.wait()
+        return response
+
+    def wait(self):
+        # Wait for the background launches.
+        self.executor.shutdown(wait=True)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_run_spider_keeps_existing_products(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        response = self.launch()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Chemicals.objects.filter(company_name="AstaTech").count(), 1)
+
+        crawl_run = CrawlRun.objects.get(company_name="AstaTech")
+        self.assertEqual(crawl_run.status, CrawlRun.Status.PENDING)
+        self.assertEqual(response.json()["job_id"], crawl_run.job_id)
+        self.assertEqual(mock_post.call_args.kwargs["data"]["jobid"], crawl_run.job_id)
+        self.assertEqual(
+            mock_post.call_args.kwargs["data"]["crawl_run_id"], crawl_run.pk
+        )
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_run_spider_failed_launch(self, mock_post):
+        mock_post.return_value.status_code = 500
+        with self.assertLogs("scrapy_app.scrapyd", "ERROR"):
+            response = self.launch()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(
+            CrawlRun.objects.get(company_name="AstaTech").status,
+            CrawlRun.Status.FAILED,
+        )
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_run_spider_unreachable_scrapyd(self, mock_post):
+        mock_post.side_effect = requests.Timeout()
+        with self.assertLogs("scrapy_app.scrapyd", "ERROR"):
+            self.launch()
+        self.assertEqual(
+            CrawlRun.objects.get(company_name="AstaTech").status,
+            CrawlRun.Status.FAILED,
+        )
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_run_spider_twice_returns_running_job(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        first = self.launch()
+        second = self.launch()
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.json()["job_id"], first.json()["job_id"])
+        self.assertEqual(CrawlRun.objects.count(), 1)
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_due_products_wait_for_running_full_crawl(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        first = self.launch()
+        second = self.launch("?company_name=AstaTech&seed=due")
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.json()["job_id"], first.json()["job_id"])
+        self.assertEqual(CrawlRun.objects.count(), 1)
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_targeted_refresh_does_not_block_full_crawl(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        CrawlRun.objects.create(
+            company_name="AstaTech",
+            kind=CrawlRun.Kind.REFRESH,
+            job_id="job1",
+            spider_args={"product_urls": "https://example.com/productA"},
+        )
+        response = self.launch()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(CrawlRun.objects.count(), 2)
+
+    @patch("scrapy_app.scrapyd.requests.get")
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_run_spider_fails_lost_launch(self, mock_post, mock_get):
+        cache.clear()
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        mock_get.return_value.json.return_value = {"running": [{"id": "job0"}]}
+        # The launch of this run never reached scrapyd.
+        lost_run = CrawlRun.objects.create(
+            company_name="AstaTech",
+            job_id="job1",
+            scheduled_at=timezone.now() - timedelta(minutes=5),
+        )
+
+        response = self.launch()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        lost_run.refresh_from_db()
+        self.assertEqual(lost_run.status, CrawlRun.Status.FAILED)
+
+    @patch("scrapy_app.scrapyd.requests.get")
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_run_spider_keeps_recent_launch(self, mock_post, mock_get):
+        CrawlRun.objects.create(company_name="AstaTech", job_id="job1")
+
+        response = self.launch()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["job_id"], "job1")
+        mock_get.assert_not_called()
+        mock_post.assert_not_called()
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_run_spider_with_force_cancels_running_job(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        first = self.launch()
+        second = self.launch("?company_name=AstaTech&force=1")
+        self.assertEqual(second.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotEqual(second.json()["job_id"], first.json()["job_id"])
+
+        old_run = CrawlRun.objects.get(job_id=first.json()["job_id"])
+        self.assertEqual(old_run.status, CrawlRun.Status.FAILED)
+        new_run = CrawlRun.objects.get(job_id=second.json()["job_id"])
+        self.assertEqual(new_run.status, CrawlRun.Status.PENDING)
+
+        cancel_calls = [
+            call
+            for call in mock_post.call_args_list
+            if call.args[0].endswith("cancel.json")
+        ]
+        self.assertEqual(cancel_calls[0].kwargs["data"]["job"], first.json()["job_id"])
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_refresh_schedules_stored_product_urls(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        response = self.client.post(reverse("refresh") + "?numcas=12345")
+        self.wait()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        crawl_run = CrawlRun.objects.get(company_name="AstaTech")
+        self.assertEqual(crawl_run.kind, CrawlRun.Kind.REFRESH)
+        self.assertEqual(response.json()["jobs"][0]["job_id"], crawl_run.job_id)
+        self.assertEqual(
+            mock_post.call_args.kwargs["data"]["product_urls"],
+            "https://example.com/productA",
+        )
+
+        # A refresh doesn't block a full crawl.
+        response = self.launch()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_refresh_twice_returns_running_refresh(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        first = self.client.post(reverse("refresh") + "?numcas=12345")
+        self.wait()
+        second = self.client.post(reverse("refresh") + "?numcas=12345")
+        self.wait()
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+
+        (job,) = second.json()["jobs"]
+        self.assertFalse(job["launched"])
+        self.assertEqual(job["job_id"], first.json()["jobs"][0]["job_id"])
+        self.assertEqual(CrawlRun.objects.count(), 1)
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_refresh_of_other_pages_is_launched(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        first = self.client.post(reverse("refresh") + "?numcas=12345")
+        self.wait()
+        # A product was added to the CAS number since.
+        create_chemical(
+            company_name="AstaTech", product_url="https://example.com/productB"
+        )
+        second = self.client.post(reverse("refresh") + "?numcas=12345")
+        self.wait()
+        self.assertEqual(second.status_code, status.HTTP_202_ACCEPTED)
+
+        (job,) = second.json()["jobs"]
+        self.assertTrue(job["launched"])
+        self.assertNotEqual(job["job_id"], first.json()["jobs"][0]["job_id"])
+        crawl_run = CrawlRun.objects.get(pk=job["crawl_run_id"])
+        self.assertEqual(
+            crawl_run.spider_args["product_urls"],
+            "https://example.com/productA https://example.com/productB",
+        )
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_refresh_ignores_running_due_products_crawl(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        due = self.launch("?company_name=AstaTech&seed=due")
+        response = self.client.post(reverse("refresh") + "?numcas=12345")
+        self.wait()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        (job,) = response.json()["jobs"]
+        self.assertTrue(job["launched"])
+        self.assertNotEqual(job["job_id"], due.json()["job_id"])
+
+    def test_refresh_with_invalid_numcas(self):
+        response = self.client.post(reverse("refresh") + "?numcas=00000")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_run_seeded_spider(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        response = self.launch("?company_name=AstaTech&seed=db&discovery=never")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(mock_post.call_args.kwargs["data"]["seed"], "db")
+        self.assertEqual(mock_post.call_args.kwargs["data"]["discovery"], "never")
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_run_due_products_is_a_refresh(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        response = self.launch("?company_name=AstaTech&seed=due")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        crawl_run = CrawlRun.objects.get(pk=response.json()["crawl_run_id"])
+        self.assertEqual(crawl_run.kind, CrawlRun.Kind.REFRESH)
+
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_resume_failed_run(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        first = self.launch("?company_name=AstaTech&seed=db&discovery=never")
+        crawl_run = CrawlRun.objects.get(pk=first.json()["crawl_run_id"])
+        self.assertEqual(
+            mock_post.call_args.kwargs["data"]["setting"], f"JOBDIR=jobs/{crawl_run.pk}"
+        )
+        crawl_run.status = CrawlRun.Status.FAILED
+        crawl_run.save()
+
+        response = self.client.post(
+            reverse("run-resume") + "?job_id=" + first.json()["job_id"]
+        )
+        self.wait()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()["crawl_run_id"], crawl_run.pk)
+        self.assertNotEqual(response.json()["job_id"], first.json()["job_id"])
+
+        crawl_run.refresh_from_db()
+        self.assertEqual(crawl_run.status, CrawlRun.Status.PENDING)
+        data = mock_post.call_args.kwargs["data"]
+        self.assertEqual(data["jobid"], crawl_run.job_id)
+        self.assertEqual(data["setting"], f"JOBDIR=jobs/{crawl_run.pk}")
+        self.assertEqual(data["seed"], "db")
+        self.assertEqual(data["discovery"], "never")
+
+    @patch("scrapy_app.scrapyd.requests.get")
+    @patch("scrapy_app.scrapyd.requests.post")
+    def test_resume_running_or_superseded_run(self, mock_post, mock_get):
+        cache.clear()
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"status": "ok"}
+        first = self.launch()
+        mock_get.return_value.json.return_value = {
+            "running": [{"id": first.json()["job_id"]}]
+        }
+        resume_url = reverse("run-resume") + "?job_id=" + first.json()["job_id"]
+        self.assertEqual(
+            self.client.post(resume_url).status_code, status.HTTP_409_CONFLICT
+        )
+
+        self.launch("?company_name=AstaTech&force=1")
+        self.assertEqual(
+            self.client.post(resume_url).status_code, status.HTTP_409_CONFLICT
+        )
+
+    def test_resume_unknown_job(self):
+        response = self.client.post(reverse("run-resume") + "?job_id=unknown")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_run_spider_with_seed_file(self):
+        response = self.client.post(self.url + "?company_name=AstaTech&seed=/etc/x")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_run_spider_without_company_name(self):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()["error"], "No company name provided.")
+
+
+class CrawlStatusAPIViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse("run-status")
+        self.crawl_run = CrawlRun.objects.create(
+            company_name="AstaTech", job_id="job1", status=CrawlRun.Status.RUNNING
+        )
+
+    @patch("scrapy_app.scrapyd.requests.get")
+    def test_status_is_cached(self, mock_get):
+        mock_get.return_value.json.return_value = {
+            "running": [{"id": "job1"}],
+            "finished": [{"id": "job0"}],
+        }
+        for _ in range(3):
+            response = self.client.get(self.url, {"job_id": "job1"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["status"], CrawlRun.Status.RUNNING)
+        self.assertEqual(response.json()["job_status"], "running")
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch("scrapy_app.scrapyd.requests.get")
+    def test_finished_job_fails_unfinished_run(self, mock_get):
+        mock_get.return_value.json.return_value = {"finished": [{"id": "job1"}]}
+        response = self.client.get(self.url, {"job_id": "job1"})
+        self.assertEqual(response.json()["status"], CrawlRun.Status.FAILED)
+
+    @patch("scrapy_app.scrapyd.requests.get")
+    def test_unreachable_scrapyd(self, mock_get):
+        mock_get.side_effect = requests.ConnectionError()
+        with self.assertLogs("scrapy_app.scrapyd", "ERROR"):
+            response = self.client.get(self.url, {"job_id": "job1"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["job_status"], "unknown")
+
+    def test_unknown_job_id(self):
+        response = self.client.get(self.url, {"job_id": "nope"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ChemicalsGenerationTestCase(TestCase):
+    def setUp(self):
+        self.old_run = CrawlRun.objects.create(
+            company_name="Company A", status=CrawlRun.Status.FINISHED
+        )
+        self.new_run = CrawlRun.objects.create(
+            company_name="Company A", status=CrawlRun.Status.RUNNING
+        )
+        create_chemical(crawl_run=self.old_run)
+        create_chemical(
+            product_url="https://example.com/productB", crawl_run=self.new_run
+        )
+
+    def test_running_crawl_is_hidden(self):
+        current = Chemicals.objects.current()
+        self.assertEqual(
+            list(current.values_list("product_url", flat=True)),
+            ["https://example.com/productA"],
+        )
+
+    def test_finished_crawl_hides_older_generation(self):
+        self.new_run.status = CrawlRun.Status.FINISHED
+        self.new_run.save()
+
+        current = Chemicals.objects.current()
+        self.assertEqual(
+            list(current.values_list("product_url", flat=True)),
+            ["https://example.com/productB"],
+        )
+
+    def test_finished_refresh_keeps_active_generation(self):
+        CrawlRun.objects.create(
+            company_name="Company A",
+            kind=CrawlRun.Kind.REFRESH,
+            status=CrawlRun.Status.FINISHED,
+        )
+        current = Chemicals.objects.current()
+        self.assertEqual(
+            list(current.values_list("product_url", flat=True)),
+            ["https://example.com/productA"],
+        )
+
+    def test_full_crawls_cannot_overlap(self):
+        with self.assertRaises(IntegrityError):
+            CrawlRun.objects.create(
+                company_name="Company A", status=CrawlRun.Status.PENDING
+            )
+
+
+class ChemicalsCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse("chemicals-list")
+        self.run = CrawlRun.objects.create(
+            company_name="Company A", status=CrawlRun.Status.FINISHED
+        )
+        create_chemical(crawl_run=self.run)
+
+    def test_repeated_lookup_is_served_from_cache(self):
+        first = self.client.get(self.url, {"numcas": "12345"})
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url, {"numcas": "12345"})
+        self.assertEqual(first.json(), second.json())
+
+    @override_settings(CHEMICALS_CACHE_VERSION_TIMEOUT=0)
+    def test_finished_crawl_invalidates_cache(self):
+        response = self.client.get(self.url, {"numcas": "12345"})
+        self.assertEqual(len(response.json()["data"]), 1)
+
+        new_run = CrawlRun.objects.create(
+            company_name="Company A", status=CrawlRun.Status.RUNNING
+        )
+        create_chemical(product_url="https://example.com/productB", crawl_run=new_run)
+        response = self.client.get(self.url, {"numcas": "12345"})
+        self.assertEqual(len(response.json()["data"]), 1)
+
+        new_run.status = CrawlRun.Status.FINISHED
+        new_run.save()
+        response = self.client.get(self.url, {"numcas": "12345"})
+        self.assertEqual(
+            [row["product_url"] for row in response.json()["data"]],
+            ["https://example.com/productB"],
+        )
+
+
+class PostgreSQLPipelineTestCase(TransactionTestCase):
+    def setUp(self):
+        self.conn = psycopg2.connect(**connection.get_connection_params())
+        self.addCleanup(self.conn.close)
+        self.pipeline = PostgreSQLPipeline()
+
+    def get_row(self, pipeline, product_url="https://example.com/productA", price="10"):
+        return pipeline.get_row(
+            {
+                "datetime": timezone.now(),
+                "availability": True,
+                "company_name": "Company A",
+                "product_url": product_url,
+                "numcas": "12345",
+                "name": "Chemical A",
+                "qt_list": [1.0],
+                "unit_list": ["g"],
+                "currency_list": ["$"],
+                "price_pack_list": [price],
+            }
+        )
+
+    def write(self, crawl_run_id, kind="full", price="10"):
+        self.pipeline.crawl_run_id = crawl_run_id
+        self.pipeline.crawl_kind = kind
+        counts = self.pipeline.upsert_rows(
+            self.conn, [self.get_row(self.pipeline, price=price)]
+        )
+        self.conn.commit()
+        return counts
+
+    def test_crawl_started_without_the_api(self):
+        crawl_run_id = start_crawl_run(self.conn, "Company A")
+        crawl_run = CrawlRun.objects.get(pk=crawl_run_id)
+        self.assertEqual(crawl_run.status, CrawlRun.Status.RUNNING)
+        self.assertEqual(crawl_run.kind, CrawlRun.Kind.FULL)
+        self.assertIsNotNone(crawl_run.scheduled_at)
+
+    def partition_exists(self, crawl_run_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT to_regclass(%s)", [f"scrapy_app_chemicals_{crawl_run_id}"]
+            )
+            return cursor.fetchone()[0] is not None
+
+    def test_refresh_during_full_crawl_writes_active_generation(self):
+        full_run_id = start_crawl_run(self.conn, "Company A")
+        refresh_run_id = start_crawl_run(
+            self.conn,
+            "Company A",
+            kind="refresh",
+            product_urls=["https://example.com/productA"],
+        )
+        self.write(full_run_id)
+        # The refresh writes after the full crawl, but to the shown rows.
+        self.write(refresh_run_id, kind="refresh", price="20")
+
+        chemical = Chemicals.objects.current().get()
+        self.assertIsNone(chemical.crawl_run_id)
+        self.assertEqual(chemical.price_pack_list, ["20"])
+
+        self.assertEqual(finish_crawl_run(self.conn, full_run_id, "Company A", True), 0)
+        chemical = Chemicals.objects.get()
+        self.assertEqual(chemical.crawl_run_id, full_run_id)
+        self.assertEqual(chemical.price_pack_list, ["10"])
+        self.assertEqual(chemical.packs.get().crawl_run_id, full_run_id)
+
+    def test_unchanged_product_is_not_rewritten(self):
+        crawl_run_id = start_crawl_run(self.conn, "Company A")
+        self.assertEqual(self.write(crawl_run_id)["changed"], 1)
+        self.assertEqual(self.write(crawl_run_id)["unchanged"], 1)
+        self.assertEqual(ChemicalsHistory.objects.count(), 1)
+
+    def test_finished_crawl_drops_older_generation(self):
+        old_run_id = start_crawl_run(self.conn, "Company A")
+        self.write(old_run_id)
+        finish_crawl_run(self.conn, old_run_id, "Company A", True)
+        new_run_id = start_crawl_run(self.conn, "Company A")
+        self.assertTrue(self.partition_exists(new_run_id))
+        self.write(new_run_id, price="20")
+
+        self.assertEqual(Chemicals.objects.current().get().crawl_run_id, old_run_id)
+        finish_crawl_run(self.conn, new_run_id, "Company A", True)
+        self.assertFalse(self.partition_exists(old_run_id))
+        self.assertEqual(Chemicals.objects.get().crawl_run_id, new_run_id)
+        self.assertEqual(
+            PriceAggregate.objects.get(numcas="12345").min_price, Decimal("20")
+        )
+
+    def test_skipped_products_are_kept_in_new_generation(self):
+        old_run_id = start_crawl_run(self.conn, "Company A")
+        self.write(old_run_id)
+        finish_crawl_run(self.conn, old_run_id, "Company A", True)
+        new_run_id = start_crawl_run(self.conn, "Company A")
+        product_url = "https://example.com/productA"
+
+        self.assertEqual(
+            keep_products(self.conn, new_run_id, "Company A", [product_url]), 1
+        )
+        self.assertEqual(finish_crawl_run(self.conn, new_run_id, "Company A", True), 0)
+        chemical = Chemicals.objects.get()
+        self.assertEqual(chemical.crawl_run_id, new_run_id)
+        self.assertEqual(chemical.packs.get().price, Decimal("10"))
+
+    def test_concurrent_writers_of_a_cas_number(self):
+        other_conn = psycopg2.connect(**connection.get_connection_params())
+        self.addCleanup(other_conn.close)
+        other_pipeline = PostgreSQLPipeline()
+        self.pipeline.crawl_kind = other_pipeline.crawl_kind = "refresh"
+
+        self.pipeline.upsert_rows(self.conn, [self.get_row(self.pipeline)])
+
+        def write_other_product():
+            row = self.get_row(other_pipeline, "https://example.com/productB", "20")
+            other_pipeline.upsert_rows(other_conn, [row])
+            other_conn.commit()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            other_write = executor.submit(write_other_product)
+            # Commit once the other writer waits for the aggregates of 12345.
+            with connection.cursor() as cursor:
+                for _ in range(100):
+                    cursor.execute(
+                        "SELECT count(*) FROM pg_locks "
+                        "WHERE locktype = 'advisory' AND NOT granted"
+                    )
+                    if cursor.fetchone()[0] or other_write.done():
+                        break
+                    time.sleep(0.05)
+            self.conn.commit()
+            other_write.result()
+
+        aggregate = PriceAggregate.objects.get(numcas="12345")
+        self.assertEqual(aggregate.sample_count, 2)
+        self.assertEqual(aggregate.min_price, Decimal("10"))
+        self.assertEqual(aggregate.max_price, Decimal("20"))
@@ -4,5 +4,9 @@ from scrapy_app import views
 urlpatterns = [
     path("", views.ChemicalsListAPIView.as_view(), name="chemicals-list"),
     path("avg/", views.AveragePriceView.as_view(), name="average-price"),
+    path("batch/", views.ChemicalsBatchAPIView.as_view(), name="chemicals-batch"),
     path("run/", views.CompanySpiderAPIView.as_view(), name="run-campaign"),
+    path("run/status/", views.CrawlStatusAPIView.as_view(), name="run-status"),
+    path("run/resume/", views.ResumeAPIView.as_view(), name="run-resume"),
+    path("refresh/", views.RefreshAPIView.as_view(), name="refresh"),
 ]
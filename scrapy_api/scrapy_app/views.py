@@ -1,16 +1,22 @@
-import os
-
-from django.http import JsonResponse
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from rest_framework.views import APIView
-from .models import Chemicals
-from .serializers import ChemicalsSerializer
-import requests
-from django.db.models import Case, FloatField, F, Value, When
-from django.db.models.functions import Cast, Coalesce
-from django.db.models.aggregates import Avg
+from . import scrapyd
+from .cache import get_or_compute
+from .models import Chemicals, CrawlRun, Pack, PriceAggregate
+from .pagination import CURSOR_FIELDS, InvalidCursor, paginate
+from .serializers import chemicals_values, dumps, parse_fields
+
+# Spider crawling the products of each company.
+SPIDER_NAMES = {
+    "AstaTech": "astatechinc_com",
+}
 
+# Values of the discovery spider argument of seeded crawls.
+DISCOVERY_MODES = ("auto", "always", "never")
 
-SCRAPYD_HOST = os.environ.get('SCRAPYD_HOST')
 
 class ChemicalsListAPIView(APIView):
     """
@@ -21,6 +27,12 @@ class ChemicalsListAPIView(APIView):
         """
         Handle GET request to retrieve Chemicals based on CAS number.
 
+        Rows are returned newest product first, in pages of at most `limit` rows. The
+        `next` cursor of a page is passed as the `cursor` query parameter to get the
+        following one. With `stream=1` all rows are streamed in one response
+        instead. The optional `fields` query parameter is a comma separated list of
+        the fields to return. Pages are cached until the next crawl run finishes.
+
         Args:
             request: The GET request object.
 
@@ -32,15 +44,93 @@ class ChemicalsListAPIView(APIView):
         if not numcas:
             return JsonResponse({"error": "No CAS number provided."}, status=400)
 
-        queryset = Chemicals.objects.filter(numcas=numcas)
+        try:
+            fields = parse_fields(request.query_params.get("fields"))
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        if request.query_params.get("stream") in ("1", "true"):
+            return self.stream(numcas, fields)
+
+        try:
+            limit = int(request.query_params.get("limit", settings.CHEMICALS_PAGE_SIZE))
+        except ValueError:
+            return JsonResponse({"error": "Invalid limit."}, status=400)
+        limit = max(1, min(limit, settings.CHEMICALS_MAX_PAGE_SIZE))
+        cursor = request.query_params.get("cursor")
+
+        try:
+            body, status = get_or_compute(
+                "list",
+                (numcas, cursor, limit, fields),
+                lambda: self.get_body(numcas, cursor, limit, fields),
+            )
+        except InvalidCursor:
+            return JsonResponse({"error": "Invalid cursor."}, status=400)
+        return HttpResponse(body, status=status, content_type="application/json")
+
+    def get_body(self, numcas, cursor, limit, fields):
+        """
+        Query and encode one page of the Chemicals of a CAS number.
+
+        Args:
+            numcas (str): The CAS number.
+            cursor (str): Cursor of the page, or None for the first page.
+            limit (int): Maximum number of rows of the page.
+            fields (list): Fields to return.
+
+        Returns:
+            A tuple of the encoded response and its status code.
+
+        Raises:
+            InvalidCursor: If the cursor is malformed.
+        """
+        # The cursor is built from these fields, even if they aren't returned.
+        cursor_fields = [field for field in CURSOR_FIELDS if field not in fields]
+        queryset = chemicals_values(
+            Chemicals.objects.current().filter(numcas=numcas), fields + cursor_fields
+        )
+        rows, next_cursor = paginate(queryset, cursor, limit)
+
+        if not rows and not cursor:
+            return dumps({"error": "No data found for the given CAS number."}), 404
+
+        if cursor_fields:
+            rows = [{field: row[field] for field in fields} for row in rows]
+        return dumps({"data": rows, "next": next_cursor}), 200
+
+    def stream(self, numcas, fields):
+        """
+        Stream all Chemicals of a CAS number.
+
+        Rows are read from a server-side cursor and written to the response as they
+        are encoded, so memory use doesn't grow with the number of rows.
+
+        Args:
+            numcas (str): The CAS number.
+            fields (list): Fields to return.
+
+        Returns:
+            A streaming JSON response, or a JSON error response.
+        """
+        queryset = chemicals_values(
+            Chemicals.objects.current().filter(numcas=numcas).order_by(*CURSOR_FIELDS),
+            fields,
+        )
 
-        if not queryset:
+        if not queryset.exists():
             return JsonResponse(
                 {"error": "No data found for the given CAS number."}, status=404
             )
 
-        data = ChemicalsSerializer(queryset, many=True).data
-        return JsonResponse({"data": data})
+        def rows():
+            yield b'{"data": ['
+            chemicals = queryset.iterator(chunk_size=settings.CHEMICALS_PAGE_SIZE)
+            for n, chemical in enumerate(chemicals):
+                yield (b"," if n else b"") + dumps(chemical)
+            yield b"]}"
+
+        return StreamingHttpResponse(rows(), content_type="application/json")
 
 
 class AveragePriceView(APIView):
@@ -52,6 +142,11 @@ class AveragePriceView(APIView):
         """
         Handle GET request to calculate the average price of Chemicals based on CAS number.
 
+        The averages are read from the price aggregates the crawler refreshes, priced
+        per gram or per milliliter, in the currency given by the optional `currency`
+        query parameter ("$" by default). Responses are cached until the next crawl
+        run finishes.
+
         Args:
             request: The GET request object.
             cas_number (str): The CAS number of the Chemicals.
@@ -65,50 +160,128 @@ class AveragePriceView(APIView):
         if not numcas:
             return JsonResponse({"error": "No CAS number provided."}, status=400)
 
-        chemicals = Chemicals.objects.filter(numcas=numcas)
+        currency = request.query_params.get("currency", "$")
+        payload, status = get_or_compute(
+            "avg", (numcas, currency), lambda: self.get_payload(numcas, currency)
+        )
+        return JsonResponse(payload, status=status)
 
-        if not chemicals:
-            return JsonResponse(
-                {"error": "No data found for the given CAS number."}, status=404
-            )
+    def get_payload(self, numcas, currency):
+        """
+        Look up the average prices of a CAS number.
 
-        average_price_per_gram = (
-            chemicals.annotate(
-                price_per_gram=Case(
-                    When(
-                        unit_list__0="mg",
-                        then=Coalesce(
-                            Cast(F("price_pack_list__0"), FloatField()), Value(0.0)
-                        )
-                        / (
-                            Coalesce(Cast(F("qt_list__0"), FloatField()), Value(1.0))
-                            * 0.001
-                        ),
-                    ),
-                    When(
-                        unit_list__0="kg",
-                        then=Coalesce(
-                            Cast(F("price_pack_list__0"), FloatField()), Value(0.0)
-                        )
-                        / (
-                            Coalesce(Cast(F("qt_list__0"), FloatField()), Value(1.0))
-                            * 1000
-                        ),
-                    ),
-                    default=Coalesce(
-                        Cast(F("price_pack_list__0"), FloatField()), Value(0.0)
-                    )
-                    / Coalesce(Cast(F("qt_list__0"), FloatField()), Value(1.0)),
-                    output_field=FloatField(),
-                )
+        Args:
+            numcas (str): The CAS number.
+            currency (str): The currency of the prices.
+
+        Returns:
+            A tuple of the response data and its status code.
+        """
+        averages = dict(
+            PriceAggregate.objects.filter(numcas=numcas, currency=currency).values_list(
+                "unit_family", "average_price"
             )
-            .filter(currency_list__0="$")
-            .aggregate(average_price=Avg("price_per_gram"))
         )
 
-        average_price = average_price_per_gram["average_price"]
+        # Only unknown CAS numbers fall through to the chemicals table.
+        if (
+            not averages
+            and not Chemicals.objects.current().filter(numcas=numcas).exists()
+        ):
+            return {"error": "No data found for the given CAS number."}, 404
 
-        return JsonResponse({"average_price_g": average_price})
+        return {
+            "average_price_g": float(averages.get(Pack.UnitFamily.GRAM, 0.0)),
+            "average_price_ml": float(averages.get(Pack.UnitFamily.MILLILITER, 0.0)),
+        }, 200
+
+
+class ChemicalsBatchAPIView(APIView):
+    """
+    API view for looking up the Chemicals and average prices of many CAS numbers.
+    """
+
+    def post(self, request):
+        """
+        Handle POST request to look up a list of CAS numbers at once.
+
+        The JSON body has a `numcas` list of at most CHEMICALS_BATCH_MAX_SIZE CAS
+        numbers, an optional `include` list of "rows" and/or "avg" (both by
+        default) and an optional `currency` of the average prices ("$" by
+        default). The rows of all CAS numbers are read with one query and their
+        average prices with another.
+
+        Args:
+            request: The POST request object.
+
+        Returns:
+            A JSON response with the results per CAS number and the list of CAS
+            numbers without data, or an error message.
+        """
+        numcas_list = request.data.get("numcas")
+
+        if not numcas_list:
+            return JsonResponse({"error": "No CAS number provided."}, status=400)
+        if not isinstance(numcas_list, list) or not all(
+            isinstance(numcas, str) for numcas in numcas_list
+        ):
+            return JsonResponse(
+                {"error": "numcas must be a list of CAS numbers."}, status=400
+            )
+        if len(numcas_list) > settings.CHEMICALS_BATCH_MAX_SIZE:
+            return JsonResponse(
+                {
+                    "error": "Too many CAS numbers, the maximum is "
+                    f"{settings.CHEMICALS_BATCH_MAX_SIZE}."
+                },
+                status=400,
+            )
+
+        include = request.data.get("include", ["rows", "avg"])
+        currency = request.data.get("currency", "$")
+        results = {numcas: {} for numcas in numcas_list}
+        found = set()
+
+        if "rows" in include:
+            for numcas in results:
+                results[numcas]["data"] = []
+            chemicals = (
+                Chemicals.objects.current()
+                .filter(numcas__in=results)
+                .order_by("numcas", *CURSOR_FIELDS)
+            )
+            for row in chemicals_values(chemicals):
+                results[row["numcas"]]["data"].append(row)
+                found.add(row["numcas"])
+
+        if "avg" in include:
+            for numcas in results:
+                results[numcas]["average_price_g"] = 0.0
+                results[numcas]["average_price_ml"] = 0.0
+            aggregates = PriceAggregate.objects.filter(
+                numcas__in=results, currency=currency
+            ).values_list("numcas", "unit_family", "average_price")
+            for numcas, unit_family, average_price in aggregates:
+                results[numcas][f"average_price_{unit_family}"] = float(average_price)
+                found.add(numcas)
+
+            # Only CAS numbers without rows or aggregates need this query.
+            unknown = set(results) - found
+            if unknown and "rows" not in include:
+                found.update(
+                    Chemicals.objects.current()
+                    .filter(numcas__in=unknown)
+                    .values_list("numcas", flat=True)
+                    .distinct()
+                )
+
+        missing = [numcas for numcas in results if numcas not in found]
+        for numcas in missing:
+            del results[numcas]
+        return HttpResponse(
+            dumps({"results": results, "missing": missing}),
+            content_type="application/json",
+        )
 
 
 class CompanySpiderAPIView(APIView):
@@ -120,37 +293,331 @@ class CompanySpiderAPIView(APIView):
         """
         Handle POST request to launch a spider for a specific company and collect products.
 
+        The crawl writes a new generation of the company's rows. The rows of the
+        previous generation stay visible until the crawl has finished. The launch
+        is sent to scrapyd in the background, the response only waits for the
+        crawl run to be recorded.
+
+        A company is crawled by one job at a time: while a full or `seed=due` crawl
+        of the company is pending or running, the job id of that crawl is returned
+        instead. Refreshes of given product pages don't count. A crawl whose launch
+        never reached scrapyd stops blocking new ones after SCRAPYD_LAUNCH_TIMEOUT
+        seconds. With `force=1` the running crawl is cancelled and a new one
+        launched.
+
+        With `seed=db` the crawl starts from the stored product pages instead of
+        the homepage, and the optional `discovery` parameter ("auto", "always" or
+        "never") decides whether the catalog is walked as well. With `seed=due`
+        only the products due for a recrawl are fetched, in a refresh run.
+
         Args:
             request: The POST request object.
 
         Returns:
-            A JSON response indicating the success or failure of the spider launch.
+            A JSON response with the job id of the crawl, or an error message.
         """
         company_name = request.query_params.get("company_name")
 
         if not company_name:
             return JsonResponse({"error": "No company name provided."}, status=400)
 
-        company_names = {
-            "AstaTech": "astatechinc_com",
-        }
+        spider_name = SPIDER_NAMES[company_name]
+        force = request.query_params.get("force") in ("1", "true")
 
-        Chemicals.objects.filter(company_name=company_name).delete()
+        scrapyd.fail_lost_runs()
 
-        spider_url = f"http://{SCRAPYD_HOST}:6800/schedule.json"
-        data = {
-            "project": "chemicals",
-            "spider": company_names[company_name],
-        }
-        response = requests.post(spider_url, data=data)
+        spider_args = {}
+        kind = CrawlRun.Kind.FULL
+        seed = request.query_params.get("seed")
+        if seed:
+            discovery = request.query_params.get("discovery", "auto")
+            if seed not in ("db", "due") or discovery not in DISCOVERY_MODES:
+                return JsonResponse({"error": "Invalid seed options."}, status=400)
+            spider_args = {"seed": seed, "discovery": discovery}
+            if seed == "due":
+                kind = CrawlRun.Kind.REFRESH
 
-        if response.status_code == 200:
+        crawl_run = CrawlRun(
+            company_name=company_name, kind=kind, spider_args=spider_args
+        )
+        try:
+            with transaction.atomic():
+                if force:
+                    self.cancel_active_runs(company_name)
+                crawl_run.job_id = scrapyd.new_job_id()
+                crawl_run.save()
+                scrapyd.schedule(crawl_run, spider_name)
+        except IntegrityError:
+            # Another request launched a crawl of this company first.
+            active_run = (
+                crawl_run.same_slot()
+                .filter(status__in=CrawlRun.ACTIVE_STATUSES)
+                .first()
+            )
+            if active_run is None:
+                return JsonResponse(
+                    {"error": "A crawl has just finished, please retry."}, status=409
+                )
             return JsonResponse(
                 {
-                    "success": "Spider for company {} has been launched.".format(
+                    "success": "Spider for company {} is already running.".format(
                         company_name
-                    )
+                    ),
+                    "job_id": active_run.job_id,
+                    "crawl_run_id": active_run.pk,
                 }
             )
-        else:
-            return JsonResponse({"error": "Failed to launch spider."}, status=500)
+
+        return JsonResponse(
+            {
+                "success": "Spider for company {} has been launched.".format(
+                    company_name
+                ),
+                "job_id": crawl_run.job_id,
+                "crawl_run_id": crawl_run.pk,
+            },
+            status=202,
+        )
+
+    def cancel_active_runs(self, company_name):
+        """
+        Mark the pending or running full and `seed=due` crawl runs of a company as
+        failed and cancel their jobs.
+
+        Args:
+            company_name (str): Name of the company.
+        """
+        active_runs = (
+            CrawlRun.objects.select_for_update()
+            .filter(company_name=company_name, status__in=CrawlRun.ACTIVE_STATUSES)
+            .exclude(CrawlRun.TARGETED)
+        )
+        for active_run in active_runs:
+            active_run.status = CrawlRun.Status.FAILED
+            active_run.save(update_fields=["status"])
+            if active_run.job_id:
+                scrapyd.cancel(active_run.job_id)
+
+
+class ResumeAPIView(APIView):
+    """
+    API view for resuming a stopped crawl.
+    """
+
+    def post(self, request):
+        """
+        Handle POST request to resume the crawl of a job that stopped before the
+        crawl finished.
+
+        The crawl run is launched again in a new job, with the same spider
+        arguments and job directory, so it continues from the requests queued
+        when it stopped and its rows are completed. A crawl run can't be resumed
+        once a crawl that can't run at the same time was launched after it.
+
+        Only a job that stopped gracefully, e.g. cancelled once, resumes without
+        gaps: it finishes its in-flight requests and saves the spider state before
+        it exits. A job that was killed loses the requests it was processing, and
+        as their fingerprints are already in the job's dupefilter, the resumed
+        crawl skips their pages, and any page only they linked to. Launch a new
+        crawl instead to get every product of such a run.
+
+        Args:
+            request: The POST request object.
+
+        Returns:
+            A JSON response with the job id of the resumed crawl, or an error
+            message.
+        """
+        job_id = request.query_params.get("job_id")
+
+        if not job_id:
+            return JsonResponse({"error": "No job id provided."}, status=400)
+
+        crawl_run = CrawlRun.objects.filter(job_id=job_id).first()
+
+        if crawl_run is None:
+            return JsonResponse(
+                {"error": "No crawl found for the given job id."}, status=404
+            )
+
+        if crawl_run.status == CrawlRun.Status.FINISHED:
+            return JsonResponse({"error": "The crawl has finished."}, status=409)
+
+        if crawl_run.status in CrawlRun.ACTIVE_STATUSES:
+            jobs = scrapyd.list_jobs()
+            if jobs is None or jobs.get(job_id) in ("pending", "running"):
+                return JsonResponse(
+                    {"error": "The crawl is still running."}, status=409
+                )
+
+        if crawl_run.same_slot().filter(pk__gt=crawl_run.pk).exists():
+            return JsonResponse(
+                {"error": "A newer crawl of the company was launched."}, status=409
+            )
+
+        scrapyd.fail_lost_runs()
+        try:
+            with transaction.atomic():
+                crawl_run.status = CrawlRun.Status.PENDING
+                crawl_run.job_id = scrapyd.new_job_id()
+                crawl_run.scheduled_at = timezone.now()
+                crawl_run.save(update_fields=["status", "job_id", "scheduled_at"])
+                scrapyd.schedule(crawl_run, SPIDER_NAMES[crawl_run.company_name])
+        except IntegrityError:
+            return JsonResponse(
+                {"error": "Another crawl of the company is running."}, status=409
+            )
+
+        return JsonResponse(
+            {
+                "success": "Crawl run {} has been resumed.".format(crawl_run.pk),
+                "job_id": crawl_run.job_id,
+                "crawl_run_id": crawl_run.pk,
+            },
+            status=202,
+        )
+
+
+class RefreshAPIView(APIView):
+    """
+    API view for re-crawling the products of a CAS number.
+    """
+
+    def post(self, request):
+        """
+        Handle POST request to refresh the stored products of a CAS number.
+
+        The product pages of the CAS number are re-crawled by a refresh run of
+        each company's spider, which skips the catalog. A refresh takes seconds
+        and updates the rows in place, the job ids can be polled on the status
+        endpoint.
+
+        A refresh doesn't wait for other crawls of the company. While a refresh of
+        the same product pages is pending or running, the job id of that refresh
+        is returned for the company instead, with `launched` set to false. A
+        refresh of other pages, e.g. after a product was added to the CAS number,
+        is launched next to it.
+
+        Args:
+            request: The POST request object.
+
+        Returns:
+            A JSON response with the job ids of the refresh, or an error message.
+        """
+        numcas = request.query_params.get("numcas")
+
+        if not numcas:
+            return JsonResponse({"error": "No CAS number provided."}, status=400)
+
+        product_urls = {}
+        for company_name, product_url in (
+            Chemicals.objects.current()
+            .filter(numcas=numcas, company_name__in=SPIDER_NAMES)
+            .order_by("company_name", "product_url")
+            .values_list("company_name", "product_url")
+        ):
+            product_urls.setdefault(company_name, []).append(product_url)
+
+        if not product_urls:
+            return JsonResponse(
+                {"error": "No data found for the given CAS number."}, status=404
+            )
+
+        scrapyd.fail_lost_runs()
+        jobs = []
+        with transaction.atomic():
+            for company_name, urls in product_urls.items():
+                launched = True
+                crawl_run = CrawlRun(
+                    company_name=company_name,
+                    kind=CrawlRun.Kind.REFRESH,
+                    spider_args={"product_urls": " ".join(urls)},
+                )
+                try:
+                    with transaction.atomic():
+                        crawl_run.job_id = scrapyd.new_job_id()
+                        crawl_run.save()
+                        scrapyd.schedule(crawl_run, SPIDER_NAMES[company_name])
+                except IntegrityError:
+                    # A refresh of the same pages is pending or running.
+                    launched = False
+                    crawl_run = (
+                        crawl_run.same_slot()
+                        .filter(status__in=CrawlRun.ACTIVE_STATUSES)
+                        .first()
+                    )
+                    if crawl_run is None:
+                        transaction.set_rollback(True)
+                        return JsonResponse(
+                            {"error": "A refresh has just finished, please retry."},
+                            status=409,
+                        )
+                jobs.append(
+                    {
+                        "company_name": company_name,
+                        "job_id": crawl_run.job_id,
+                        "crawl_run_id": crawl_run.pk,
+                        "launched": launched,
+                    }
+                )
+
+        return JsonResponse(
+            {"jobs": jobs},
+            status=202 if any(job["launched"] for job in jobs) else 200,
+        )
+
+
+class CrawlStatusAPIView(APIView):
+    """
+    API view for checking the status of a launched spider.
+    """
+
+    def get(self, request):
+        """
+        Handle GET request to get the status of a crawl by its job id.
+
+        The crawl run status is read from the database, the job state from
+        scrapyd's cached job list. A job scrapyd finished while its crawl run is
+        still pending or running ended without finishing the run, so the run is
+        marked as failed, as are pending runs whose launch was lost.
+
+        Args:
+            request: The GET request object.
+
+        Returns:
+            A JSON response with the crawl run and job status, or an error message.
+        """
+        job_id = request.query_params.get("job_id")
+
+        if not job_id:
+            return JsonResponse({"error": "No job id provided."}, status=400)
+
+        scrapyd.fail_lost_runs()
+        crawl_run = CrawlRun.objects.filter(job_id=job_id).first()
+
+        if crawl_run is None:
+            return JsonResponse(
+                {"error": "No crawl found for the given job id."}, status=404
+            )
+
+        jobs = scrapyd.list_jobs()
+        job_status = "unknown" if jobs is None else jobs.get(job_id, "unknown")
+
+        if job_status == "finished" and crawl_run.status in (
+            CrawlRun.Status.PENDING,
+            CrawlRun.Status.RUNNING,
+        ):
+            crawl_run.status = CrawlRun.Status.FAILED
+            crawl_run.save(update_fields=["status"])
+
+        return JsonResponse(
+            {
+                "job_id": job_id,
+                "crawl_run_id": crawl_run.pk,
+                "company_name": crawl_run.company_name,
+                "status": crawl_run.status,
+                "job_status": job_status,
+                "started_at": crawl_run.started_at,
+                "finished_at": crawl_run.finished_at,
+            }
+        )